@@ -3,14 +3,14 @@
 from datetime import datetime, timedelta
 from typing import Optional, Union, Dict, Any
 import jwt
-from fastapi import HTTPException, Depends, status, Request
+from fastapi import HTTPException, Depends, status, Request, WebSocket
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
 import secrets
+import base64
 import os
 import logging
-import time
-from collections import defaultdict
 from backend.config import settings, User, TokenData
+from backend.shared_state import shared_state
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -26,8 +26,11 @@ security_bearer = HTTPBearer()
 # Защита от brute-force
 MAX_FAILED_ATTEMPTS = 5  # Максимальное количество неудачных попыток
 LOCKOUT_TIME = 300  # Время блокировки в секундах (5 минут)
-failed_login_attempts = defaultdict(list)  # username -> [timestamp1, timestamp2, ...]
-ip_login_attempts = defaultdict(list)  # ip -> [timestamp1, timestamp2, ...]
+# Счетчики неудачных попыток хранятся в общем хранилище (backend.shared_state),
+# поэтому блокировка действует во всех воркерах и на всех узлах.
+# Окно блокировки отсчитывается от первой неудачной попытки.
+_USER_ATTEMPTS_KEY = "auth:user:{}"
+_IP_ATTEMPTS_KEY = "auth:ip:{}"
 
 # Пользователи для базовой аутентификации
 USERS = {
@@ -49,48 +52,61 @@ USERS = {
     }
 }
 
-def is_account_locked(username: str) -> bool:
-    """Проверяет, заблокирован ли аккаунт из-за большого количества неудачных попыток."""
-    now = time.time()
-    # Очищаем старые попытки
-    failed_login_attempts[username] = [t for t in failed_login_attempts[username] 
-                                     if now - t < LOCKOUT_TIME]
-    
-    # Проверяем количество неудачных попыток
-    if len(failed_login_attempts[username]) >= MAX_FAILED_ATTEMPTS:
-        # Вычисляем, сколько времени осталось до разблокировки
-        time_passed = now - failed_login_attempts[username][0]
-        time_left = LOCKOUT_TIME - time_passed
+async def get_lockout(username: str, ip_address: Optional[str] = None) -> Optional[str]:
+    """
+    Проверяет блокировку аккаунта и IP-адреса одним обращением к хранилищу.
+    Возвращает "account", "ip" или None.
+    """
+    ops = [("get", _USER_ATTEMPTS_KEY.format(username), 0, 0)]
+    if ip_address:
+        ops.append(("get", _IP_ATTEMPTS_KEY.format(ip_address), 0, 0))
+    try:
+        results = await shared_state.batch(ops)
+    except Exception as e:
+        # Недоступность хранилища не должна блокировать вход всем пользователям
+        logger.error(f"Не удалось проверить блокировку входа ({shared_state.name}): {e}")
+        return None
+
+    attempts, time_left = results[0]
+    if attempts >= MAX_FAILED_ATTEMPTS:
         logger.warning(f"Аккаунт {username} заблокирован на {time_left:.1f} секунд после {MAX_FAILED_ATTEMPTS} неудачных попыток")
-        return True
-    
-    return False
+        return "account"
+    if ip_address:
+        attempts, time_left = results[1]
+        if attempts >= MAX_FAILED_ATTEMPTS * 2:  # Умножаем на 2 для IP (более мягкая политика)
+            logger.warning(f"IP {ip_address} заблокирован на {time_left:.1f} секунд после множества неудачных попыток")
+            return "ip"
+    return None
+
+async def is_account_locked(username: str) -> bool:
+    """Проверяет, заблокирован ли аккаунт из-за большого количества неудачных попыток."""
+    return await get_lockout(username) == "account"
 
-def is_ip_blocked(ip_address: str) -> bool:
+async def is_ip_blocked(ip_address: str) -> bool:
     """Проверяет, заблокирован ли IP-адрес из-за большого количества неудачных попыток."""
-    now = time.time()
-    # Очищаем старые попытки
-    ip_login_attempts[ip_address] = [t for t in ip_login_attempts[ip_address] 
-                                   if now - t < LOCKOUT_TIME]
-    
-    # Проверяем количество неудачных попыток
-    if len(ip_login_attempts[ip_address]) >= MAX_FAILED_ATTEMPTS * 2:  # Умножаем на 2 для IP (более мягкая политика)
-        time_passed = now - ip_login_attempts[ip_address][0]
-        time_left = LOCKOUT_TIME - time_passed
+    try:
+        attempts, time_left = await shared_state.get(_IP_ATTEMPTS_KEY.format(ip_address))
+    except Exception as e:
+        logger.error(f"Не удалось проверить блокировку IP ({shared_state.name}): {e}")
+        return False
+    if attempts >= MAX_FAILED_ATTEMPTS * 2:
         logger.warning(f"IP {ip_address} заблокирован на {time_left:.1f} секунд после множества неудачных попыток")
         return True
-    
     return False
 
-def record_failed_attempt(username: str, ip_address: Optional[str] = None):
+async def record_failed_attempt(username: str, ip_address: Optional[str] = None):
     """Записывает неудачную попытку входа."""
-    now = time.time()
-    failed_login_attempts[username].append(now)
+    ops = [("incr", _USER_ATTEMPTS_KEY.format(username), 1, LOCKOUT_TIME)]
     if ip_address:
-        ip_login_attempts[ip_address].append(now)
+        ops.append(("incr", _IP_ATTEMPTS_KEY.format(ip_address), 1, LOCKOUT_TIME))
+    try:
+        results = await shared_state.batch(ops)
+    except Exception as e:
+        logger.error(f"Не удалось записать неудачную попытку входа ({shared_state.name}): {e}")
+        return
     
     # Логируем попытки
-    attempt_count = len(failed_login_attempts[username])
+    attempt_count = results[0][0]
     logger.warning(f"Неудачная попытка входа для пользователя {username} (попытка {attempt_count}/{MAX_FAILED_ATTEMPTS})")
     
     if attempt_count >= MAX_FAILED_ATTEMPTS:
@@ -110,25 +126,21 @@ def get_user(username: str) -> Optional[Dict[str, Any]]:
         return user_dict
     return None
 
-def authenticate_user(username: str, password: str, ip_address: Optional[str] = None) -> Optional[Dict[str, Any]]:
+async def authenticate_user(username: str, password: str, ip_address: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """Аутентифицирует пользователя и возвращает его данные."""
-    # Проверяем блокировку аккаунта
-    if is_account_locked(username):
-        return None
-    
-    # Проверяем блокировку IP
-    if ip_address and is_ip_blocked(ip_address):
+    # Проверяем блокировку аккаунта и IP
+    if await get_lockout(username, ip_address):
         return None
     
     user = get_user(username)
     if not user:
         # Записываем неудачную попытку для несуществующего пользователя
-        record_failed_attempt(username, ip_address)
+        await record_failed_attempt(username, ip_address)
         return None
         
     if not verify_password(password, username):
         # Записываем неудачную попытку
-        record_failed_attempt(username, ip_address)
+        await record_failed_attempt(username, ip_address)
         return None
         
     return user
@@ -167,18 +179,18 @@ async def get_current_user_basic(credentials: HTTPBasicCredentials = Depends(sec
     if request:
         ip_address = request.client.host
     
-    user = authenticate_user(credentials.username, credentials.password, ip_address)
+    user = await authenticate_user(credentials.username, credentials.password, ip_address)
     if not user:
-        # Проверяем, заблокирован ли аккаунт
-        if is_account_locked(credentials.username):
+        # Проверяем, заблокирован ли аккаунт или IP
+        lockout = await get_lockout(credentials.username, ip_address)
+        if lockout == "account":
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Слишком много неудачных попыток входа. Пожалуйста, попробуйте позже.",
                 headers={"WWW-Authenticate": "Basic", "Retry-After": str(LOCKOUT_TIME)},
             )
         
-        # Проверяем, заблокирован ли IP
-        if ip_address and is_ip_blocked(ip_address):
+        if lockout == "ip":
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Слишком много неудачных попыток входа с вашего IP. Пожалуйста, попробуйте позже.",
@@ -227,6 +239,31 @@ async def get_admin_user(
         )
     return user
 
+async def authenticate_websocket(websocket: WebSocket) -> Optional[User]:
+    """
+    Аутентификация WebSocket-соединения.
+    Браузер не позволяет задать заголовки для WebSocket, поэтому кроме заголовка
+    Authorization (Basic или Bearer) принимается JWT в параметре запроса 'token'.
+    """
+    auth_header = websocket.headers.get("authorization", "")
+    scheme, _, value = auth_header.partition(" ")
+    ip_address = websocket.client.host if websocket.client else None
+
+    if scheme.lower() == "basic" and value:
+        try:
+            username, _, password = base64.b64decode(value).decode("utf-8").partition(":")
+        except (ValueError, UnicodeDecodeError):
+            return None
+        user = await authenticate_user(username, password, ip_address)
+        return User(username=user["username"], is_admin=user["is_admin"]) if user else None
+
+    token = value if scheme.lower() == "bearer" and value else websocket.query_params.get("token")
+    if token:
+        token_data = decode_token(token)
+        if token_data:
+            return User(username=token_data.username, is_admin=token_data.is_admin)
+    return None
+
 # Функция для создания основных пользователей
 def create_default_users():
     """Создает пользователей по умолчанию при первом запуске."""
@@ -0,0 +1,256 @@
+# backend/cache_store.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Доля от лимита, до которой сжимается файл при превышении размера
+_COMPACT_TARGET_RATIO = 0.8
+
+
+class ResponseCacheStore:
+    """
+    Персистентный уровень кеша ответов: key-value файл SQLite рядом с основной БД.
+    Значения хранятся в виде JSON, сжатого zlib. Файл переживает перезапуски и
+    общий для всех воркеров uvicorn (WAL + busy_timeout).
+
+    Все обращения к SQLite выполняются в потоках (asyncio.to_thread), запись
+    буферизуется и сбрасывается фоновой задачей пачками, поэтому не попадает
+    в путь обработки запроса.
+    """
+
+    def __init__(self, path: str, ttl: int, max_bytes: int, flush_interval: float = 1.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # одно соединение используется из разных потоков
+        self._pending: Dict[str, Tuple[str, bytes, float]] = {}  # key -> (model_id, blob, expires_at)
+        self._pending_deletes: List[Optional[str]] = []  # префиксы для удаления (None - все)
+        # Время последнего обращения к записям, прочитанным с диска: пишется пачкой вместе с очередью
+        self._pending_access: Dict[str, float] = {}  # key -> last_access
+        self._wakeup = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.write_errors = 0
+
+    # --- Синхронная часть (выполняется в потоках) ---
+
+    def _open_sync(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        # auto_vacuum действует только для нового файла: позволяет возвращать место после сжатия
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY,"
+            " model_id TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_model ON response_cache (model_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_expires ON response_cache (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_access ON response_cache (last_access)")
+        conn.commit()
+        self._conn = conn
+
+    def _get_sync(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_sync(self, items: List[Tuple[str, str, bytes, float]], deletes: List[Optional[str]],
+                    accesses: List[Tuple[float, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            for prefix in deletes:
+                if prefix is None:
+                    self._conn.execute("DELETE FROM response_cache")
+                else:
+                    provider_prefix = prefix if prefix.endswith("/") else f"{prefix}/"
+                    self._conn.execute(
+                        "DELETE FROM response_cache WHERE model_id = ? OR substr(model_id, 1, ?) = ?",
+                        (prefix, len(provider_prefix), provider_prefix)
+                    )
+            if items:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO response_cache (key, model_id, value, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, model_id, blob, len(blob), expires_at, now) for key, model_id, blob, expires_at in items]
+                )
+            if accesses:
+                # Время последнего обращения нужно для вытеснения при сжатии файла
+                self._conn.executemany("UPDATE response_cache SET last_access = ? WHERE key = ?", accesses)
+            self._conn.commit()
+
+    def _compact_sync(self) -> Tuple[int, int]:
+        """Удаляет истекшие записи и, если файл превышает лимит, самые давно используемые."""
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                excess = total - int(self.max_bytes * _COMPACT_TARGET_RATIO)
+                # Находим границу last_access, до которой нужно удалить записи
+                cursor = self._conn.execute("SELECT key, size FROM response_cache ORDER BY last_access")
+                keys = []
+                for key, size in cursor:
+                    keys.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self._conn.executemany("DELETE FROM response_cache WHERE key = ?", keys)
+                evicted = len(keys)
+            self._conn.commit()
+            if expired or evicted:
+                # Возвращаем освободившиеся страницы, чтобы файл не рос бесконечно
+                self._conn.execute("PRAGMA incremental_vacuum").fetchall()
+        return expired, evicted
+
+    def _stats_sync(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+            ).fetchone()
+
+    def _close_sync(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- Асинхронный интерфейс ---
+
+    async def open(self) -> None:
+        """Открывает файл кеша и запускает фоновую запись."""
+        await asyncio.to_thread(self._open_sync)
+        self._writer_task = asyncio.create_task(self._writer_loop(), name="response_cache_store_writer")
+        logger.info(f"Персистентный кеш ответов: {self.path} (лимит {self.max_bytes // (1024 * 1024)} МБ)")
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Читает значение с диска. Незаписанные изменения учитываются в первую очередь."""
+        if self._conn is None:
+            return None
+        pending = self._pending.get(key)
+        if pending is not None:
+            blob = pending[1]
+        else:
+            try:
+                blob = await asyncio.to_thread(self._get_sync, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения персистентного кеша: {e}")
+                return None
+        if blob is None:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        if pending is None:
+            # Чтение не порождает отдельной транзакции: время обращения запишет фоновая задача
+            self._pending_access[key] = time.time()
+            self._wakeup.set()
+        return json.loads(zlib.decompress(blob))
+
+    def schedule_set(self, key: str, model_id: str, data: Dict[str, Any]) -> None:
+        """Ставит значение в очередь на запись. Не блокирует вызывающий код."""
+        if self._conn is None:
+            return
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        self._pending[key] = (model_id, blob, time.time() + self.ttl)
+        self._wakeup.set()
+
+    def schedule_clear(self, prefix: Optional[str] = None) -> None:
+        """Ставит в очередь удаление всех записей или записей модели/провайдера."""
+        if self._conn is None:
+            return
+        if prefix is None:
+            self._pending.clear()
+        else:
+            provider_prefix = prefix if prefix.endswith("/") else f"{prefix}/"
+            for key in [k for k, (m, _, _) in self._pending.items() if m == prefix or m.startswith(provider_prefix)]:
+                del self._pending[key]
+        self._pending_deletes.append(prefix)
+        self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные изменения на диск."""
+        if self._conn is None or (not self._pending and not self._pending_deletes and not self._pending_access):
+            return
+        items = [(key, model_id, blob, expires_at) for key, (model_id, blob, expires_at) in self._pending.items()]
+        deletes = self._pending_deletes
+        accesses = [(last_access, key) for key, last_access in self._pending_access.items()]
+        self._pending = {}
+        self._pending_deletes = []
+        self._pending_access = {}
+        try:
+            await asyncio.to_thread(self._write_sync, items, deletes, accesses)
+        except sqlite3.Error as e:
+            self.write_errors += 1
+            logger.warning(f"Не удалось записать {len(items)} ответов в персистентный кеш: {e}")
+
+    async def _writer_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Небольшая задержка позволяет объединить записи в одну транзакцию
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def compact(self) -> None:
+        """Удаляет истекшие записи и ужимает файл до лимита размера."""
+        if self._conn is None:
+            return
+        try:
+            expired, evicted = await asyncio.to_thread(self._compact_sync)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка сжатия персистентного кеша: {e}")
+            return
+        if expired or evicted:
+            logger.debug(f"Персистентный кеш: удалено истекших {expired}, вытеснено {evicted}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику дискового уровня."""
+        entries, size = await asyncio.to_thread(self._stats_sync) if self._conn is not None else (0, 0)
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "pending_writes": len(self._pending),
+            "pending_access_updates": len(self._pending_access),
+            "hits": self.disk_hits,
+            "misses": self.disk_misses,
+            "write_errors": self.write_errors,
+        }
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись, сбрасывает очередь и закрывает файл."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        await self.flush()
+        await asyncio.to_thread(self._close_sync)
@@ -47,6 +47,14 @@ class Settings(BaseSettings):
         description="URL для подключения к базе данных SQLAlchemy (асинхронный драйвер)."
     )
 
+    # Профиль SQLite (применяется только для sqlite:// в файле)
+    sqlite_tuning_enabled: bool = Field(default=True, description="Применять профиль SQLite: WAL, отдельное соединение для записи и пул соединений для чтения")
+    sqlite_busy_timeout_ms: int = Field(default=5000, ge=0, description="Сколько ждать снятия блокировки БД другим процессом (мс)")
+    sqlite_mmap_size_mb: int = Field(default=256, ge=0, description="Размер отображаемой в память части файла БД (МБ, 0 - отключить mmap)")
+    sqlite_cache_size_mb: int = Field(default=64, ge=1, description="Размер кеша страниц SQLite на соединение (МБ)")
+    sqlite_read_pool_size: int = Field(default=4, ge=1, description="Количество постоянных соединений только для чтения (сверх них открываются временные)")
+    sqlite_write_queue_timeout: float = Field(default=30.0, gt=0, description="Максимальное ожидание очереди к соединению записи в секундах")
+
     # Настройки сервера
     host: str = Field(default="0.0.0.0", description="Хост для запуска API сервера")
     port: int = Field(default=8000, description="Порт для запуска API сервера")
@@ -111,10 +119,75 @@ class Settings(BaseSettings):
     
     # Настройки кеширования
     models_cache_ttl: int = Field(default=3600, description="Время жизни кеша моделей в секундах (1 час)")
+    models_cache_retry_base: float = Field(default=30.0, gt=0, description="Задержка повторного запроса списка моделей после первой ошибки в секундах (далее удваивается)")
+    models_cache_retry_max: float = Field(default=1800.0, gt=0, description="Максимальная задержка повторного запроса списка моделей после ошибок в секундах")
+    models_catalog_sync_interval: float = Field(default=60.0, gt=0, description="Интервал фоновой сверки каталога моделей с провайдерами в секундах (каталог загружается из БД при запуске)")
+    blocking_io_workers: int = Field(default=4, ge=1, description="Количество потоков для блокирующих вызовов SDK провайдеров (списки моделей)")
+    blocking_io_timeout: float = Field(default=30.0, gt=0, description="Таймаут блокирующего вызова SDK провайдера в секундах")
+    loop_block_threshold_ms: float = Field(default=200.0, ge=0, description="Записывать в лог блокировки цикла событий дольше этого порога в миллисекундах (0 - выключено)")
+    metrics_enabled: bool = Field(default=True, description="Включить эндпоинт /metrics (формат Prometheus, доступ администратора) и замер времени SQL запросов")
+    tracing_enabled: bool = Field(default=False, description="Включить трассировку запросов (спаны в формате OpenTelemetry)")
+    tracing_sample_ratio: float = Field(default=0.01, ge=0, le=1, description="Доля записываемых запросов (входящий traceparent с флагом sampled записывается всегда)")
+    tracing_exporter: str = Field(default="file", pattern="^(file|otlp)$", description="Куда выгружать спаны: file - OTLP/JSON построчно в файл, otlp - HTTP в коллектор")
+    tracing_file_path: str = Field(default="./data/traces.jsonl", description="Файл для выгрузки спанов (tracing_exporter=file)")
+    tracing_otlp_endpoint: str = Field(default="http://localhost:4318/v1/traces", description="Адрес OTLP/HTTP коллектора (tracing_exporter=otlp)")
+    tracing_service_name: str = Field(default="prompt-arena", description="Имя сервиса в спанах (service.name)")
     response_cache_ttl: int = Field(default=86400, description="Время жизни кеша ответов в секундах (24 часа)")
+    response_cache_max_entries: int = Field(default=5000, ge=1, description="Максимальное количество ответов в кеше")
+    response_cache_max_mb: int = Field(default=64, ge=1, description="Максимальный суммарный размер ответов в кеше (МБ)")
+    response_cache_sweep_interval: int = Field(default=300, ge=1, description="Интервал фоновой очистки истекших ответов в секундах")
+    response_cache_persist: bool = Field(default=False, description="Сохранять кеш ответов на диск (переживает перезапуски, общий для воркеров)")
+    response_cache_path: str = Field(default="./data/response_cache.db", description="Путь к файлу персистентного кеша ответов")
+    response_cache_disk_max_mb: int = Field(default=512, ge=1, description="Максимальный размер персистентного кеша ответов (МБ)")
+    
+    # Очереди исходящих запросов к провайдерам
+    provider_max_concurrency: int = Field(default=8, ge=1, description="Максимум одновременных запросов к одному провайдеру")
+    provider_tokens_per_minute: int = Field(default=0, ge=0, description="Бюджет токенов в минуту на провайдера (0 - без ограничения)")
+    provider_queue_timeout: float = Field(default=30.0, gt=0, description="Максимальное время ожидания очереди к провайдеру в секундах")
+    provider_rate_limit_retries: int = Field(default=2, ge=0, description="Количество повторов запроса после ответа 429")
+    provider_client_close_grace: float = Field(default=300.0, ge=0, description="Через сколько секунд закрывается клиент провайдера после смены ключа (начатые с ним запросы успевают завершиться)")
+    # Базовые URL API провайдеров (None - адрес SDK по умолчанию; например, локальные mock серверы бенчмарков)
+    openai_base_url: Optional[str] = Field(default=None, description="Базовый URL API OpenAI (None - по умолчанию SDK)")
+    anthropic_base_url: Optional[str] = Field(default=None, description="Базовый URL API Anthropic (None - по умолчанию SDK)")
+    # OpenAI-совместимые провайдеры
+    openrouter_base_url: str = Field(default="https://openrouter.ai/api/v1", description="Базовый URL API OpenRouter")
+    together_base_url: str = Field(default="https://api.together.xyz/v1", description="Базовый URL API Together AI")
+    # Mock провайдер для нагрузочных тестов без сети
+    mock_provider_enabled: bool = Field(default=False, description="Включить детерминированный mock провайдер (модели mock/*) для нагрузочных тестов")
+    mock_provider_latency_ms: float = Field(default=50.0, ge=0, description="Задержка ответа mock провайдера в миллисекундах")
+    mock_provider_token_latency_ms: float = Field(default=0.0, ge=0, description="Дополнительная задержка mock провайдера на каждый токен ответа в миллисекундах")
+    config_cache_ttl: int = Field(default=300, ge=1, description="Время жизни кеша расшифрованных API ключей и системных промтов в секундах (изменения через API применяются сразу)")
+    # Лидерборд
+    rating_reconcile_interval: int = Field(default=3600, ge=0, description="Интервал сверки агрегатов лидерборда с таблицей оценок в секундах (0 - только при запуске)")
+    elo_k_factor: float = Field(default=32.0, gt=0, description="Коэффициент K для инкрементального обновления рейтинга Эло")
+    elo_initial_rating: float = Field(default=1500.0, description="Начальный рейтинг Эло новой модели")
+    rating_refit_interval: int = Field(default=3600, ge=0, description="Интервал пересчета рейтинга Брэдли-Терри в секундах (0 - только вручную)")
+    rating_bootstrap_rounds: int = Field(default=200, ge=0, description="Количество бутстрэп-выборок для доверительных интервалов Брэдли-Терри")
+    rating_buffer_enabled: bool = Field(default=False, description="Накапливать оценки в буфере и записывать в БД пачками (ответ - квитанция вместо ID)")
+    rating_buffer_flush_ms: int = Field(default=200, ge=1, description="Максимальная задержка записи буфера оценок в БД в миллисекундах")
+    rating_buffer_max_rows: int = Field(default=500, ge=1, description="Количество оценок в буфере, при котором запись выполняется сразу")
+    rating_buffer_journal_path: str = Field(default="./data/ratings_journal.jsonl", description="Базовый путь журнала буфера оценок (восстановление после сбоя); каждый процесс добавляет к имени свой PID")
+    # Задания пакетной оценки
+    eval_job_workers: int = Field(default=8, ge=1, description="Количество воркеров на одно задание пакетной оценки")
+    eval_job_provider_concurrency: int = Field(default=4, ge=1, description="Максимум одновременных запросов задания к одному провайдеру")
+    eval_job_max_cells: int = Field(default=20000, ge=1, description="Максимальное число ячеек (промты × модели) в задании")
+    eval_job_lease_seconds: float = Field(default=60.0, gt=0, description="Срок аренды задания процессом в секундах; задание упавшего процесса продолжает другой после истечения")
+    
+    provider_limits: Dict[str, Dict[str, float]] = Field(
+        default={},
+        description="Индивидуальные лимиты для провайдера или модели, например "
+                    "{\"groq\": {\"concurrency\": 4, \"tokens_per_minute\": 6000}, \"openai/gpt-4o\": {\"concurrency\": 2}}"
+    )
     
     # Настройки безопасности
     max_requests_per_minute: int = Field(default=60, description="Максимальное количество запросов в минуту")
+    rate_limit_max_keys: int = Field(default=100_000, ge=1, description="Максимум отслеживаемых ключей (IP + группа путей) в ограничителе частоты; давно неактивные вытесняются")
+    shared_state_url: str = Field(
+        default="memory://",
+        description="Хранилище счетчиков лимитов и блокировок входа: memory:// (один процесс), "
+                    "sqlite:///./data/shared_state.db (все воркеры одного хоста) или redis://host:6379/0 (несколько узлов)"
+    )
+    shared_state_pool_size: int = Field(default=8, ge=1, description="Максимум соединений с Redis на процесс для счетчиков лимитов (redis://)")
     session_expiry: int = Field(default=86400, description="Время жизни сессии в секундах (24 часа)")
 
     # Версия приложения
@@ -275,6 +348,15 @@ class ModelInfo(BaseModel):
     supports_vision: bool = False
     supports_tools: bool = False
 
+class ModelSearchResponse(BaseModel):
+    """Страница результатов поиска по каталогу моделей."""
+    items: List[ModelInfo]
+    total: int # Количество моделей, подходящих под запрос и фильтры
+    offset: int
+    limit: int
+    # Количество найденных моделей по провайдерам и категориям ("provider" -> {"openai": 12, ...})
+    facets: Dict[str, Dict[str, int]] = {}
+
 class InteractionRequest(BaseModel):
     model_id: str
     prompt: str
@@ -299,6 +381,7 @@ class InteractionResponse(BaseModel):
     # Добавим полезную информацию
     elapsed_time: Optional[float] = None
     token_count: Optional[dict] = None
+    coalesced: bool = Field(default=False, description="Ответ получен из идентичного запроса, выполнявшегося одновременно")
     
     model_config = {
         "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id
@@ -326,6 +409,43 @@ class ComparisonResponse(BaseModel):
     response_1: InteractionResponse
     response_2: InteractionResponse
 
+class ModelTarget(BaseModel):
+    """Модель в запросе к нескольким моделям. Заданные параметры переопределяют общие параметры запроса."""
+    model_id: str
+    system_prompt: Optional[str] = None
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = Field(default=None, ge=0.0, le=2.0)
+    top_p: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    frequency_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    presence_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    stop_sequences: Optional[List[str]] = None
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id
+    }
+
+class MultiModelRequest(BaseModel):
+    """Один промт для нескольких моделей одновременно."""
+    prompt: str
+    models: List[ModelTarget] = Field(..., min_length=1, max_length=20, description="Модели (с индивидуальными параметрами)")
+    # Общие параметры для всех моделей
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = Field(default=None, ge=0.0, le=2.0)
+    system_prompt: Optional[str] = None
+    top_p: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    frequency_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    presence_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    stop_sequences: Optional[List[str]] = None
+    deadline: Optional[float] = Field(
+        default=None, gt=0, le=600,
+        description="Общий срок в секундах: не успевшие модели отменяются"
+    )
+
+class MultiModelResponse(BaseModel):
+    responses: List[InteractionResponse] = Field(description="Ответы в порядке завершения")
+    timed_out: List[str] = Field(default=[], description="Модели, не успевшие ответить до срока")
+    elapsed_time: float
+
 class RatingBase(BaseModel):
     model_id: str
     prompt_text: str # Полный текст промта для хеширования
@@ -345,6 +465,7 @@ class RatingCreate(RatingBase):
 
 class RatingRead(RatingBase):
     id: int
+    prompt_text: Optional[str] = None # Полный текст промта в БД не хранится, только хеш
     prompt_hash: str # Хеш промта, который хранится в БД
     timestamp: datetime.datetime # Используем datetime для ясности
     comparison_winner: Optional[str] = None
@@ -358,6 +479,51 @@ class RatingRead(RatingBase):
         "from_attributes": True  # Заменяет orm_mode в Pydantic v2
     }
 
+class RatingReceipt(BaseModel):
+    """Квитанция об оценке, принятой в буфер записи: строка в БД появится при следующем сбросе."""
+    receipt_id: str
+    status: str = "queued"
+    model_id: str
+    rating: int
+    timestamp: datetime.datetime
+
+    model_config = {
+        "protected_namespaces": ()
+    }
+
+class ComparisonVoteCreate(BaseModel):
+    """Голос в попарном сравнении двух моделей."""
+    model_id_1: str
+    model_id_2: str
+    winner: str = Field(..., pattern="^(model_1|model_2|tie)$", description="'model_1', 'model_2' или 'tie'")
+    prompt_text: Optional[str] = None
+    user_identifier: Optional[str] = None
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id_*
+    }
+
+    @field_validator("model_id_2")
+    @classmethod
+    def validate_different_models(cls, v, info):
+        """Проверяет, что сравниваются разные модели."""
+        if v == info.data.get("model_id_1"):
+            raise ValueError("Для сравнения нужны две разные модели")
+        return v
+
+class ComparisonVoteRead(BaseModel):
+    """Результат голосования с обновленными рейтингами Эло."""
+    id: int
+    model_id_1: str
+    model_id_2: str
+    winner: str
+    elo_1: float
+    elo_2: float
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id_*
+    }
+
 class LeaderboardEntry(BaseModel):
     rank: int # Добавим ранг
     model_id: str
@@ -366,6 +532,11 @@ class LeaderboardEntry(BaseModel):
     category: Optional[str] = None # Категория модели
     average_rating: float
     rating_count: int
+    # Попарный рейтинг (режимы ранжирования elo и bradley_terry)
+    score: Optional[float] = None
+    ci_lower: Optional[float] = None # Границы 95% доверительного интервала (bradley_terry)
+    ci_upper: Optional[float] = None
+    games: Optional[int] = None # Количество сравнений с участием модели
     
     model_config = {
         "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id
@@ -408,6 +579,57 @@ class PromptTemplateUpdate(BaseModel):
     tags: Optional[str] = None
     is_public: Optional[bool] = None
 
+# Модели для заданий пакетной оценки
+class EvalJobCreate(BaseModel):
+    """Задание: каждый промт отправляется каждой модели."""
+    prompts: List[str] = Field(default=[], description="Тексты промтов")
+    template_ids: List[int] = Field(default=[], description="ID шаблонов промтов (добавляются к prompts)")
+    model_ids: List[str] = Field(..., min_length=1, description="Модели для оценки")
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = Field(default=None, ge=0.0, le=2.0)
+    system_prompt: Optional[str] = None
+    top_p: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    frequency_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    presence_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    stop_sequences: Optional[List[str]] = None
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_ids
+    }
+
+class EvalJobRead(BaseModel):
+    """Состояние задания пакетной оценки."""
+    id: str
+    status: str
+    model_ids: List[str]
+    prompt_count: int
+    total_cells: int
+    completed_cells: int
+    failed_cells: int
+    created_by: Optional[str] = None
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_ids
+    }
+
+class EvalJobCellRead(BaseModel):
+    """Результат одной ячейки задания (промт × модель)."""
+    seq: int
+    prompt_index: int
+    model_id: str
+    status: str
+    response: Optional[str] = None
+    error: Optional[str] = None
+    elapsed_time: Optional[float] = None
+    token_count: Optional[dict] = None
+    
+    model_config = {
+        "protected_namespaces": ()  # Отключаем защищенное пространство имен для model_id
+    }
+
 # Модели для JWT-токенов аутентификации
 class Token(BaseModel):
     access_token: str
@@ -0,0 +1,100 @@
+# backend/config_cache.py
+
+import time
+from typing import Dict, Optional, Tuple
+
+from backend.config import settings
+
+
+class ConfigCache:
+    """
+    Кеш редко меняющейся конфигурации из БД в памяти процесса:
+    расшифрованные API ключи провайдеров и таблица системных промтов.
+
+    Кеш только хранит данные: загрузку из БД и инвалидацию при изменениях
+    выполняет backend.database. Инвалидация сквозная - при записи и повторно
+    после commit, чтобы конкурентный запрос не вернул в кеш старое значение,
+    прочитанное до фиксации транзакции. Поколение (generation) растет при каждой
+    инвалидации: значение, загрузка которого началась до инвалидации, не сохраняется.
+
+    Расшифрованные ключи хранятся в bytearray и затираются нулями при удалении
+    из кеша. Строка, которую получает вызывающий код, - копия, и ее время жизни
+    определяется сборщиком мусора Python.
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        # TTL - страховка на случай изменения БД в обход приложения
+        self.ttl = ttl
+        self.generation = 0
+        self._keys: Dict[str, Tuple[Optional[bytearray], float]] = {}  # provider -> (ключ или None, expires_at)
+        # model_id -> текст промта и provider -> промт первой модели провайдера
+        self._prompts: Optional[Tuple[Dict[str, str], Dict[str, str], float]] = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- API ключи ---
+
+    def get_api_key(self, provider: str) -> Tuple[bool, Optional[str]]:
+        """Возвращает (найден ли в кеше, ключ). Отсутствие ключа в БД тоже кешируется."""
+        entry = self._keys.get(provider)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                self._drop_key(provider)
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        secret = entry[0]
+        return True, secret.decode("utf-8") if secret is not None else None
+
+    def set_api_key(self, provider: str, api_key: Optional[str], generation: int) -> None:
+        if generation != self.generation:
+            return
+        self._drop_key(provider)
+        secret = bytearray(api_key.encode("utf-8")) if api_key is not None else None
+        self._keys[provider] = (secret, time.monotonic() + self.ttl)
+
+    def _drop_key(self, provider: str) -> None:
+        entry = self._keys.pop(provider, None)
+        if entry is not None and entry[0] is not None:
+            secret = entry[0]
+            secret[:] = bytes(len(secret))
+
+    def invalidate_api_key(self, provider: Optional[str] = None) -> None:
+        """Удаляет ключ провайдера (или все ключи) из кеша, затирая его в памяти."""
+        self.generation += 1
+        for cached_provider in [provider] if provider is not None else list(self._keys):
+            self._drop_key(cached_provider)
+
+    # --- Системные промты ---
+
+    def get_system_prompts(self) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+        """Возвращает (промты моделей, промты провайдеров) или None, если таблицу нужно загрузить."""
+        if self._prompts is None or self._prompts[2] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._prompts[0], self._prompts[1]
+
+    def set_system_prompts(self, by_model: Dict[str, str], by_provider: Dict[str, str], generation: int) -> None:
+        if generation != self.generation:
+            return
+        self._prompts = (by_model, by_provider, time.monotonic() + self.ttl)
+
+    def invalidate_system_prompts(self) -> None:
+        self.generation += 1
+        self._prompts = None
+
+    def clear(self) -> None:
+        self.invalidate_api_key()
+        self.invalidate_system_prompts()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "api_keys": len(self._keys),
+            "system_prompts": len(self._prompts[0]) if self._prompts is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+config_cache = ConfigCache(ttl=settings.config_cache_ttl)
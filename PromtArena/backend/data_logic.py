@@ -1,5 +1,6 @@
 # backend/data_logic.py
 
+import asyncio
 import hashlib
 import logging
 import time
@@ -7,10 +8,13 @@ from typing import List, Optional, Dict, Any, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Импортируем функции и модели из соседних модулей
-from backend import database
+from backend import database, rating_engine
+from backend.rating_buffer import rating_buffer
+from backend.model_catalog import model_catalog
 from backend.config import (
-    ApiKeyCreate, ApiKeyRead, RatingCreate, RatingRead, LeaderboardEntry, ModelInfo, CategoryInfo,
-    SUPPORTED_PROVIDERS, SystemPromptCreate, SystemPromptRead
+    ApiKeyCreate, ApiKeyRead, RatingCreate, RatingRead, RatingReceipt, LeaderboardEntry, ModelInfo, CategoryInfo,
+    SUPPORTED_PROVIDERS, SystemPromptCreate, SystemPromptRead, ComparisonVoteCreate, ComparisonVoteRead,
+    settings
 )
 
 logger = logging.getLogger(__name__)
@@ -50,6 +54,10 @@ def get_categories() -> List[CategoryInfo]:
     logger.debug("Запрос структуры категорий")
     return CATEGORIES_STRUCTURE
 
+async def get_models(category: Optional[str] = None) -> List[ModelInfo]:
+    """Возвращает модели общего каталога, опционально отфильтрованные по категории."""
+    return await model_catalog.list_models(category)
+
 # --- Логика API Ключей ---
 
 async def add_or_update_api_key(db: AsyncSession, api_key_data: ApiKeyCreate, username: Optional[str] = None) -> ApiKeyRead:
@@ -60,6 +68,7 @@ async def add_or_update_api_key(db: AsyncSession, api_key_data: ApiKeyCreate, us
     logger.info(f"Запрос на добавление/обновление ключа для провайдера: {api_key_data.provider}")
     # Валидация провайдера уже произошла в Pydantic модели ApiKeyCreate
     db_api_key = await database.create_api_key(db, api_key_data, username)
+    _invalidate_provider_clients(api_key_data.provider)
     return ApiKeyRead.model_validate(db_api_key)
 
 async def list_api_keys(db: AsyncSession) -> List[ApiKeyRead]:
@@ -73,7 +82,17 @@ async def remove_api_key(db: AsyncSession, provider: str) -> bool:
     if provider not in SUPPORTED_PROVIDERS:
         logger.warning(f"Попытка удаления ключа для неподдерживаемого провайдера: {provider}")
         return False
-    return await database.delete_api_key(db, provider)
+    deleted = await database.delete_api_key(db, provider)
+    if deleted:
+        _invalidate_provider_clients(provider)
+    return deleted
+
+def _invalidate_provider_clients(provider: str) -> None:
+    """Сбрасывает закешированные клиенты провайдера после изменения его ключа."""
+    # Отложенный импорт чтобы избежать циклических импортов
+    from backend.models_io import provider_clients
+    provider_clients.invalidate(provider)
+    model_catalog.invalidate(provider)
 
 # --- Логика Системных Промтов ---
 
@@ -101,14 +120,19 @@ def _hash_prompt(prompt_text: str) -> str:
     """Создает SHA-256 хеш для текста промта."""
     return hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
 
-async def process_and_save_rating(db: AsyncSession, rating_data: RatingCreate) -> RatingRead:
+async def process_and_save_rating(db: AsyncSession, rating_data: RatingCreate) -> Union[RatingRead, RatingReceipt]:
     """
     Обрабатывает данные оценки, хеширует промт и сохраняет в БД.
+    При включенном буфере записи оценка ставится в очередь, а вместо записи
+    из БД возвращается квитанция.
     """
     logger.info(f"Обработка оценки {rating_data.rating}/10 для модели {rating_data.model_id}")
     prompt_hash = _hash_prompt(rating_data.prompt_text)
     logger.debug(f"Хеш промта ({rating_data.prompt_text[:20]}...): {prompt_hash}")
 
+    if rating_buffer.running:
+        return rating_buffer.submit(rating_data, prompt_hash)
+
     # Вызываем функцию БД для создания записи
     db_rating = await database.create_rating(db, rating_data, prompt_hash)
 
@@ -116,52 +140,135 @@ async def process_and_save_rating(db: AsyncSession, rating_data: RatingCreate) -
     rating_read_data = RatingRead.model_validate(db_rating)
     return rating_read_data
 
-# --- Логика Лидерборда ---
+# Обновления Эло читают и пишут строки обеих моделей; блокировка исключает потерю
+# обновления при одновременных голосах за одну модель
+_elo_lock = asyncio.Lock()
 
-# Кеш для деталей моделей, чтобы не дергать models_io постоянно
-_model_details_cache: Dict[str, ModelInfo] = {}
-_cache_expiry_time = 3600 # Время жизни кеша в секундах (1 час)
-_last_cache_update = 0
-
-async def _get_enriched_model_details(db: AsyncSession) -> Dict[str, ModelInfo]:
+async def process_comparison_vote(db: AsyncSession, vote: ComparisonVoteCreate) -> ComparisonVoteRead:
     """
-    Получает детали моделей (имя, провайдер, категория) из кеша или
-    вызывает функцию из models_io для их получения.
+    Сохраняет голос попарного сравнения и инкрементально (O(1)) обновляет рейтинги Эло
+    обеих моделей в той же транзакции.
     """
-    import time
-    global _last_cache_update, _model_details_cache
-
-    current_time = time.time()
-    if not _model_details_cache or (current_time - _last_cache_update > _cache_expiry_time):
-        logger.info("Обновление кеша деталей моделей для лидерборда...")
+    logger.info(f"Голос сравнения: {vote.model_id_1} vs {vote.model_id_2} -> {vote.winner}")
+    prompt_hash = _hash_prompt(vote.prompt_text) if vote.prompt_text else None
+
+    async with _elo_lock:
+        db_vote = await database.create_comparison_vote(
+            db, vote.model_id_1, vote.model_id_2, vote.winner, prompt_hash, vote.user_identifier
+        )
+        rows = await database.get_elo_ratings(db, [vote.model_id_1, vote.model_id_2])
+        for model_id in (vote.model_id_1, vote.model_id_2):
+            if model_id not in rows:
+                rows[model_id] = database.ModelEloRating(
+                    model_id=model_id, elo=settings.elo_initial_rating, games=0, wins=0, losses=0, ties=0
+                )
+                db.add(rows[model_id])
+        row_1, row_2 = rows[vote.model_id_1], rows[vote.model_id_2]
+
+        score_1 = rating_engine.WINNER_SCORES[vote.winner]
+        row_1.elo, row_2.elo = rating_engine.elo_update(row_1.elo, row_2.elo, score_1, settings.elo_k_factor)
+        for row, score in ((row_1, score_1), (row_2, 1.0 - score_1)):
+            row.games += 1
+            if score == 1.0:
+                row.wins += 1
+            elif score == 0.0:
+                row.losses += 1
+            else:
+                row.ties += 1
+        await db.commit()
+
+    return ComparisonVoteRead(
+        id=db_vote.id,
+        model_id_1=vote.model_id_1,
+        model_id_2=vote.model_id_2,
+        winner=vote.winner,
+        elo_1=round(row_1.elo, 2),
+        elo_2=round(row_2.elo, 2)
+    )
+
+# Фоновая сверка материализованных агрегатов рейтингов
+_reconcile_task: Optional[asyncio.Task] = None
+
+async def _reconcile_ratings_loop(interval: float) -> None:
+    while True:
         try:
-            # Отложенный импорт чтобы избежать циклических импортов
-            from backend.models_io import get_available_models_details
-            all_models: List[ModelInfo] = await get_available_models_details(db) # Передаем сессию для получения ключей
-            _model_details_cache = {model.id: model for model in all_models}
-            _last_cache_update = current_time
-            logger.info(f"Кеш деталей моделей обновлен. Загружено {len(_model_details_cache)} моделей.")
-        except ImportError:
-             logger.error("Функция get_available_models_details не найдена в backend.models_io. Пожалуйста, реализуйте ее.")
-             # Возвращаем пустой словарь или старый кеш, чтобы не падать
-             return _model_details_cache
+            async with database.AsyncSessionFactory() as db:
+                await database.reconcile_rating_aggregates(db)
         except Exception as e:
-            logger.exception("Ошибка при обновлении кеша деталей моделей.", exc_info=e)
-            # Возвращаем старый кеш, если он есть
-            return _model_details_cache
+            logger.error(f"Ошибка сверки агрегатов рейтингов: {e}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
 
-    return _model_details_cache
+def start_rating_reconciler(interval: float) -> None:
+    """
+    Запускает периодическую сверку агрегатов лидерборда с таблицей ratings.
+    Первая сверка выполняется сразу и заполняет агрегаты для уже существующих оценок;
+    при interval=0 сверка выполняется только один раз.
+    """
+    global _reconcile_task
+    if _reconcile_task is None:
+        _reconcile_task = asyncio.create_task(_reconcile_ratings_loop(interval), name="rating_reconciler")
+
+async def stop_rating_reconciler() -> None:
+    """Останавливает периодическую сверку агрегатов рейтингов."""
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
 
+# --- Логика Лидерборда ---
+
+async def _get_enriched_model_details(db: AsyncSession) -> Dict[str, ModelInfo]:
+    """
+    Получает детали моделей (имя, провайдер, категория) из общего каталога моделей.
+    Каталог сверяется с провайдерами в своей сессии, параметр db оставлен для совместимости.
+    """
+    return await model_catalog.get_models_map()
 
-async def generate_leaderboard(db: AsyncSession, category_filter: Optional[str] = None) -> List[LeaderboardEntry]:
+
+# Доступные режимы ранжирования лидерборда
+LEADERBOARD_RANKINGS = ("average", "elo", rating_engine.BRADLEY_TERRY)
+
+async def _get_ranking_data(db: AsyncSession, ranking: str, category_filter: Optional[str]) -> List[tuple]:
+    """
+    Возвращает строки (model_id, avg_rating, count, extra) в порядке ранжирования.
+    extra - дополнительные поля LeaderboardEntry для попарных режимов.
+    """
+    if ranking == "average":
+        return [(model_id, avg, count, {}) for model_id, avg, count in await database.get_leaderboard_data(db, category_filter)]
+
+    aggregates = await database.get_rating_aggregates(db)
+    if ranking == "elo":
+        rows = [
+            (model_id, {"score": round(elo, 2), "games": games})
+            for model_id, elo, games in await database.get_elo_leaderboard_data(db)
+        ]
+    elif ranking == rating_engine.BRADLEY_TERRY:
+        rows = [
+            (row.model_id, {"score": row.score, "ci_lower": row.ci_lower, "ci_upper": row.ci_upper, "games": row.games})
+            for row in await database.get_latest_rating_snapshot(db, rating_engine.BRADLEY_TERRY)
+        ]
+    else:
+        raise ValueError(f"Неизвестный режим ранжирования: {ranking}")
+    return [(model_id, *aggregates.get(model_id, (0.0, 0)), extra) for model_id, extra in rows]
+
+async def generate_leaderboard(db: AsyncSession, category_filter: Optional[str] = None,
+                               ranking: str = "average") -> List[LeaderboardEntry]:
     """
     Формирует лидерборд: получает агрегированные данные из БД,
     обогащает их деталями моделей (имя, провайдер, категория) и применяет фильтр.
+    ranking: "average" - средняя оценка 1-10, "elo" - инкрементальный рейтинг Эло,
+    "bradley_terry" - последний снимок пакетного пересчета с доверительными интервалами.
     """
-    logger.info(f"Генерация лидерборда. Фильтр по категории: {category_filter}")
+    logger.info(f"Генерация лидерборда. Фильтр по категории: {category_filter}, ранжирование: {ranking}")
 
-    # 1. Получаем сырые данные рейтинга (model_id, avg_rating, count) из БД
-    raw_leaderboard_data = await database.get_leaderboard_data(db, category_filter)
+    # 1. Получаем сырые данные рейтинга (model_id, avg_rating, count, extra) из БД
+    raw_leaderboard_data = await _get_ranking_data(db, ranking, category_filter)
     if not raw_leaderboard_data:
         logger.warning("Нет данных о рейтингах для формирования лидерборда.")
         return []
@@ -175,7 +282,7 @@ async def generate_leaderboard(db: AsyncSession, category_filter: Optional[str]
     # 3. Собираем и фильтруем лидерборд
     leaderboard: List[LeaderboardEntry] = []
     rank = 1
-    for model_id, avg_rating, rating_count in raw_leaderboard_data:
+    for model_id, avg_rating, rating_count, extra in raw_leaderboard_data:
         details = model_details.get(model_id)
         if details:
             # Применяем фильтр по категории, если он задан
@@ -196,7 +303,8 @@ async def generate_leaderboard(db: AsyncSession, category_filter: Optional[str]
                     provider=SUPPORTED_PROVIDERS.get(details.provider, details.provider), # Отображаемое имя провайдера
                     category=model_category_id, # Используем ID категории
                     average_rating=round(avg_rating, 2), # Округляем рейтинг
-                    rating_count=rating_count
+                    rating_count=rating_count,
+                    **extra
                 )
                 leaderboard.append(entry)
                 rank += 1
@@ -214,7 +322,8 @@ async def generate_leaderboard(db: AsyncSession, category_filter: Optional[str]
                     provider=SUPPORTED_PROVIDERS.get(provider, provider),
                     category=None,
                     average_rating=round(avg_rating, 2),
-                    rating_count=rating_count
+                    rating_count=rating_count,
+                    **extra
                 )
                 leaderboard.append(entry)
                 rank += 1
@@ -5,14 +5,21 @@ import hashlib
 from typing import AsyncGenerator, List, Optional, Tuple, Dict, Any, Union
 import logging
 import os
+import time
 
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, LargeBinary, Index, UniqueConstraint, ForeignKey, func, desc, Boolean
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError
 from contextlib import asynccontextmanager
 
 from backend.config import settings, fernet, SUPPORTED_PROVIDERS
+from backend.config_cache import config_cache
+from backend import metrics, tracing
 # Импортируем Pydantic модели для type hinting и возвращаемых значений
 from backend.config import ApiKeyCreate, ApiKeyRead, RatingCreate, RatingRead, LeaderboardEntry, SystemPromptCreate, SystemPromptRead
 
@@ -31,10 +38,38 @@ def decrypt_data(encrypted_data: bytes) -> str:
 
 # --- Настройка SQLAlchemy ---
 
+def _is_file_sqlite(url: str) -> bool:
+    """SQLite в файле (для :memory: второй движок означал бы отдельную пустую БД)."""
+    return 'sqlite' in url.lower() and ':memory:' not in url and not url.rstrip('/').endswith('sqlite+aiosqlite:')
+
+def _apply_sqlite_profile(dbapi_connection, connection_record, read_only: bool = False) -> None:
+    """
+    Настраивает соединение SQLite при подключении: WAL (чтение не блокируется записью),
+    synchronous=NORMAL (в WAL безопасно и без fsync на каждый commit), ожидание
+    блокировок вместо немедленной ошибки, mmap и увеличенный кеш страниц.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+        cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size_mb * 1024 * 1024}")
+        # Отрицательное значение cache_size - размер в КиБ, а не в страницах
+        cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_mb * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
 # Создаем асинхронный движок
 try:
     # Проверяем, является ли БД SQLite
     is_sqlite = 'sqlite' in settings.database_url.lower()
+    # Отдельные соединения для записи и чтения - только для SQLite в файле
+    use_sqlite_profile = settings.sqlite_tuning_enabled and _is_file_sqlite(settings.database_url)
     
     db_params = {
         'echo': settings.log_level == "DEBUG",  # Включаем логирование SQL запросов в DEBUG режиме
@@ -48,22 +83,136 @@ try:
             'max_overflow': 10,    # Максимальное количество соединений сверх pool_size
         })
     
-    async_engine = create_async_engine(
-        settings.database_url,
-        **db_params
-    )
+    if use_sqlite_profile:
+        # SQLite допускает одного писателя: все записи идут через одно соединение,
+        # остальные ждут его в очереди пула (вместо SQLITE_BUSY на уровне файла)
+        async_engine = create_async_engine(
+            settings.database_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=settings.sqlite_write_queue_timeout,
+            **db_params
+        )
+        # Чтение (лидерборд, статистика, ключи, промты) - через пул соединений только для чтения.
+        # Переполнение не ограничено: вложенные сессии (синхронизация каталога, общий вызов
+        # инференса, задания) берут второе соединение, пока внешняя сессия держит первое,
+        # и ограниченный пул под нагрузкой ждал бы сам себя до pool_timeout
+        read_engine = create_async_engine(
+            settings.database_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.sqlite_read_pool_size,
+            max_overflow=-1,
+            **db_params
+        )
+        event.listen(async_engine.sync_engine, "connect", _apply_sqlite_profile)
+        event.listen(read_engine.sync_engine, "connect",
+                     lambda conn, record: _apply_sqlite_profile(conn, record, read_only=True))
+    else:
+        async_engine = create_async_engine(
+            settings.database_url,
+            **db_params
+        )
+        read_engine = async_engine
     logger.info(f"Async engine created for URL: {'sqlite' if 'sqlite' in settings.database_url else settings.database_url.split('@')[1] if '@' in settings.database_url else settings.database_url}")
 except Exception as e:
     logger.exception(f"Failed to create async engine for URL: {settings.database_url}", exc_info=e)
     raise
 
+# --- Метрики и трассировка SQL запросов ---
+
+# Метка operation ограничена известными командами, чтобы число рядов метрики не росло
+_SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "CREATE", "BEGIN", "COMMIT", "ROLLBACK"}
+
+def _sql_operation(statement: str) -> str:
+    operation = statement.lstrip()[:8].split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in _SQL_OPERATIONS else "OTHER"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+    # Спан не делается текущим: внутри запроса других спанов нет
+    context._query_span = tracing.span("db.query", **{
+        "db.system": conn.dialect.name,
+        "db.operation": _sql_operation(statement),
+        "db.statement": statement[:500],
+    })
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    if settings.metrics_enabled:
+        metrics.db_query_duration.observe(time.perf_counter() - started, _sql_operation(statement))
+    context._query_span.end()
+
+def _handle_db_error(exception_context):
+    query_span = getattr(exception_context.execution_context, "_query_span", None)
+    if query_span is not None:
+        query_span.record_exception(exception_context.original_exception)
+        query_span.end()
+
+if settings.metrics_enabled or settings.tracing_enabled:
+    for _engine in {async_engine, read_engine}:
+        event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(_engine.sync_engine, "handle_error", _handle_db_error)
+
+def _is_write_statement(clause: Any) -> bool:
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith("SELECT")
+    return False
+
+class RoutingSession(Session):
+    """
+    Сессия, которая направляет SELECT в пул чтения, а INSERT/UPDATE/DELETE и flush -
+    в соединение записи. После первой записи сессия до конца транзакции работает
+    только с соединением записи, чтобы видеть собственные незафиксированные изменения.
+    """
+    _use_writer = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._use_writer or self._flushing or _is_write_statement(clause):
+            self._use_writer = True
+            return async_engine.sync_engine
+        return read_engine.sync_engine
+
+@event.listens_for(RoutingSession, "after_commit")
+@event.listens_for(RoutingSession, "after_rollback")
+def _reset_writer(session: RoutingSession) -> None:
+    session._use_writer = False
+
+def _drop_cached_config(api_key_provider: Optional[str], system_prompts: bool) -> None:
+    if api_key_provider is not None:
+        config_cache.invalidate_api_key(api_key_provider)
+    if system_prompts:
+        config_cache.invalidate_system_prompts()
+
+def _invalidate_config_cache(db: AsyncSession, api_key_provider: Optional[str] = None, system_prompts: bool = False) -> None:
+    """
+    Сбрасывает кеш ключей/промтов сразу и повторно после commit сессии: иначе
+    конкурентный запрос мог бы успеть закешировать значение, прочитанное до фиксации.
+    """
+    _drop_cached_config(api_key_provider, system_prompts)
+    db.sync_session.info.setdefault("config_cache_invalidations", []).append((api_key_provider, system_prompts))
+
+@event.listens_for(Session, "after_commit")
+def _apply_config_cache_invalidations(session: Session) -> None:
+    for api_key_provider, system_prompts in session.info.pop("config_cache_invalidations", ()):
+        _drop_cached_config(api_key_provider, system_prompts)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_config_cache_invalidations(session: Session) -> None:
+    session.info.pop("config_cache_invalidations", None)
+
 # Создаем асинхронную фабрику сессий
 AsyncSessionFactory = async_sessionmaker(
-    bind=async_engine,
     expire_on_commit=False, # Важно для асинхронных задач
     class_=AsyncSession,
     autoflush=False,        # Отключаем автоматический flush для контроля транзакций
-    autocommit=False        # Явно указываем, что автокоммита нет
+    autocommit=False,       # Явно указываем, что автокоммита нет
+    **({'sync_session_class': RoutingSession} if use_sqlite_profile else {'bind': async_engine})
 )
 
 # Базовый класс для декларативных моделей
@@ -140,6 +289,87 @@ class Rating(Base):
     def __repr__(self):
         return f"<Rating(id={self.id}, model_id='{self.model_id}', rating={self.rating})>"
 
+class ModelRatingAggregate(Base):
+    """
+    Материализованные агрегаты оценок по модели для лидерборда.
+    Обновляются в той же транзакции, что и вставка оценки, и периодически
+    сверяются с таблицей ratings.
+    """
+    __tablename__ = "model_rating_aggregates"
+
+    model_id = Column(String(255), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    min_rating = Column(Integer, nullable=True)
+    max_rating = Column(Integer, nullable=True)
+    last_rating_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<ModelRatingAggregate(model_id='{self.model_id}', count={self.rating_count})>"
+
+class RatingJournalCheckpoint(Base):
+    """
+    Последний записанный в БД номер записи журнала буфера оценок. Обновляется в той же
+    транзакции, что и вставка пачки, поэтому повторное чтение журнала после сбоя
+    не создает дубликатов.
+    """
+    __tablename__ = "rating_journal_checkpoints"
+
+    journal = Column(String(255), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class ComparisonVote(Base):
+    """Результат попарного сравнения двух моделей на одном промте."""
+    __tablename__ = "comparison_votes"
+
+    id = Column(Integer, primary_key=True)
+    model_a = Column(String(255), nullable=False, index=True)
+    model_b = Column(String(255), nullable=False, index=True)
+    winner = Column(String(10), nullable=False)  # 'model_1', 'model_2', 'tie' (model_1 = model_a)
+    prompt_hash = Column(String(64), nullable=True)
+    user_identifier = Column(String(255), nullable=True)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<ComparisonVote(id={self.id}, '{self.model_a}' vs '{self.model_b}', winner='{self.winner}')>"
+
+class ModelEloRating(Base):
+    """Текущий рейтинг Эло модели, обновляется инкрементально при каждом голосе."""
+    __tablename__ = "model_elo_ratings"
+
+    model_id = Column(String(255), primary_key=True)
+    elo = Column(Float, nullable=False)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    ties = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ModelEloRating(model_id='{self.model_id}', elo={self.elo:.1f})>"
+
+class RatingSnapshot(Base):
+    """Строка снимка рейтингов, рассчитанного пакетно (например, Брэдли-Терри)."""
+    __tablename__ = "rating_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    snapshot_id = Column(String(36), nullable=False, index=True)
+    method = Column(String(30), nullable=False)  # 'bradley_terry'
+    model_id = Column(String(255), nullable=False)
+    score = Column(Float, nullable=False)
+    ci_lower = Column(Float, nullable=True)
+    ci_upper = Column(Float, nullable=True)
+    games = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index('ix_rating_snapshots_method_created', 'method', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<RatingSnapshot(snapshot_id='{self.snapshot_id}', model_id='{self.model_id}', score={self.score:.1f})>"
+
 class PromptTemplate(Base):
     """Модель для хранения шаблонов промтов."""
     __tablename__ = "prompt_templates"
@@ -161,6 +391,69 @@ class PromptTemplate(Base):
     def __repr__(self):
         return f"<PromptTemplate(id={self.id}, name='{self.name}')>"
 
+class EvalJob(Base):
+    """Фоновое задание пакетной оценки: набор промтов × набор моделей."""
+    __tablename__ = "eval_jobs"
+
+    id = Column(String(36), primary_key=True)  # UUID
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, running, completed, cancelled, failed
+    params = Column(Text, nullable=True)  # JSON с общими параметрами генерации
+    model_ids = Column(Text, nullable=False)  # JSON-список моделей
+    prompt_count = Column(Integer, nullable=False, default=0)
+    total_cells = Column(Integer, nullable=False, default=0)
+    completed_cells = Column(Integer, nullable=False, default=0)
+    failed_cells = Column(Integer, nullable=False, default=0)
+    created_by = Column(String(50), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Процесс, выполняющий задание, и срок его аренды (продлевается, пока задание выполняется)
+    owner = Column(String(64), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<EvalJob(id='{self.id}', status='{self.status}', {self.completed_cells}/{self.total_cells})>"
+
+class EvalJobCell(Base):
+    """Одна ячейка задания: ответ одной модели на один промт."""
+    __tablename__ = "eval_job_cells"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(36), ForeignKey("eval_jobs.id", ondelete="CASCADE"), nullable=False)
+    prompt_index = Column(Integer, nullable=False)
+    prompt_text = Column(Text, nullable=False)
+    model_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, completed, failed
+    seq = Column(Integer, nullable=True)  # Порядковый номер завершения (для потоковой выдачи и возобновления)
+    response = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    elapsed_time = Column(Float, nullable=True)
+    token_count = Column(Text, nullable=True)  # JSON
+    completed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_eval_job_cells_job_status', 'job_id', 'status'),
+        Index('ix_eval_job_cells_job_seq', 'job_id', 'seq'),
+    )
+
+    def __repr__(self):
+        return f"<EvalJobCell(id={self.id}, job_id='{self.job_id}', model_id='{self.model_id}', status='{self.status}')>"
+
+class ModelCatalogEntry(Base):
+    """
+    Снимок каталога моделей одного провайдера (список ModelInfo в компактном JSON).
+    Загружается при запуске, чтобы /models отвечал сразу, не дожидаясь API провайдеров.
+    """
+    __tablename__ = "model_catalog"
+
+    provider = Column(String(50), primary_key=True)
+    models_json = Column(Text, nullable=False)
+    model_count = Column(Integer, nullable=False, default=0)
+    fetched_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ModelCatalogEntry(provider='{self.provider}', models={self.model_count})>"
+
 # --- Функции для работы с БД ---
 
 # Функция get_db для FastAPI Depends
@@ -181,30 +474,31 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 async def init_db():
     """Инициализирует базу данных, создавая таблицы и добавляя начальные данные."""
-    async with async_engine.begin() as conn:
-        logger.info("Инициализация базы данных...")
-        try:
-            # Создаем все таблицы, если они еще не существуют
+    logger.info("Инициализация базы данных...")
+    try:
+        # Создаем все таблицы, если они еще не существуют. Транзакция DDL закрывается
+        # до работы с сессиями: у профиля SQLite только одно соединение записи
+        async with async_engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
-            logger.info("Таблицы успешно созданы (или уже существовали).")
+        logger.info("Таблицы успешно созданы (или уже существовали).")
+        
+        # Проверяем, существуют ли таблицы действительно
+        # Это поможет обнаружить ошибки с путями к SQLite
+        try:
+            await check_db_connection()
+            logger.info("Проверка соединения с базой данных успешно пройдена.")
+            
+            # Добавляем начальные системные промты, если их нет
+            async with AsyncSessionFactory() as session:
+                await add_default_system_prompts(session)
             
-            # Проверяем, существуют ли таблицы действительно
-            # Это поможет обнаружить ошибки с путями к SQLite
-            try:
-                await check_db_connection()
-                logger.info("Проверка соединения с базой данных успешно пройдена.")
-                
-                # Добавляем начальные системные промты, если их нет
-                async with AsyncSessionFactory() as session:
-                    await add_default_system_prompts(session)
-                
-            except Exception as e:
-                logger.error(f"Ошибка проверки соединения с БД: {e}")
-                raise
-                
         except Exception as e:
-            logger.exception("Ошибка при создании таблиц БД.", exc_info=e)
+            logger.error(f"Ошибка проверки соединения с БД: {e}")
             raise
+            
+    except Exception as e:
+        logger.exception("Ошибка при создании таблиц БД.", exc_info=e)
+        raise
 
 async def check_db_connection():
     """Проверяет соединение с базой данных и корректность схемы."""
@@ -268,6 +562,7 @@ async def add_default_system_prompts(db: AsyncSession):
             )
             db.add(system_prompt)
         
+        _invalidate_config_cache(db, system_prompts=True)
         await db.commit()
         logger.info(f"Добавлено {len(default_prompts)} дефолтных системных промтов.")
                 
@@ -283,6 +578,7 @@ async def create_api_key(db: AsyncSession, api_key_data: ApiKeyCreate, username:
     db_api_key = result.scalar_one_or_none()
 
     encrypted_key = encrypt_data(api_key_data.api_key.get_secret_value())
+    _invalidate_config_cache(db, api_key_provider=api_key_data.provider)
 
     try:
         if db_api_key:
@@ -328,17 +624,25 @@ async def create_api_key(db: AsyncSession, api_key_data: ApiKeyCreate, username:
         await db.rollback()
         raise ValueError(f"Не удалось сохранить ключ для {api_key_data.provider}: {str(e)}")
 
+@tracing.traced("config.get_api_key")
 async def get_api_key(db: AsyncSession, provider: str) -> Optional[str]:
-    """Получает API ключ из базы данных и расшифровывает его."""
+    """
+    Получает API ключ из базы данных и расшифровывает его.
+    Результат (в том числе отсутствие ключа) кешируется в памяти до изменения ключа.
+    """
+    cached, api_key = config_cache.get_api_key(provider)
+    if cached:
+        return api_key
+    generation = config_cache.generation
     try:
         query = await db.execute(
             ApiKey.__table__.select().where(ApiKey.provider == provider)
         )
         row = query.first()
-        if row:
-            # Расшифровываем ключ перед возвратом
-            return decrypt_data(row.encrypted_api_key)
-        return None
+        # Расшифровываем ключ перед возвратом
+        api_key = decrypt_data(row.encrypted_api_key) if row else None
+        config_cache.set_api_key(provider, api_key, generation)
+        return api_key
     except Exception as e:
         logger.error(f"Ошибка при получении API ключа для {provider}: {e}")
         return None
@@ -384,6 +688,7 @@ async def get_all_api_keys_info(db: AsyncSession) -> List[ApiKeyRead]:
 async def delete_api_key(db: AsyncSession, provider: str) -> bool:
     """Удаляет API ключ для провайдера."""
     from sqlalchemy import delete
+    _invalidate_config_cache(db, api_key_provider=provider)
     try:
         stmt = delete(ApiKey).where(ApiKey.provider == provider)
         result = await db.execute(stmt)
@@ -412,6 +717,7 @@ async def create_or_update_system_prompt(db: AsyncSession, prompt_data: SystemPr
     )
     result = await db.execute(stmt_select)
     db_prompt = result.scalar_one_or_none()
+    _invalidate_config_cache(db, system_prompts=True)
     
     try:
         if db_prompt:
@@ -454,32 +760,47 @@ async def create_or_update_system_prompt(db: AsyncSession, prompt_data: SystemPr
         await db.rollback()
         raise ValueError(f"Не удалось сохранить промт для {prompt_data.model_id}: {str(e)}")
 
+@tracing.traced("config.get_system_prompt")
 async def get_system_prompt(db: AsyncSession, model_id: str) -> Optional[str]:
-    """Получает текст системного промта для указанной модели."""
-    from sqlalchemy import select
-    stmt = select(SystemPrompt.prompt_text).where(
-        SystemPrompt.model_id == model_id,
-        SystemPrompt.is_default == True
-    )
-    result = await db.execute(stmt)
-    prompt_text = result.scalar_one_or_none()
+    """
+    Получает текст системного промта для указанной модели.
+    Все промты по умолчанию загружаются одним запросом и кешируются в памяти
+    до изменения любого из них, поэтому поиск не обращается к БД.
+    """
+    prompts = config_cache.get_system_prompts()
+    if prompts is None:
+        prompts = await _load_system_prompts(db)
+    by_model, by_provider = prompts
+    prompt_text = by_model.get(model_id)
     
     # Если промта нет для конкретной модели, попробуем найти для провайдера
     if not prompt_text and '/' in model_id:
-        provider = model_id.split('/')[0]
-        stmt = select(SystemPrompt.prompt_text).where(
-            SystemPrompt.model_id.like(f"{provider}/%"),
-            SystemPrompt.is_default == True
-        )
-        result = await db.execute(stmt)
-        prompt_text = result.scalar_one_or_none()
-        
+        prompt_text = by_provider.get(model_id.split('/')[0])
+
     # Если все равно нет, используем дефолтный из настроек
     if not prompt_text:
         return settings.default_system_prompt
         
     return prompt_text
 
+async def _load_system_prompts(db: AsyncSession) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Загружает промты по умолчанию: по модели и по провайдеру (промт первой модели провайдера)."""
+    from sqlalchemy import select
+    generation = config_cache.generation
+    stmt = select(SystemPrompt.model_id, SystemPrompt.prompt_text).where(
+        SystemPrompt.is_default == True
+    ).order_by(SystemPrompt.id)
+    result = await db.execute(stmt)
+    by_model: Dict[str, str] = {}
+    by_provider: Dict[str, str] = {}
+    for model_id, prompt_text in result:
+        by_model.setdefault(model_id, prompt_text)
+        if '/' in model_id:
+            # У провайдера может быть несколько моделей с промтами
+            by_provider.setdefault(model_id.split('/')[0], prompt_text)
+    config_cache.set_system_prompts(by_model, by_provider, generation)
+    return by_model, by_provider
+
 async def get_all_system_prompts(db: AsyncSession) -> List[SystemPromptRead]:
     """Получает все системные промты."""
     from sqlalchemy import select
@@ -492,6 +813,7 @@ async def get_all_system_prompts(db: AsyncSession) -> List[SystemPromptRead]:
 async def delete_system_prompt(db: AsyncSession, model_id: str) -> bool:
     """Удаляет системный промт для модели."""
     from sqlalchemy import delete
+    _invalidate_config_cache(db, system_prompts=True)
     try:
         stmt = delete(SystemPrompt).where(
             SystemPrompt.model_id == model_id,
@@ -697,12 +1019,201 @@ async def create_rating(db: AsyncSession, rating_data: RatingCreate, prompt_hash
         db.add(db_rating)
         await db.flush()
         await db.refresh(db_rating)
+        # Агрегат лидерборда обновляется в той же транзакции, что и сама оценка
+        await _add_rating_to_aggregate(db, db_rating.model_id, db_rating.rating, db_rating.timestamp)
         return db_rating
     except SQLAlchemyError as e:
         logger.error(f"Ошибка SQLAlchemy при сохранении рейтинга: {e}")
         await db.rollback()
         raise ValueError(f"Не удалось сохранить рейтинг: {str(e)}")
 
+async def create_ratings_bulk(db: AsyncSession, rows: List[Dict[str, Any]],
+                              journal: Optional[str] = None, last_seq: Optional[int] = None) -> None:
+    """
+    Вставляет пачку оценок одним executemany и обновляет агрегаты лидерборда
+    (по одному upsert на модель). Если передан журнал, в той же транзакции
+    сохраняется номер последней записанной записи журнала.
+    """
+    from sqlalchemy import insert
+    if not rows:
+        return
+    try:
+        await db.execute(insert(Rating), rows)
+        per_model: Dict[str, List[Any]] = {}
+        for row in rows:
+            stats = per_model.get(row["model_id"])
+            rating, timestamp = row["rating"], row["timestamp"]
+            if stats is None:
+                per_model[row["model_id"]] = [rating, 1, rating, rating, timestamp]
+            else:
+                stats[0] += rating
+                stats[1] += 1
+                stats[2] = min(stats[2], rating)
+                stats[3] = max(stats[3], rating)
+                stats[4] = max(stats[4], timestamp)
+        for model_id, (rating_sum, count, min_rating, max_rating, last_at) in per_model.items():
+            await _merge_into_aggregate(db, model_id, rating_sum, count, min_rating, max_rating, last_at)
+        if journal is not None and last_seq is not None:
+            checkpoint = await db.get(RatingJournalCheckpoint, journal)
+            if checkpoint is None:
+                db.add(RatingJournalCheckpoint(journal=journal, last_seq=last_seq))
+            else:
+                checkpoint.last_seq = last_seq
+            await db.flush()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка SQLAlchemy при пакетном сохранении {len(rows)} оценок: {e}")
+        await db.rollback()
+        raise ValueError(f"Не удалось сохранить пачку оценок: {str(e)}")
+
+async def get_rating_journal_checkpoint(db: AsyncSession, journal: str) -> int:
+    """Номер последней записи журнала буфера оценок, уже сохраненной в БД (0 - нет)."""
+    checkpoint = await db.get(RatingJournalCheckpoint, journal)
+    return checkpoint.last_seq if checkpoint is not None else 0
+
+async def delete_rating_journal_checkpoint(db: AsyncSession, journal: str) -> None:
+    """Удаляет контрольную точку журнала, который полностью записан в БД и удален."""
+    checkpoint = await db.get(RatingJournalCheckpoint, journal)
+    if checkpoint is not None:
+        await db.delete(checkpoint)
+        await db.flush()
+
+async def _add_rating_to_aggregate(db: AsyncSession, model_id: str, rating: int, timestamp: datetime.datetime) -> None:
+    """Учитывает одну оценку в model_rating_aggregates (upsert одним запросом)."""
+    await _merge_into_aggregate(db, model_id, rating, 1, rating, rating, timestamp)
+
+async def _merge_into_aggregate(db: AsyncSession, model_id: str, rating_sum: int, count: int,
+                                min_rating: int, max_rating: int, timestamp: datetime.datetime) -> None:
+    """Добавляет к model_rating_aggregates сумму и количество оценок модели (upsert одним запросом)."""
+    from sqlalchemy import case, update
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(ModelRatingAggregate).values(
+            model_id=model_id, rating_sum=rating_sum, rating_count=count,
+            min_rating=min_rating, max_rating=max_rating, last_rating_at=timestamp
+        )
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ModelRatingAggregate.model_id],
+            set_={
+                "rating_sum": ModelRatingAggregate.rating_sum + excluded.rating_sum,
+                "rating_count": ModelRatingAggregate.rating_count + excluded.rating_count,
+                "min_rating": case(
+                    (ModelRatingAggregate.min_rating.is_(None), excluded.min_rating),
+                    (excluded.min_rating < ModelRatingAggregate.min_rating, excluded.min_rating),
+                    else_=ModelRatingAggregate.min_rating
+                ),
+                "max_rating": case(
+                    (ModelRatingAggregate.max_rating.is_(None), excluded.max_rating),
+                    (excluded.max_rating > ModelRatingAggregate.max_rating, excluded.max_rating),
+                    else_=ModelRatingAggregate.max_rating
+                ),
+                "last_rating_at": excluded.last_rating_at,
+            }
+        )
+        await db.execute(stmt)
+        return
+
+    # Для остальных СУБД: обновление, а при отсутствии строки - вставка
+    result = await db.execute(
+        update(ModelRatingAggregate).where(ModelRatingAggregate.model_id == model_id).values(
+            rating_sum=ModelRatingAggregate.rating_sum + rating_sum,
+            rating_count=ModelRatingAggregate.rating_count + count,
+            min_rating=case((ModelRatingAggregate.min_rating > min_rating, min_rating), else_=ModelRatingAggregate.min_rating),
+            max_rating=case((ModelRatingAggregate.max_rating < max_rating, max_rating), else_=ModelRatingAggregate.max_rating),
+            last_rating_at=timestamp,
+        )
+    )
+    if result.rowcount == 0:
+        db.add(ModelRatingAggregate(
+            model_id=model_id, rating_sum=rating_sum, rating_count=count,
+            min_rating=min_rating, max_rating=max_rating, last_rating_at=timestamp
+        ))
+        await db.flush()
+
+async def reconcile_rating_aggregates(db: AsyncSession) -> int:
+    """
+    Сверяет model_rating_aggregates с таблицей ratings и исправляет расхождения
+    (например, после ручного удаления оценок или сбоя). Возвращает число исправленных моделей.
+    """
+    from sqlalchemy import select, update, delete, insert, exists
+
+    actual_stmt = select(
+        Rating.model_id,
+        func.sum(Rating.rating).label('rating_sum'),
+        func.count(Rating.id).label('rating_count'),
+        func.min(Rating.rating).label('min_rating'),
+        func.max(Rating.rating).label('max_rating'),
+        func.max(Rating.timestamp).label('last_rating_at')
+    ).group_by(Rating.model_id)
+    actual = {row.model_id: row for row in (await db.execute(actual_stmt)).all()}
+    stored = {
+        row.model_id: row for row in (await db.execute(select(
+            ModelRatingAggregate.model_id, ModelRatingAggregate.rating_sum, ModelRatingAggregate.rating_count,
+            ModelRatingAggregate.min_rating, ModelRatingAggregate.max_rating
+        ))).all()
+    }
+
+    def _differs(model_id: str) -> bool:
+        a, s = actual[model_id], stored[model_id]
+        return (a.rating_sum, a.rating_count, a.min_rating, a.max_rating) != (s.rating_sum, s.rating_count, s.min_rating, s.max_rating)
+
+    missing = [model_id for model_id in actual if model_id not in stored]
+    orphaned = [model_id for model_id in stored if model_id not in actual]
+    drifted = [model_id for model_id in actual if model_id in stored and _differs(model_id)]
+    if not (missing or orphaned or drifted):
+        return 0
+
+    def _subquery(column):
+        return select(column).where(Rating.model_id == ModelRatingAggregate.model_id).scalar_subquery()
+
+    if drifted:
+        # Значения пересчитываются внутри UPDATE, чтобы не затереть оценки, добавленные после чтения
+        await db.execute(
+            update(ModelRatingAggregate).where(ModelRatingAggregate.model_id.in_(drifted)).values(
+                rating_sum=_subquery(func.sum(Rating.rating)),
+                rating_count=_subquery(func.count(Rating.id)),
+                min_rating=_subquery(func.min(Rating.rating)),
+                max_rating=_subquery(func.max(Rating.rating)),
+                last_rating_at=_subquery(func.max(Rating.timestamp)),
+            )
+        )
+    if missing:
+        # Списки получены из снимка чтения: пока дошла очередь до записи, новая оценка могла
+        # создать строку агрегата. Значения берутся из ratings в момент вставки и заменяют ее
+        columns = ["model_id", "rating_sum", "rating_count", "min_rating", "max_rating", "last_rating_at"]
+        missing_rows = actual_stmt.where(Rating.model_id.in_(missing))
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            stmt = upsert(ModelRatingAggregate).from_select(columns, missing_rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ModelRatingAggregate.model_id],
+                set_={column: getattr(stmt.excluded, column) for column in columns[1:]}
+            )
+        else:
+            # Для остальных СУБД: вставляются только модели, у которых строки все еще нет
+            stmt = insert(ModelRatingAggregate).from_select(columns, missing_rows.where(
+                ~exists().where(ModelRatingAggregate.model_id == Rating.model_id)
+            ))
+        await db.execute(stmt)
+    if orphaned:
+        # Строка удаляется, только если у модели по-прежнему нет оценок
+        await db.execute(delete(ModelRatingAggregate).where(
+            ModelRatingAggregate.model_id.in_(orphaned),
+            ~exists().where(Rating.model_id == ModelRatingAggregate.model_id)
+        ))
+    await db.commit()
+
+    logger.info(f"Агрегаты рейтингов сверены: добавлено {len(missing)}, исправлено {len(drifted)}, удалено {len(orphaned)}")
+    return len(missing) + len(drifted) + len(orphaned)
+
 async def get_ratings_for_model(db: AsyncSession, model_id: str, limit: int = 100) -> List[RatingRead]:
     """Получает последние N оценок для конкретной модели."""
     from sqlalchemy import select
@@ -714,31 +1225,22 @@ async def get_ratings_for_model(db: AsyncSession, model_id: str, limit: int = 10
 async def get_leaderboard_data(db: AsyncSession, category: Optional[str] = None) -> List[Tuple[str, float, int]]:
     """
     Получает агрегированные данные для лидерборда: (model_id, avg_rating, count).
-    Фильтрует по категории, если она указана (пока фильтрация по категории не реализована на уровне БД,
-    т.к. нет связи модели с категорией в таблице Rating).
+    Читает материализованную таблицу model_rating_aggregates (одна строка на модель),
+    а не сканирует все оценки.
+    Фильтрация по категории выполняется в data_logic, т.к. категория модели не хранится в БД.
     """
-    from sqlalchemy import select, func
+    from sqlalchemy import select, Float as SAFloat, cast
 
-    # Группируем по model_id и вычисляем средний рейтинг и количество оценок
+    average_rating = (cast(ModelRatingAggregate.rating_sum, SAFloat) / ModelRatingAggregate.rating_count).label('average_rating')
     stmt = (
-        select(
-            Rating.model_id,
-            func.avg(Rating.rating).label('average_rating'),
-            func.count(Rating.id).label('rating_count')
-        )
-        .group_by(Rating.model_id)
-        .order_by(func.avg(Rating.rating).desc(), func.count(Rating.id).desc()) # Сортируем по среднему рейтингу, затем по количеству
+        select(ModelRatingAggregate.model_id, average_rating, ModelRatingAggregate.rating_count)
+        .where(ModelRatingAggregate.rating_count > 0)
+        .order_by(average_rating.desc(), ModelRatingAggregate.rating_count.desc()) # Сортируем по среднему рейтингу, затем по количеству
     )
 
-    # TODO: Добавить фильтрацию по категории, если это возможно
-    # if category:
-    #    # Потребуется JOIN с таблицей моделей или передача списка model_id для категории
-    #    pass
-
     try:
         result = await db.execute(stmt)
         # Возвращаем список кортежей (model_id, avg_rating, count)
-        # Преобразуем avg_rating в float, т.к. func.avg может вернуть Decimal
         leaderboard_raw = [(row.model_id, float(row.average_rating), row.rating_count) for row in result.all()]
         logger.debug(f"Сырые данные для лидерборда: {leaderboard_raw}")
         return leaderboard_raw
@@ -747,25 +1249,104 @@ async def get_leaderboard_data(db: AsyncSession, category: Optional[str] = None)
         # Не выполняем rollback, так как это запрос на чтение
         raise ValueError(f"Не удалось получить данные лидерборда: {str(e)}")
 
+# --- Попарные сравнения и рейтинги Эло / Брэдли-Терри ---
+
+async def create_comparison_vote(db: AsyncSession, model_a: str, model_b: str, winner: str,
+                                 prompt_hash: Optional[str] = None,
+                                 user_identifier: Optional[str] = None) -> ComparisonVote:
+    """Добавляет голос попарного сравнения (без коммита)."""
+    vote = ComparisonVote(
+        model_a=model_a,
+        model_b=model_b,
+        winner=winner,
+        prompt_hash=prompt_hash,
+        user_identifier=user_identifier,
+    )
+    db.add(vote)
+    await db.flush()
+    return vote
+
+async def get_elo_ratings(db: AsyncSession, model_ids: List[str]) -> Dict[str, ModelEloRating]:
+    """Получает строки рейтинга Эло для указанных моделей (по первичному ключу)."""
+    from sqlalchemy import select
+    result = await db.execute(select(ModelEloRating).where(ModelEloRating.model_id.in_(model_ids)))
+    return {row.model_id: row for row in result.scalars()}
+
+async def get_elo_leaderboard_data(db: AsyncSession) -> List[Tuple[str, float, int]]:
+    """Получает (model_id, elo, games), отсортированные по рейтингу Эло."""
+    from sqlalchemy import select
+    stmt = select(ModelEloRating.model_id, ModelEloRating.elo, ModelEloRating.games).order_by(ModelEloRating.elo.desc())
+    result = await db.execute(stmt)
+    return [(row.model_id, row.elo, row.games) for row in result.all()]
+
+async def get_all_comparison_outcomes(db: AsyncSession) -> List[Tuple[str, str, str]]:
+    """Получает все сравнения в виде (model_a, model_b, winner) для пакетного пересчета."""
+    from sqlalchemy import select
+    result = await db.execute(select(ComparisonVote.model_a, ComparisonVote.model_b, ComparisonVote.winner))
+    return [tuple(row) for row in result.all()]
+
+async def save_rating_snapshot(db: AsyncSession, snapshot_id: str, method: str, rows: List[Dict[str, Any]],
+                               keep: int = 20) -> None:
+    """Сохраняет снимок рейтингов и удаляет старые снимки этого метода, оставляя `keep` последних."""
+    from sqlalchemy import select, delete
+    now = datetime.datetime.utcnow()
+    db.add_all([RatingSnapshot(snapshot_id=snapshot_id, method=method, created_at=now, **row) for row in rows])
+    await db.flush()
+
+    recent = (
+        select(RatingSnapshot.snapshot_id)
+        .where(RatingSnapshot.method == method)
+        .group_by(RatingSnapshot.snapshot_id)
+        .order_by(func.max(RatingSnapshot.created_at).desc())
+        .limit(keep)
+    )
+    await db.execute(
+        delete(RatingSnapshot).where(RatingSnapshot.method == method, RatingSnapshot.snapshot_id.not_in(recent))
+    )
+    await db.commit()
+
+async def get_latest_rating_snapshot(db: AsyncSession, method: str) -> List[RatingSnapshot]:
+    """Получает строки последнего снимка рейтингов указанного метода, отсортированные по score."""
+    from sqlalchemy import select
+    latest = (
+        select(RatingSnapshot.snapshot_id)
+        .where(RatingSnapshot.method == method)
+        .order_by(RatingSnapshot.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = select(RatingSnapshot).where(RatingSnapshot.snapshot_id == latest).order_by(RatingSnapshot.score.desc())
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+async def get_rating_aggregates(db: AsyncSession) -> Dict[str, Tuple[float, int]]:
+    """Получает средний балл и число оценок по всем моделям: {model_id: (avg, count)}."""
+    from sqlalchemy import select
+    result = await db.execute(
+        select(ModelRatingAggregate.model_id, ModelRatingAggregate.rating_sum, ModelRatingAggregate.rating_count)
+        .where(ModelRatingAggregate.rating_count > 0)
+    )
+    return {row.model_id: (row.rating_sum / row.rating_count, row.rating_count) for row in result.all()}
+
 # --- Дополнительные полезные функции ---
 
 async def get_model_rating_stats(db: AsyncSession, model_id: str) -> Dict[str, Any]:
     """Получает статистику рейтингов для конкретной модели."""
-    from sqlalchemy import select, func
+    from sqlalchemy import select
     
     try:
-        # Собираем несколько метрик в одном запросе
+        # Метрики берем из материализованных агрегатов (одна строка по ключу)
         stmt = select(
-            func.avg(Rating.rating).label('avg_rating'),
-            func.min(Rating.rating).label('min_rating'),
-            func.max(Rating.rating).label('max_rating'),
-            func.count(Rating.id).label('rating_count')
-        ).where(Rating.model_id == model_id)
+            ModelRatingAggregate.rating_sum,
+            ModelRatingAggregate.min_rating,
+            ModelRatingAggregate.max_rating,
+            ModelRatingAggregate.rating_count
+        ).where(ModelRatingAggregate.model_id == model_id)
         
         result = await db.execute(stmt)
         row = result.one_or_none()
         
-        if not row:
+        if not row or not row.rating_count:
             return {
                 "model_id": model_id,
                 "average_rating": 0.0,
@@ -776,7 +1357,7 @@ async def get_model_rating_stats(db: AsyncSession, model_id: str) -> Dict[str, A
             
         return {
             "model_id": model_id,
-            "average_rating": float(row.avg_rating) if row.avg_rating else 0.0,
+            "average_rating": row.rating_sum / row.rating_count,
             "min_rating": row.min_rating or 0,
             "max_rating": row.max_rating or 0,
             "rating_count": row.rating_count or 0
@@ -807,25 +1388,23 @@ async def get_rating_statistics(db: AsyncSession) -> Dict[str, Any]:
     from sqlalchemy import select, func
     
     try:
-        # Общее количество рейтингов
-        stmt_count = select(func.count()).select_from(Rating)
-        result_count = await db.execute(stmt_count)
-        total_ratings = result_count.scalar() or 0
-        
-        # Общее количество уникальных моделей с рейтингами
-        stmt_models = select(func.count(Rating.model_id.distinct()))
-        result_models = await db.execute(stmt_models)
-        unique_models = result_models.scalar() or 0
+        # Общие счетчики считаются по материализованным агрегатам (строка на модель)
+        stmt_totals = select(
+            func.coalesce(func.sum(ModelRatingAggregate.rating_count), 0).label('total_ratings'),
+            func.count(ModelRatingAggregate.model_id).label('unique_models'),
+            func.coalesce(func.sum(ModelRatingAggregate.rating_sum), 0).label('rating_sum')
+        ).where(ModelRatingAggregate.rating_count > 0)
+        totals = (await db.execute(stmt_totals)).one()
+        total_ratings = totals.total_ratings
+        unique_models = totals.unique_models
         
-        # Средний рейтинг по всем моделям
-        stmt_avg = select(func.avg(Rating.rating))
-        result_avg = await db.execute(stmt_avg)
-        average_rating = float(result_avg.scalar() or 0)
+        # Средний рейтинг по всем оценкам
+        average_rating = float(totals.rating_sum) / total_ratings if total_ratings else 0.0
         
         # Количество рейтингов по провайдерам
         stmt_providers = select(
-            func.substr(Rating.model_id, 1, func.instr(Rating.model_id, '/')-1).label('provider'),
-            func.count().label('count')
+            func.substr(ModelRatingAggregate.model_id, 1, func.instr(ModelRatingAggregate.model_id, '/')-1).label('provider'),
+            func.sum(ModelRatingAggregate.rating_count).label('count')
         ).group_by('provider')
         result_providers = await db.execute(stmt_providers)
         providers_stats = {row.provider: row.count for row in result_providers}
@@ -856,4 +1435,169 @@ async def get_rating_statistics(db: AsyncSession) -> Dict[str, Any]:
             "total_ratings": 0,
             "unique_models": 0,
             "average_rating": 0.0
-        }
\ No newline at end of file
+        }
+
+# --- Функции для заданий пакетной оценки ---
+
+async def create_eval_job(db: AsyncSession, job_id: str, prompts: List[str], model_ids: List[str],
+                          params: Dict[str, Any], username: Optional[str] = None) -> EvalJob:
+    """Создает задание и все его ячейки (промты × модели) одной транзакцией."""
+    import json
+    job = EvalJob(
+        id=job_id,
+        status="pending",
+        params=json.dumps(params, ensure_ascii=False),
+        model_ids=json.dumps(model_ids, ensure_ascii=False),
+        prompt_count=len(prompts),
+        total_cells=len(prompts) * len(model_ids),
+        created_by=username,
+    )
+    db.add(job)
+    # Порядок "промт, затем модели" чередует провайдеров в очереди
+    db.add_all([
+        EvalJobCell(job_id=job_id, prompt_index=index, prompt_text=prompt, model_id=model_id)
+        for index, prompt in enumerate(prompts)
+        for model_id in model_ids
+    ])
+    await db.commit()
+    return job
+
+async def get_eval_job(db: AsyncSession, job_id: str) -> Optional[EvalJob]:
+    """Получает задание по ID."""
+    return await db.get(EvalJob, job_id)
+
+async def list_eval_jobs(db: AsyncSession, limit: int = 50, statuses: Optional[List[str]] = None) -> List[EvalJob]:
+    """Получает последние задания (опционально только с указанными статусами)."""
+    from sqlalchemy import select
+    stmt = select(EvalJob).order_by(EvalJob.created_at.desc()).limit(limit)
+    if statuses:
+        stmt = stmt.where(EvalJob.status.in_(statuses))
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+async def get_pending_eval_cells(db: AsyncSession, job_id: str) -> List[EvalJobCell]:
+    """Получает невыполненные ячейки задания."""
+    from sqlalchemy import select
+    stmt = select(EvalJobCell).where(
+        EvalJobCell.job_id == job_id,
+        EvalJobCell.status == "pending"
+    ).order_by(EvalJobCell.id)
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+async def get_eval_cells_after(db: AsyncSession, job_id: str, after_seq: int = 0, limit: int = 500) -> List[EvalJobCell]:
+    """Получает завершенные ячейки задания в порядке завершения, начиная после after_seq."""
+    from sqlalchemy import select
+    stmt = select(EvalJobCell).where(
+        EvalJobCell.job_id == job_id,
+        EvalJobCell.seq > after_seq
+    ).order_by(EvalJobCell.seq).limit(limit)
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+async def get_eval_job_max_seq(db: AsyncSession, job_id: str) -> int:
+    """Последний выданный порядковый номер завершения в задании."""
+    from sqlalchemy import select
+    result = await db.execute(select(func.max(EvalJobCell.seq)).where(EvalJobCell.job_id == job_id))
+    return result.scalar() or 0
+
+async def save_eval_cell_result(db: AsyncSession, cell_id: int, job_id: str, seq: int, response: str,
+                                error: Optional[str], elapsed_time: Optional[float],
+                                token_count: Optional[Dict[str, Any]]) -> None:
+    """Сохраняет результат ячейки и обновляет счетчики задания одной транзакцией."""
+    import json
+    from sqlalchemy import update
+    status = "failed" if error else "completed"
+    await db.execute(
+        update(EvalJobCell).where(EvalJobCell.id == cell_id).values(
+            status=status,
+            seq=seq,
+            response=response,
+            error=error,
+            elapsed_time=elapsed_time,
+            token_count=json.dumps(token_count) if token_count else None,
+            completed_at=datetime.datetime.utcnow(),
+        )
+    )
+    counter = EvalJob.failed_cells if error else EvalJob.completed_cells
+    await db.execute(
+        update(EvalJob).where(EvalJob.id == job_id).values({counter.key: counter + 1})
+    )
+    await db.commit()
+
+async def set_eval_job_status(db: AsyncSession, job_id: str, status: str) -> None:
+    """Обновляет статус задания и отметки времени начала/завершения."""
+    from sqlalchemy import update
+    values: Dict[str, Any] = {"status": status}
+    now = datetime.datetime.utcnow()
+    if status == "running":
+        values["started_at"] = func.coalesce(EvalJob.started_at, now)
+    elif status in ("completed", "cancelled", "failed"):
+        values.update(finished_at=now, owner=None, lease_until=None)
+    await db.execute(update(EvalJob).where(EvalJob.id == job_id).values(**values))
+    await db.commit()
+
+async def claim_eval_job(db: AsyncSession, job_id: str, owner: str, lease_seconds: float) -> bool:
+    """
+    Атомарно захватывает незавершенное задание для процесса owner, если оно свободно
+    или аренда прошлого владельца истекла. Возвращает False, если задание выполняет другой процесс.
+    """
+    from sqlalchemy import or_, update
+    now = datetime.datetime.utcnow()
+    result = await db.execute(
+        update(EvalJob).where(
+            EvalJob.id == job_id,
+            EvalJob.status.in_(("pending", "running")),
+            or_(EvalJob.owner.is_(None), EvalJob.owner == owner, EvalJob.lease_until < now),
+        ).values(
+            status="running",
+            owner=owner,
+            lease_until=now + datetime.timedelta(seconds=lease_seconds),
+            started_at=func.coalesce(EvalJob.started_at, now),
+        )
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def renew_eval_job_lease(db: AsyncSession, job_id: str, owner: str, lease_seconds: float) -> bool:
+    """Продлевает аренду задания. False - задание отменено, завершено или перешло к другому процессу."""
+    from sqlalchemy import update
+    result = await db.execute(
+        update(EvalJob).where(
+            EvalJob.id == job_id, EvalJob.owner == owner, EvalJob.status == "running"
+        ).values(lease_until=datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds))
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def release_eval_jobs(db: AsyncSession, job_ids: List[str], owner: str) -> None:
+    """Освобождает задания процесса при остановке, чтобы их сразу продолжил другой процесс."""
+    from sqlalchemy import update
+    if not job_ids:
+        return
+    await db.execute(
+        update(EvalJob).where(EvalJob.id.in_(job_ids), EvalJob.owner == owner).values(owner=None, lease_until=None)
+    )
+    await db.commit()
+
+# --- Снимок каталога моделей ---
+
+async def get_model_catalog_snapshot(db: AsyncSession) -> List[Tuple[str, str, datetime.datetime]]:
+    """Возвращает сохраненный каталог: (provider, models_json, fetched_at) по провайдерам."""
+    from sqlalchemy import select
+    result = await db.execute(
+        select(ModelCatalogEntry.provider, ModelCatalogEntry.models_json, ModelCatalogEntry.fetched_at)
+    )
+    return [tuple(row) for row in result.all()]
+
+async def save_model_catalog_snapshot(db: AsyncSession, entries: Dict[str, Tuple[str, int, datetime.datetime]],
+                                      removed: List[str]) -> None:
+    """Сохраняет списки моделей провайдеров {provider: (models_json, count, fetched_at)} и удаляет removed."""
+    from sqlalchemy import delete
+    if removed:
+        await db.execute(delete(ModelCatalogEntry).where(ModelCatalogEntry.provider.in_(removed)))
+    for provider, (models_json, model_count, fetched_at) in entries.items():
+        await db.merge(ModelCatalogEntry(
+            provider=provider, models_json=models_json, model_count=model_count, fetched_at=fetched_at
+        ))
+    await db.commit()
@@ -0,0 +1,333 @@
+# backend/jobs.py
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from backend import database, models_io
+from backend.config import settings, EvalJobCreate, EvalJobRead, InteractionRequest, InteractionResponse
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых задание больше не выполняется
+TERMINAL_STATUSES = ("completed", "cancelled", "failed")
+
+# Общие параметры генерации, которые задание передает в каждый запрос
+_JOB_PARAM_FIELDS = (
+    "max_tokens", "temperature", "system_prompt", "top_p",
+    "frequency_penalty", "presence_penalty", "stop_sequences",
+)
+
+
+def _process_owner() -> str:
+    """Идентификатор процесса-владельца заданий (хост, PID и случайный суффикс)."""
+    return f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def job_to_dict(job: database.EvalJob) -> Dict[str, Any]:
+    """Преобразует задание из БД в словарь для EvalJobRead."""
+    return {
+        "id": job.id,
+        "status": job.status,
+        "model_ids": json.loads(job.model_ids),
+        "prompt_count": job.prompt_count,
+        "total_cells": job.total_cells,
+        "completed_cells": job.completed_cells,
+        "failed_cells": job.failed_cells,
+        "created_by": job.created_by,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def cell_to_dict(cell: database.EvalJobCell) -> Dict[str, Any]:
+    """Преобразует ячейку задания из БД в словарь для EvalJobCellRead."""
+    return {
+        "seq": cell.seq,
+        "prompt_index": cell.prompt_index,
+        "model_id": cell.model_id,
+        "status": cell.status,
+        "response": cell.response,
+        "error": cell.error,
+        "elapsed_time": cell.elapsed_time,
+        "token_count": json.loads(cell.token_count) if cell.token_count else None,
+    }
+
+
+class EvalJobManager:
+    """
+    Выполняет задания пакетной оценки (промты × модели) в фоне.
+
+    Каждое задание обрабатывается пулом воркеров; одновременные запросы задания
+    к одному провайдеру дополнительно ограничены семафором. Результат каждой
+    ячейки сразу сохраняется в БД, поэтому после перезапуска задание продолжается
+    с невыполненных ячеек. Запросы идут через run_single_inference, так что
+    кеш ответов, объединение одинаковых запросов и планировщик провайдеров
+    работают и для заданий.
+
+    При нескольких воркерах uvicorn задание выполняет один процесс: перед запуском
+    задание атомарно захватывается в БД на срок аренды, которую владелец продлевает.
+    Задания упавшего процесса подхватываются другими после истечения аренды,
+    а отмена из другого процесса останавливает задание при продлении.
+    """
+
+    def __init__(self, workers: int, provider_concurrency: int, max_cells: int, lease_seconds: float = 60.0):
+        self.workers = workers
+        self.provider_concurrency = provider_concurrency
+        self.max_cells = max_cells
+        self.lease_seconds = lease_seconds
+        self._owner = _process_owner()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._seq: Dict[str, int] = {}
+        # Событие прогресса задания; заменяется новым после каждого срабатывания
+        self._progress: Dict[str, asyncio.Event] = {}
+
+    # --- Жизненный цикл ---
+
+    async def start(self) -> None:
+        """Возобновляет задания, прерванные остановкой приложения, и следит за арендой."""
+        # Воркер мог получить менеджер после fork: владелец должен быть свой у каждого процесса
+        self._owner = _process_owner()
+        await self._resume_orphaned()
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(), name="eval_jobs_watch")
+
+    async def stop(self) -> None:
+        """Останавливает выполняющиеся задания и освобождает их. Невыполненные ячейки остаются в БД."""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+        job_ids = list(self._tasks)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        try:
+            async with database.AsyncSessionFactory() as db:
+                await database.release_eval_jobs(db, job_ids, self._owner)
+        except Exception as e:
+            logger.warning(f"Не удалось освободить задания оценки, их продолжат после истечения аренды: {e}")
+
+    async def _resume_orphaned(self) -> None:
+        """Запускает незавершенные задания без владельца или с истекшей арендой."""
+        now = datetime.datetime.utcnow()
+        async with database.AsyncSessionFactory() as db:
+            jobs = await database.list_eval_jobs(db, limit=1000, statuses=["pending", "running"])
+        for job in jobs:
+            if job.id in self._tasks or (job.owner is not None and job.lease_until is not None and job.lease_until >= now):
+                continue
+            logger.info(f"Возобновление задания оценки {job.id} ({job.completed_cells + job.failed_cells}/{job.total_cells})")
+            self._launch(job.id)
+
+    async def _watch(self) -> None:
+        """Продлевает аренду своих заданий и подхватывает задания завершившихся процессов."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                for job_id, task in list(self._tasks.items()):
+                    async with database.AsyncSessionFactory() as db:
+                        renewed = await database.renew_eval_job_lease(db, job_id, self._owner, self.lease_seconds)
+                    if not renewed:
+                        # Задание отменено в другом процессе или перешло к другому владельцу
+                        logger.info(f"Задание оценки {job_id} больше не принадлежит процессу, выполнение остановлено")
+                        task.cancel()
+                await self._resume_orphaned()
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды заданий оценки: {e}")
+
+    def _launch(self, job_id: str) -> None:
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run_job(job_id), name=f"eval_job_{job_id}")
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    # --- Управление заданиями ---
+
+    async def submit(self, request: EvalJobCreate, username: Optional[str] = None) -> database.EvalJob:
+        """
+        Создает задание и запускает его. Промты берутся из списка и шаблонов.
+        Выбрасывает ValueError, если набор промтов пуст, шаблон не найден
+        или задание слишком большое.
+        """
+        prompts = [prompt for prompt in request.prompts if prompt.strip()]
+        model_ids = list(dict.fromkeys(request.model_ids))  # без дублей, с сохранением порядка
+
+        async with database.AsyncSessionFactory() as db:
+            for template_id in request.template_ids:
+                template = await database.get_prompt_template_by_id(db, template_id, username)
+                if template is None:
+                    raise ValueError(f"Шаблон промта {template_id} не найден")
+                prompts.append(template.prompt_text)
+
+            if not prompts:
+                raise ValueError("Не указано ни одного промта")
+            total_cells = len(prompts) * len(model_ids)
+            if total_cells > self.max_cells:
+                raise ValueError(f"Задание содержит {total_cells} запросов, максимум {self.max_cells}")
+
+            params = request.model_dump(include=set(_JOB_PARAM_FIELDS), exclude_none=True)
+            job_id = str(uuid.uuid4())
+            job = await database.create_eval_job(db, job_id, prompts, model_ids, params, username)
+
+        logger.info(f"Создано задание оценки {job_id}: {len(prompts)} промтов × {len(model_ids)} моделей")
+        self._launch(job_id)
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        """Отменяет задание. Возвращает False, если задание уже завершено."""
+        async with database.AsyncSessionFactory() as db:
+            job = await database.get_eval_job(db, job_id)
+            if job is None or job.status in TERMINAL_STATUSES:
+                return False
+            task = self._tasks.get(job_id)
+            if task is None:
+                await database.set_eval_job_status(db, job_id, "cancelled")
+                self._notify(job_id)
+                return True
+
+        self._cancelled.add(job_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def iter_results(self, job_id: str, after: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Выдает результаты ячеек в порядке завершения, начиная после `after`,
+        и ждет новые, пока задание выполняется. Последнее событие - `done`.
+        """
+        while True:
+            # Событие берется до чтения из БД, чтобы не пропустить сохраненный между ними результат
+            progress = self._progress.setdefault(job_id, asyncio.Event())
+            async with database.AsyncSessionFactory() as db:
+                cells = await database.get_eval_cells_after(db, job_id, after)
+                job = await database.get_eval_job(db, job_id)
+                if job is None:
+                    return
+                events = [{"event": "result", **cell_to_dict(cell)} for cell in cells]
+                job_state = job_to_dict(job)
+
+            for event in events:
+                after = event["seq"]
+                yield event
+
+            if events:
+                continue
+            if job_state["status"] in TERMINAL_STATUSES:
+                yield {"event": "done", "job": EvalJobRead(**job_state).model_dump(mode="json")}
+                return
+            try:
+                await asyncio.wait_for(progress.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self, job_id: str) -> None:
+        progress = self._progress.pop(job_id, None)
+        if progress is not None:
+            progress.set()
+
+    # --- Выполнение ---
+
+    async def _run_job(self, job_id: str) -> None:
+        async with database.AsyncSessionFactory() as db:
+            job = await database.get_eval_job(db, job_id)
+            if job is None or job.status in TERMINAL_STATUSES:
+                return
+            params = json.loads(job.params) if job.params else {}
+            if not await database.claim_eval_job(db, job_id, self._owner, self.lease_seconds):
+                logger.debug(f"Задание оценки {job_id} выполняет другой процесс")
+                return
+            cells = [
+                (cell.id, cell.prompt_text, cell.model_id)
+                for cell in await database.get_pending_eval_cells(db, job_id)
+            ]
+            self._seq[job_id] = await database.get_eval_job_max_seq(db, job_id)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for cell in cells:
+            queue.put_nowait(cell)
+        provider_limits = defaultdict(lambda: asyncio.Semaphore(self.provider_concurrency))
+
+        workers = [
+            asyncio.create_task(self._worker(job_id, queue, params, provider_limits), name=f"eval_job_{job_id}_{i}")
+            for i in range(min(self.workers, len(cells)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                await self._finish(job_id, "cancelled")
+                logger.info(f"Задание оценки {job_id} отменено")
+            raise
+        except Exception as e:
+            logger.error(f"Задание оценки {job_id} завершилось с ошибкой: {e}", exc_info=True)
+            await self._finish(job_id, "failed")
+            return
+        finally:
+            self._seq.pop(job_id, None)
+
+        await self._finish(job_id, "completed")
+        logger.info(f"Задание оценки {job_id} завершено")
+
+    async def _finish(self, job_id: str, status: str) -> None:
+        async with database.AsyncSessionFactory() as db:
+            await database.set_eval_job_status(db, job_id, status)
+        self._notify(job_id)
+
+    async def _worker(self, job_id: str, queue: asyncio.Queue, params: Dict[str, Any],
+                      provider_limits: Dict[str, asyncio.Semaphore]) -> None:
+        while True:
+            try:
+                cell_id, prompt, model_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            provider = model_id.split("/", 1)[0]
+            async with provider_limits[provider]:
+                request = InteractionRequest(model_id=model_id, prompt=prompt, **params)
+                response = await models_io.run_single_inference_isolated(request)
+
+            # Номер выдается синхронно, поэтому уникален в пределах задания
+            self._seq[job_id] += 1
+            save = asyncio.ensure_future(self._save_result(job_id, cell_id, self._seq[job_id], response))
+            try:
+                await asyncio.shield(save)
+            except asyncio.CancelledError:
+                # Полученный ответ сохраняем даже при остановке, чтобы не запрашивать его повторно
+                await save
+                raise
+            self._notify(job_id)
+
+    async def _save_result(self, job_id: str, cell_id: int, seq: int, response: InteractionResponse) -> None:
+        async with database.AsyncSessionFactory() as db:
+            await database.save_eval_cell_result(
+                db, cell_id, job_id, seq,
+                response=response.response,
+                error=response.error,
+                elapsed_time=response.elapsed_time,
+                token_count=response.token_count,
+            )
+
+
+job_manager = EvalJobManager(
+    workers=settings.eval_job_workers,
+    provider_concurrency=settings.eval_job_provider_concurrency,
+    max_cells=settings.eval_job_max_cells,
+    lease_seconds=settings.eval_job_lease_seconds,
+)
@@ -0,0 +1,137 @@
+# backend/loop_monitor.py
+
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from backend import metrics
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Пул потоков для блокирующих вызовов SDK ---
+
+# Отдельный ограниченный пул, а не пул по умолчанию (asyncio.to_thread): зависший
+# запрос к API провайдера не займет потоки, нужные SQLite и кешу
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(
+            max_workers=settings.blocking_io_workers, thread_name_prefix="blocking-io"
+        )
+    return _blocking_executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Выполняет блокирующую функцию в пуле потоков, не останавливая цикл событий.
+    По истечении timeout (по умолчанию blocking_io_timeout) выбрасывает asyncio.TimeoutError;
+    сам поток прервать нельзя, он освободится после завершения вызова.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout=settings.blocking_io_timeout if timeout is None else timeout)
+
+
+def shutdown_executor() -> None:
+    """Останавливает пул потоков, не дожидаясь зависших вызовов."""
+    global _blocking_executor
+    if _blocking_executor is not None:
+        _blocking_executor.shutdown(wait=False, cancel_futures=True)
+        _blocking_executor = None
+
+
+# --- Детектор блокировок цикла событий ---
+
+class LoopMonitor:
+    """
+    Обнаруживает блокировки цикла событий дольше threshold_ms.
+
+    Задача-пульс в цикле событий отмечает время каждые threshold/2. Сторожевой поток
+    проверяет отметку: если пульса нет дольше порога, он один раз записывает в лог
+    стек потока цикла событий - то есть код, который блокирует цикл прямо сейчас.
+    После разблокировки пульс записывает итоговую длительность блокировки.
+    Накладные расходы - одно пробуждение задачи и потока на интервал.
+    """
+
+    def __init__(self, threshold_ms: float = 100.0):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = self.threshold / 2
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stack_reported = False
+        self.blocks = 0
+        self.max_block_ms = 0.0
+        self.total_block_ms = 0.0
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._last_beat = started
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            metrics.event_loop_lag.observe(max(lag, 0.0))
+            if lag > self.threshold:
+                lag_ms = lag * 1000
+                self.blocks += 1
+                self.total_block_ms += lag_ms
+                self.max_block_ms = max(self.max_block_ms, lag_ms)
+                logger.warning(f"Цикл событий был заблокирован на {lag_ms:.0f} мс (порог {self.threshold * 1000:.0f} мс)")
+            self._stack_reported = False
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._last_beat
+            if stalled <= self.interval + self.threshold or self._stack_reported:
+                continue
+            self._stack_reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "стек недоступен\n"
+            logger.warning(f"Цикл событий не отвечает {stalled * 1000:.0f} мс. Текущий стек:\n{stack}")
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop_monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Детектор блокировок цикла событий включен (порог {self.threshold * 1000:.0f} мс)")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None,
+            "threshold_ms": self.threshold * 1000,
+            "blocks": self.blocks,
+            "max_block_ms": round(self.max_block_ms, 1),
+            "total_block_ms": round(self.total_block_ms, 1),
+        }
+
+
+loop_monitor = LoopMonitor(threshold_ms=settings.loop_block_threshold_ms or 100.0)
@@ -1,17 +1,19 @@
 # backend/main.py
 
+import time
+_boot_started = time.perf_counter()  # Для отчета о времени запуска
+
 import logging
 from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any, Union, Tuple
 import os
-import time
 import asyncio
-from collections import defaultdict
 from datetime import timedelta
 import json
+import math
 
-from fastapi import FastAPI, Depends, HTTPException, Request, status, Path, Query, BackgroundTasks, APIRouter
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, status, Path, Query, BackgroundTasks, APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -20,10 +22,17 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAu
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Импорты из нашего проекта
-from backend import database, data_logic, models_io, auth, utils
+from backend import database, data_logic, models_io, auth, utils, jobs, rating_engine, metrics, tracing
+from backend.rating_buffer import rating_buffer
+from backend.model_catalog import model_catalog
+from backend import loop_monitor
+from backend.rate_limit import GcraLimiter, RateLimitRule, RuleMatcher, SharedWindowLimiter
+from backend.shared_state import SharedState, shared_state
 from backend.config import (
     settings, ApiKeyCreate, ApiKeyRead, ModelInfo, InteractionRequest,
-    InteractionResponse, ComparisonRequest, ComparisonResponse, RatingCreate, RatingRead,
+    InteractionResponse, ComparisonRequest, ComparisonResponse, MultiModelRequest, MultiModelResponse,
+    EvalJobCreate, EvalJobRead, ModelSearchResponse,
+    RatingCreate, RatingRead, RatingReceipt, ComparisonVoteCreate, ComparisonVoteRead,
     LeaderboardEntry, CategoryInfo, SUPPORTED_PROVIDERS, SystemPromptCreate, SystemPromptRead,
     Token, User, PromptTemplateCreate, PromptTemplateRead, PromptTemplateUpdate
 )
@@ -110,9 +119,16 @@ async def lifespan(app: FastAPI):
     if missing_critical:
         logger.warning("⚠️ Запуск с отсутствующими критическими зависимостями! Некоторая функциональность будет недоступна.")
     
+    # SDK провайдеров не импортируются при запуске, только при первом обращении к провайдеру
+    sdk_report = models_io.sdk_loader.report()
+    installed_sdks = [provider for provider, info in sdk_report.items() if info["installed"]]
+    logger.info(f"SDK провайдеров (ленивая загрузка): установлены {', '.join(installed_sdks) or 'нет'}")
+    
     try:
         await database.init_db()
         logger.info("База данных успешно инициализирована.")
+        # Каталог моделей из снимка прошлого запуска; списки провайдеров обновятся в фоне
+        await model_catalog.load()
         
         # Выводим информацию о доступе
         access_links = utils.generate_access_links(port=settings.port, secure=False)
@@ -147,31 +163,117 @@ async def lifespan(app: FastAPI):
         logger.critical("КРИТИЧЕСКАЯ ОШИБКА: Не удалось инициализировать базу данных!", exc_info=e)
         raise SystemExit("Не удалось инициализировать БД.")
 
+    # Персистентный уровень кеша ответов (опционально)
+    if settings.response_cache_persist:
+        try:
+            from backend.cache_store import ResponseCacheStore
+            store = ResponseCacheStore(
+                path=settings.response_cache_path,
+                ttl=settings.response_cache_ttl,
+                max_bytes=settings.response_cache_disk_max_mb * 1024 * 1024
+            )
+            await store.open()
+            await store.compact()
+            models_io.response_cache.attach_store(store)
+        except Exception as e:
+            logger.error(f"Не удалось открыть персистентный кеш ответов, используется только память: {e}")
+
+    # Фоновая выгрузка спанов трассировки
+    tracing.tracer.start()
+
+    # Метрики из счетчиков кешей, очередей и буферов
+    if settings.metrics_enabled:
+        metrics.register_default_collectors()
+
+    # Детектор блокировок цикла событий (синхронные вызовы внутри корутин)
+    if settings.loop_block_threshold_ms > 0:
+        loop_monitor.loop_monitor.start()
+
+    # Фоновая очистка истекших ответов в кеше
+    models_io.response_cache.start_sweeper(settings.response_cache_sweep_interval)
+
+    # Сверка агрегатов лидерборда (при первом запуске заполняет их по существующим оценкам)
+    data_logic.start_rating_reconciler(settings.rating_reconcile_interval)
+    rating_engine.start_refit_task(settings.rating_refit_interval)
+
+    # Буфер отложенной записи оценок: досылает в БД оценки из журнала прошлого запуска
+    if settings.rating_buffer_enabled:
+        try:
+            await rating_buffer.start()
+        except Exception as e:
+            logger.error(f"Не удалось запустить буфер записи оценок, оценки пишутся напрямую: {e}")
+
+    # Общее хранилище счетчиков лимитов и блокировок входа
+    try:
+        await shared_state.open()
+    except Exception as e:
+        logger.error(f"Не удалось подключиться к общему хранилищу лимитов ({shared_state.name}): {e}")
+
+    # Возобновляем задания пакетной оценки, прерванные прошлой остановкой
+    await jobs.job_manager.start()
+
+    # Сверка каталога моделей с провайдерами (при пустом снимке - первая загрузка списков)
+    model_catalog.schedule_sync()
+
+    logger.info(f"Приложение готово к работе за {time.perf_counter() - _boot_started:.2f} сек.")
+
     yield # Приложение работает
 
     logger.info("Остановка приложения Промт Арена...")
 
+    # Незавершенные задания продолжатся при следующем запуске
+    await jobs.job_manager.stop()
+    await data_logic.stop_rating_reconciler()
+    await rating_engine.stop_refit_task()
+    # Оставшиеся в буфере оценки записываются в БД до остановки
+    await rating_buffer.stop()
+    await model_catalog.stop()
+
+    await shared_state.aclose()
+    await models_io.response_cache.stop_sweeper()
+    await models_io.response_cache.detach_store()
+
+    # Закрываем долгоживущие клиенты провайдеров (пулы HTTP-соединений)
+    await models_io.provider_clients.aclose()
+    loop_monitor.shutdown_executor()
+    await loop_monitor.loop_monitor.stop()
+    await tracing.tracer.stop()
+
 # --- Middleware для ограничения частоты запросов ---
 
 class RateLimitMiddleware:
-    def __init__(self, app, max_requests: int = 60, window_size: int = 60):
+    """
+    Ограничение частоты запросов по IP клиента (GCRA, см. backend.rate_limit).
+    Для каждого ключа хранится одно число, число ключей ограничено max_keys.
+    Правила выбираются по шаблону пути, затем по методу запроса. Заголовки
+    X-RateLimit-* добавляются к фактическому ответу приложения.
+
+    Если задано общее хранилище (SQLite или Redis), счетчики ведутся в нем и
+    лимиты действуют на все воркеры вместе; при его недоступности используется
+    локальный GCRA.
+    """
+    def __init__(self, app, max_requests: int = 60, window_size: int = 60, max_keys: int = 100_000,
+                 state: Optional[SharedState] = None):
         self.app = app
-        self.max_requests = max_requests
-        self.window_size = window_size  # в секундах
-        self.requests = defaultdict(list)
-        # Добавляем отдельные ограничения для разных путей и методов
-        self.path_limits = {
-            "/api/v1/token": {"max": 10, "window": 60},  # Строгие ограничения для авторизации (10 запросов в минуту)
-            "/api/v1/interact": {"max": 30, "window": 60},  # Ограничения для запросов к моделям
-            "/api/v1/compare": {"max": 20, "window": 60},  # Ограничения для сравнения моделей
-        }
-        # Лимиты по методам запросов
-        self.method_limits = {
-            "POST": {"max": 40, "window": 60},  # POST запросы обычно более "тяжелые"
-            "PUT": {"max": 40, "window": 60},
-            "DELETE": {"max": 30, "window": 60},
-        }
-        logger.info(f"Инициализирован RateLimitMiddleware: {max_requests} запросов за {window_size} секунд")
+        self.limiter = GcraLimiter(max_keys=max_keys)
+        self.shared_limiter = SharedWindowLimiter(state) if state is not None and state.name != "memory" else None
+        self._shared_error_logged_at = 0.0
+        self.matcher = RuleMatcher(
+            rules=[
+                # Отдельные ограничения для разных путей: один счетчик на группу путей
+                RateLimitRule("token", 10, 60, pattern="/api/v1/token"),  # Строгие ограничения для авторизации
+                # Запросы к моделям; шаблон "/api/v1/interact*" захватил бы и /api/v1/interactions/*
+                RateLimitRule("interact", 30, 60, pattern="/api/v1/interact"),
+                RateLimitRule("interact", 30, 60, pattern="/api/v1/interact/*"),
+                RateLimitRule("compare", 20, 60, pattern="/api/v1/interactions/*"),  # Сравнение моделей
+                # Лимиты по методам запросов (POST запросы обычно более "тяжелые"), счетчик на каждый путь
+                RateLimitRule("POST", 40, 60, methods=("POST",), shared=False),
+                RateLimitRule("PUT", 40, 60, methods=("PUT",), shared=False),
+                RateLimitRule("DELETE", 30, 60, methods=("DELETE",), shared=False),
+            ],
+            default=RateLimitRule("default", max_requests, window_size, shared=False),
+        )
+        logger.info(f"Инициализирован RateLimitMiddleware: {max_requests} запросов за {window_size} секунд, до {max_keys} ключей")
         
     async def __call__(self, scope, receive, send):
         if scope["type"] != "http":
@@ -199,40 +301,20 @@ class RateLimitMiddleware:
             else:
                 client_ip = "0.0.0.0"  # Неизвестный IP
         
-        # Определяем применимые лимиты
-        # Сначала проверяем конкретный путь
-        limits = self.path_limits.get(path, None)
-        if limits:
-            max_requests = limits["max"]
-            window_size = limits["window"]
-        # Затем проверяем метод запроса
-        elif method in self.method_limits:
-            limits = self.method_limits[method]
-            max_requests = limits["max"]
-            window_size = limits["window"]
-        # Иначе используем значения по умолчанию
-        else:
-            max_requests = self.max_requests
-            window_size = self.window_size
-        
-        # Определяем уникальный ключ для запроса (IP + путь)
-        request_key = f"{client_ip}:{path}"
-        
-        # Очищаем старые запросы
-        current_time = time.time()
-        self.requests[request_key] = [t for t in self.requests[request_key] 
-                                   if current_time - t < window_size]
+        # Определяем применимое правило и ключ счетчика
+        rule = self.matcher.match(method, path)
+        request_key = f"{client_ip}:{rule.name}" if rule.shared else f"{client_ip}:{rule.name}:{path}"
+        with tracing.span("rate_limit.check", rule=rule.name):
+            result = await self._hit(request_key, rule)
         
-        # Проверяем количество запросов
-        if len(self.requests[request_key]) >= max_requests:
-            # Вычисляем время до сброса ограничения
-            oldest_request = min(self.requests[request_key]) if self.requests[request_key] else current_time
-            reset_after = int(window_size - (current_time - oldest_request))
+        if not result.allowed:
+            retry_after = math.ceil(result.retry_after)
             
+            metrics.rate_limit_rejections.inc(rule.name)
             # Логируем информацию о превышении лимита
             logger.warning(
                 f"Rate limit превышен для {client_ip} на пути {path}: "
-                f"{len(self.requests[request_key])}/{max_requests} запросов за {window_size} секунд"
+                f"лимит {rule.limit} запросов за {rule.window:.0f} секунд ({rule.name})"
             )
             
             # Формируем ответ с ошибкой 429 Too Many Requests и дополнительными заголовками
@@ -241,10 +323,10 @@ class RateLimitMiddleware:
                 "status": 429,
                 "headers": [
                     [b"content-type", b"application/json"],
-                    [b"retry-after", str(reset_after).encode()],
-                    [b"x-ratelimit-limit", str(max_requests).encode()],
+                    [b"retry-after", str(retry_after).encode()],
+                    [b"x-ratelimit-limit", str(rule.limit).encode()],
                     [b"x-ratelimit-remaining", b"0"],
-                    [b"x-ratelimit-reset", str(reset_after).encode()],
+                    [b"x-ratelimit-reset", str(math.ceil(result.reset_after)).encode()],
                 ],
             }
             await send(response)
@@ -252,9 +334,9 @@ class RateLimitMiddleware:
             # Формируем тело ответа с подробной информацией
             body = {
                 "detail": "Слишком много запросов. Пожалуйста, попробуйте позже.",
-                "limit": max_requests,
-                "window": window_size,
-                "retry_after": reset_after
+                "limit": rule.limit,
+                "window": rule.window,
+                "retry_after": retry_after
             }
             
             await send({
@@ -263,18 +345,32 @@ class RateLimitMiddleware:
             })
             return
         
-        # Добавляем текущий запрос
-        self.requests[request_key].append(current_time)
+        # Заголовки с информацией о лимитах добавляем к ответу приложения
+        rate_limit_headers = [
+            (b"x-ratelimit-limit", str(rule.limit).encode()),
+            (b"x-ratelimit-remaining", str(result.remaining).encode()),
+            (b"x-ratelimit-reset", str(math.ceil(result.reset_after)).encode()),
+        ]
         
-        # Добавляем заголовки с информацией о лимитах
-        if scope.get("extensions", {}).get("http.response.headers"):
-            scope["extensions"]["http.response.headers"].extend([
-                (b"x-ratelimit-limit", str(max_requests).encode()),
-                (b"x-ratelimit-remaining", str(max_requests - len(self.requests[request_key])).encode()),
-            ])
+        async def send_with_rate_limit_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + rate_limit_headers
+            await send(message)
         
         # Продолжаем обработку запроса
-        await self.app(scope, receive, send)
+        await self.app(scope, receive, send_with_rate_limit_headers)
+
+    async def _hit(self, request_key: str, rule: RateLimitRule):
+        if self.shared_limiter is not None:
+            try:
+                return await self.shared_limiter.hit(request_key, rule.limit, rule.window)
+            except Exception as e:
+                # Пишем в лог не чаще раза в минуту, чтобы не засорять его при длительном сбое
+                now = time.monotonic()
+                if now - self._shared_error_logged_at > 60:
+                    self._shared_error_logged_at = now
+                    logger.error(f"Общее хранилище лимитов недоступно, используется локальный лимит: {e}")
+        return self.limiter.hit(request_key, rule.limit, rule.window)
 
 # --- Middleware для ограничения размера запроса ---
 class MaxBodySizeMiddleware:
@@ -337,6 +433,51 @@ class MaxBodySizeMiddleware:
         
         await self.app(scope, receive_with_size_limit, send)
 
+# --- Middleware трассировки запросов ---
+class TracingMiddleware:
+    """
+    Корневой спан трассировки для каждого HTTP запроса (см. backend.tracing). Добавляется
+    последним и поэтому охватывает все остальные middleware. Учитывает входящий заголовок
+    traceparent. ID трассы записывается в request.state.trace_id (для журнала ошибок)
+    и возвращается клиенту в заголовке X-Trace-Id.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing.tracer.enabled:
+            return await self.app(scope, receive, send)
+
+        traceparent = next((value.decode("latin-1") for name, value in scope.get("headers", [])
+                            if name == b"traceparent"), None)
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        span = tracing.tracer.start_root_span(
+            f"{method} {path}", {"http.method": method, "http.target": path}, traceparent=traceparent
+        )
+        if span is tracing.NOOP_SPAN:
+            return await self.app(scope, receive, send)
+
+        scope.setdefault("state", {})["trace_id"] = span.trace_id
+        trace_header = (b"x-trace-id", span.trace_id.encode())
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_error(f"HTTP {message['status']}")
+                message["headers"] = list(message.get("headers", [])) + [trace_header]
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # После маршрутизации известен шаблон пути: имя спана без ID из URL
+                route = scope.get("route")
+                if route is not None and getattr(route, "path", None):
+                    span.name = f"{method} {route.path}"
+
 # --- Настройка безопасности и middleware ---
 # Инициализируем список trusted hosts, если они указаны
 trusted_hosts = settings.trusted_hosts if hasattr(settings, 'trusted_hosts') else []
@@ -368,7 +509,13 @@ API для веб-приложения "Промт Арена". Предоста
 )
 
 # Добавляем middleware
-app.add_middleware(RateLimitMiddleware, max_requests=settings.max_requests_per_minute, window_size=60)
+app.add_middleware(
+    RateLimitMiddleware,
+    max_requests=settings.max_requests_per_minute,
+    window_size=60,
+    max_keys=settings.rate_limit_max_keys,
+    state=shared_state
+)
 app.add_middleware(MaxBodySizeMiddleware, max_size_mb=settings.max_prompt_length // 1000 or 10)  # Ограничение размера payload
 
 # Настраиваем CORS для нашего API
@@ -379,6 +526,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Трассировка - самый внешний из наших middleware
+app.add_middleware(TracingMiddleware)
 
 # --- Маршруты для статических файлов и фронтенда ---
 
@@ -552,6 +701,9 @@ async def generic_exception_handler(request: Request, exc: Exception):
     # Создаем идентификатор ошибки для отслеживания
     import uuid
     error_id = str(uuid.uuid4())
+    # ID трассы запроса (если запрос попал в выборку трассировки)
+    trace_id = getattr(request.state, "trace_id", None)
+    trace_info = f" [Trace ID: {trace_id}]" if trace_id else ""
     
     # Получаем дополнительную информацию о контексте запроса
     request_info = {
@@ -601,7 +753,7 @@ async def generic_exception_handler(request: Request, exc: Exception):
     
     # Логируем полную информацию об ошибке для отладки
     logger.error(
-        f"[Error ID: {error_id}] Внутренняя ошибка сервера при обработке {request.method} {request.url}\n"
+        f"[Error ID: {error_id}]{trace_info} Внутренняя ошибка сервера при обработке {request.method} {request.url}\n"
         f"Тип ошибки: {error_type}\n"
         f"Сообщение: {str(exc)}\n"
         f"Контекст запроса: {request_info}\n"
@@ -645,17 +797,18 @@ api_router = APIRouter(prefix="/api/v1")
 async def login_for_access_token(credentials: HTTPBasicCredentials = Depends(HTTPBasic()), request: Request = None):
     """Получение JWT-токена по учетным данным."""
     ip_address = request.client.host if request else None
-    user = auth.authenticate_user(credentials.username, credentials.password, ip_address)
+    user = await auth.authenticate_user(credentials.username, credentials.password, ip_address)
     if not user:
         # Проверяем различные условия блокировки
-        if auth.is_account_locked(credentials.username):
+        lockout = await auth.get_lockout(credentials.username, ip_address)
+        if lockout == "account":
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Слишком много неудачных попыток входа. Пожалуйста, попробуйте позже.",
                 headers={"WWW-Authenticate": "Basic", "Retry-After": str(auth.LOCKOUT_TIME)},
             )
         
-        if ip_address and auth.is_ip_blocked(ip_address):
+        if lockout == "ip":
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Слишком много неудачных попыток входа с вашего IP. Пожалуйста, попробуйте позже.",
@@ -837,6 +990,69 @@ async def clear_provider_cache(
             detail=f"Ошибка при очистке кеша: {str(e)}"
         )
 
+@api_router.get(
+    "/cache/responses/stats",
+    tags=["Кеш"],
+    summary="Статистика кеша ответов моделей"
+)
+async def get_response_cache_stats(current_user: User = Depends(auth.get_admin_user)):
+    """Возвращает размер кеша ответов и счетчики попаданий, промахов и вытеснений."""
+    stats = models_io.response_cache.stats()
+    stats["single_flight"] = models_io.inflight_requests.stats()
+    if models_io.response_cache.store is not None:
+        stats["disk"] = await models_io.response_cache.store.stats()
+    return stats
+
+@api_router.get(
+    "/providers/sdk",
+    tags=["Мониторинг"],
+    summary="Состояние SDK провайдеров"
+)
+async def get_provider_sdk_report(current_user: User = Depends(auth.get_admin_user)):
+    """
+    Показывает для каждого провайдера, установлен ли SDK, загружен ли он
+    (загрузка происходит при первом обращении), время загрузки и ошибку импорта.
+    """
+    return models_io.sdk_loader.report()
+
+@api_router.get(
+    "/scheduler/stats",
+    tags=["Мониторинг"],
+    summary="Статистика очередей запросов к провайдерам"
+)
+async def get_scheduler_stats(current_user: User = Depends(auth.get_admin_user)):
+    """
+    Возвращает состояние очередей к провайдерам: число выполняющихся запросов,
+    глубину очереди, среднее и максимальное ожидание, отказы по таймауту и ответы 429.
+    """
+    return models_io.provider_scheduler.stats()
+
+@api_router.get(
+    "/event-loop/stats",
+    tags=["Мониторинг"],
+    summary="Статистика блокировок цикла событий"
+)
+async def get_event_loop_stats(current_user: User = Depends(auth.get_admin_user)):
+    """
+    Возвращает число блокировок цикла событий дольше порога LOOP_BLOCK_THRESHOLD_MS,
+    максимальную и суммарную длительность. Стек блокирующего кода записывается в лог.
+    """
+    return loop_monitor.loop_monitor.stats()
+
+@api_router.delete(
+    "/cache/responses",
+    tags=["Кеш"],
+    summary="Очистить кеш ответов моделей"
+)
+async def clear_response_cache(
+    model_id: Optional[str] = Query(None, description="ID модели или провайдера. Если не указан, кеш очищается полностью.", examples=["openai/gpt-4o", "openai"]),
+    current_user: User = Depends(auth.get_admin_user)
+):
+    """Очищает кеш ответов целиком или только для одной модели/провайдера."""
+    removed = models_io.response_cache.clear(model_id)
+    logger.info(f"API: Из кеша ответов удалено {removed} записей ({model_id or 'все модели'})")
+    return {"status": "success", "removed": removed}
+
 # --- Эндпоинты для системных промтов ---
 
 @api_router.post(
@@ -942,9 +1158,429 @@ async def get_access_links(
     
     return links
 
+# --- Эндпоинты каталога моделей ---
+@api_router.get(
+    "/categories",
+    response_model=List[CategoryInfo],
+    tags=["Модели"],
+    summary="Структура категорий моделей"
+)
+async def get_categories(
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Возвращает категории и подкатегории для фильтрации моделей и лидерборда."""
+    return data_logic.get_categories()
+
+@api_router.get(
+    "/models",
+    response_model=List[ModelInfo],
+    tags=["Модели"],
+    summary="Доступные модели всех провайдеров"
+)
+async def get_models(
+    category: Optional[str] = Query(None, description="ID категории или подкатегории для фильтрации"),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Возвращает модели провайдеров, для которых добавлены API ключи. Каталог хранится
+    в памяти и в БД и обновляется в фоне, поэтому ответ не ждет API провайдеров
+    (кроме первого запуска и изменения ключей).
+    """
+    return await data_logic.get_models(category)
+
+@api_router.get(
+    "/models/search",
+    response_model=ModelSearchResponse,
+    tags=["Модели"],
+    summary="Поиск по каталогу моделей с фильтрами и постраничной выдачей"
+)
+async def search_models(
+    request: Request,
+    q: Optional[str] = Query(None, max_length=200, description="Подстрока ID или имени модели (1-2 символа - префикс слова)"),
+    category: Optional[str] = Query(None, description="ID категории или подкатегории"),
+    provider: Optional[str] = Query(None, description="Провайдер"),
+    supports_vision: Optional[bool] = Query(None),
+    supports_tools: Optional[bool] = Query(None),
+    supports_system_prompt: Optional[bool] = Query(None),
+    min_input_tokens: Optional[int] = Query(None, ge=0, description="Минимальный размер контекста"),
+    max_input_tokens: Optional[int] = Query(None, ge=0, description="Максимальный размер контекста"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Ищет модели по индексу каталога и возвращает одну страницу результатов с количеством
+    найденных моделей по провайдерам и категориям. ETag меняется только при изменении
+    каталога: на запрос с If-None-Match возвращается 304 без тела.
+    """
+    index = await model_catalog.get_index()
+    etag = f'W/"{index.version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    result = index.search(
+        offset=offset, limit=limit, query=q, category=category, provider=provider,
+        supports_vision=supports_vision, supports_tools=supports_tools,
+        supports_system_prompt=supports_system_prompt,
+        min_input_tokens=min_input_tokens, max_input_tokens=max_input_tokens,
+    )
+    return JSONResponse(content=result.model_dump(mode="json"), headers=headers)
+
+# --- Эндпоинты для взаимодействия с моделями ---
+
+# Заголовки для потоковых ответов: запрещаем кеширование и буферизацию на прокси (nginx)
+_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"}
+
+def _sse_event(event: Dict[str, Any]) -> str:
+    """Форматирует событие в формат Server-Sent Events."""
+    return f"event: {event.get('event', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@api_router.post(
+    "/interact",
+    response_model=InteractionResponse,
+    tags=["Взаимодействие"],
+    summary="Запрос к одной модели"
+)
+async def interact(
+    request_data: InteractionRequest,
+    current_user: User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """
+    Отправляет промт одной модели и возвращает полный ответ.
+    Ошибки провайдера возвращаются в поле `error`, а не HTTP-статусом.
+    """
+    logger.info(f"API: Запрос к модели {request_data.model_id}")
+    return await models_io.run_single_inference(db, request_data)
+
+@api_router.post(
+    "/interact/stream",
+    tags=["Взаимодействие"],
+    summary="Потоковый запрос к одной модели (SSE)"
+)
+async def interact_stream(
+    request_data: InteractionRequest,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Отправляет промт одной модели и возвращает ответ потоком Server-Sent Events.
+
+    - `delta`: очередной фрагмент текста (`text`)
+    - `done`: завершение потока с `ttft` (время до первого токена), `elapsed_time`, `token_count` и `error`
+    """
+    logger.info(f"API: Потоковый запрос к модели {request_data.model_id}")
+
+    async def event_stream():
+        # Сессия открывается внутри генератора: зависимости FastAPI закрываются до начала отправки потока
+        async with database.AsyncSessionFactory() as db:
+            async for event in models_io.stream_single_inference(db, request_data):
+                yield _sse_event(event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
+
+@api_router.post(
+    "/interactions/compare",
+    response_model=ComparisonResponse,
+    tags=["Взаимодействие"],
+    summary="Сравнение ответов двух моделей"
+)
+async def compare_models(
+    request_data: ComparisonRequest,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Отправляет один промт двум моделям параллельно и возвращает оба ответа."""
+    logger.info(f"API: Сравнение моделей {request_data.model_id_1} и {request_data.model_id_2}")
+    return await models_io.run_comparison_inference(request_data)
+
+@api_router.post(
+    "/interactions/compare/stream",
+    tags=["Взаимодействие"],
+    summary="Потоковое сравнение двух моделей (SSE)"
+)
+async def compare_models_stream(
+    request_data: ComparisonRequest,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Потоковое сравнение двух моделей. События обоих потоков приходят вперемешку
+    по мере генерации; поле `slot` ('model_1' или 'model_2') указывает, к какой модели
+    относится событие. Поток завершается после двух событий `done`.
+    """
+    logger.info(f"API: Потоковое сравнение моделей {request_data.model_id_1} и {request_data.model_id_2}")
+
+    async def event_stream():
+        async for event in models_io.stream_comparison_inference(request_data):
+            yield _sse_event(event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
+
+@api_router.post(
+    "/interactions/multi",
+    response_model=MultiModelResponse,
+    tags=["Взаимодействие"],
+    summary="Запрос к нескольким моделям одновременно"
+)
+async def multi_model_interaction(
+    request_data: MultiModelRequest,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Отправляет один промт нескольким моделям (до 20) параллельно.
+    Параметры из `models[i]` переопределяют общие. Ответы возвращаются в порядке
+    завершения; модели, не успевшие до `deadline`, перечислены в `timed_out`.
+    """
+    return await models_io.run_multi_inference(request_data)
+
+@api_router.post(
+    "/interactions/multi/stream",
+    tags=["Взаимодействие"],
+    summary="Запрос к нескольким моделям с потоковой выдачей результатов (SSE)"
+)
+async def multi_model_interaction_stream(
+    request_data: MultiModelRequest,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    То же, что `/interactions/multi`, но каждый ответ отправляется событием `result`
+    сразу по готовности. Затем следуют события `timeout` для опоздавших моделей
+    и завершающее `done`.
+    """
+    async def event_stream():
+        async for event in models_io.iter_multi_inference(request_data):
+            yield _sse_event(event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
+
+@api_router.websocket("/interactions/compare/ws")
+async def compare_models_ws(websocket: WebSocket):
+    """
+    WebSocket-вариант потокового сравнения. Клиент отправляет JSON с ComparisonRequest
+    и получает те же события, что и в SSE-эндпоинте. По одному соединению можно
+    выполнить несколько сравнений подряд.
+    """
+    user = await auth.authenticate_websocket(websocket)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                payload = await websocket.receive_json()
+            except (ValueError, KeyError, TypeError):
+                # Не JSON (JSONDecodeError) или двоичный кадр вместо текстового
+                await websocket.send_json({"event": "error", "error": "Ожидается JSON-объект с параметрами сравнения"})
+                continue
+            if not isinstance(payload, dict):
+                await websocket.send_json({"event": "error", "error": "Ожидается JSON-объект с параметрами сравнения"})
+                continue
+            try:
+                request_data = ComparisonRequest(**payload)
+            except ValueError as e:
+                await websocket.send_json({"event": "error", "error": str(e)})
+                continue
+            logger.info(f"WS: Потоковое сравнение моделей {request_data.model_id_1} и {request_data.model_id_2} ({user.username})")
+            async for event in models_io.stream_comparison_inference(request_data):
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        logger.debug("WS: Клиент отключился от потокового сравнения")
+
+# --- Эндпоинты для оценок и лидерборда ---
+
+@api_router.post(
+    "/rate",
+    response_model=Union[RatingRead, RatingReceipt],
+    status_code=status.HTTP_201_CREATED,
+    responses={status.HTTP_202_ACCEPTED: {"model": RatingReceipt, "description": "Оценка принята в буфер записи"}},
+    tags=["Рейтинги"],
+    summary="Оценить ответ модели"
+)
+async def rate_model(
+    rating_data: RatingCreate,
+    response: Response,
+    db: AsyncSession = Depends(database.get_db),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Сохраняет оценку ответа модели (1-10). Лидерборд обновляется сразу.
+    При включенном буфере записи (RATING_BUFFER_ENABLED) возвращает 202 и квитанцию:
+    оценка попадет в БД и лидерборд в течение RATING_BUFFER_FLUSH_MS.
+    """
+    try:
+        result = await data_logic.process_and_save_rating(db, rating_data)
+        if isinstance(result, RatingReceipt):
+            response.status_code = status.HTTP_202_ACCEPTED
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@api_router.get(
+    "/leaderboard",
+    response_model=List[LeaderboardEntry],
+    tags=["Рейтинги"],
+    summary="Лидерборд моделей по средней оценке"
+)
+async def get_leaderboard(
+    category: Optional[str] = Query(None, description="ID категории или подкатегории для фильтрации"),
+    ranking: str = Query("average", pattern="^(average|elo|bradley_terry)$", description="Режим ранжирования"),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Возвращает модели в порядке выбранного режима: `average` - средняя оценка и количество оценок,
+    `elo` - рейтинг Эло по попарным сравнениям, `bradley_terry` - последний пересчет
+    Брэдли-Терри с 95% доверительными интервалами.
+    """
+    try:
+        return await data_logic.generate_leaderboard(db, category, ranking)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@api_router.post(
+    "/rate/comparison",
+    response_model=ComparisonVoteRead,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Рейтинги"],
+    summary="Выбрать победителя в сравнении двух моделей"
+)
+async def rate_comparison(
+    vote_data: ComparisonVoteCreate,
+    db: AsyncSession = Depends(database.get_db),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Сохраняет результат попарного сравнения и сразу обновляет рейтинги Эло обеих моделей."""
+    return await data_logic.process_comparison_vote(db, vote_data)
+
+@api_router.post(
+    "/leaderboard/refit",
+    tags=["Рейтинги"],
+    summary="Пересчитать рейтинг Брэдли-Терри"
+)
+async def refit_leaderboard(
+    db: AsyncSession = Depends(database.get_db),
+    current_user: User = Depends(auth.get_admin_user)
+):
+    """Выполняет пакетный пересчет рейтинга Брэдли-Терри по всем сравнениям и сохраняет снимок."""
+    try:
+        snapshot_id = await rating_engine.refit_bradley_terry(db)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return {"status": "success", "snapshot_id": snapshot_id}
+
+# --- Эндпоинты для заданий пакетной оценки ---
+
+async def _get_eval_job_for_user(job_id: str, current_user: User) -> database.EvalJob:
+    """Возвращает задание, если оно существует и доступно пользователю."""
+    async with database.AsyncSessionFactory() as db:
+        job = await database.get_eval_job(db, job_id)
+    if job is None or (not current_user.is_admin and job.created_by != current_user.username):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Задание не найдено")
+    return job
+
+@api_router.post(
+    "/jobs",
+    response_model=EvalJobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Задания"],
+    summary="Запустить пакетную оценку: набор промтов × набор моделей"
+)
+async def create_eval_job(
+    job_data: EvalJobCreate,
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Создает фоновое задание: каждый промт (из `prompts` и шаблонов `template_ids`)
+    отправляется каждой модели из `model_ids`. Прогресс сохраняется в БД,
+    после перезапуска приложения задание продолжается.
+    """
+    try:
+        job = await jobs.job_manager.submit(job_data, current_user.username)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return EvalJobRead(**jobs.job_to_dict(job))
+
+@api_router.get(
+    "/jobs",
+    response_model=List[EvalJobRead],
+    tags=["Задания"],
+    summary="Список заданий пакетной оценки"
+)
+async def list_eval_jobs(
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Возвращает последние задания. Администратор видит задания всех пользователей."""
+    async with database.AsyncSessionFactory() as db:
+        job_list = await database.list_eval_jobs(db, limit=limit)
+    return [
+        EvalJobRead(**jobs.job_to_dict(job)) for job in job_list
+        if current_user.is_admin or job.created_by == current_user.username
+    ]
+
+@api_router.get(
+    "/jobs/{job_id}",
+    response_model=EvalJobRead,
+    tags=["Задания"],
+    summary="Состояние задания пакетной оценки"
+)
+async def get_eval_job(
+    job_id: str = Path(..., description="ID задания"),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Возвращает статус задания и счетчики выполненных и неудачных запросов."""
+    job = await _get_eval_job_for_user(job_id, current_user)
+    return EvalJobRead(**jobs.job_to_dict(job))
+
+@api_router.post(
+    "/jobs/{job_id}/cancel",
+    response_model=EvalJobRead,
+    tags=["Задания"],
+    summary="Отменить задание пакетной оценки"
+)
+async def cancel_eval_job(
+    job_id: str = Path(..., description="ID задания"),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """Останавливает задание. Уже полученные результаты сохраняются."""
+    await _get_eval_job_for_user(job_id, current_user)
+    if not await jobs.job_manager.cancel(job_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Задание уже завершено")
+    job = await _get_eval_job_for_user(job_id, current_user)
+    return EvalJobRead(**jobs.job_to_dict(job))
+
+@api_router.get(
+    "/jobs/{job_id}/results",
+    tags=["Задания"],
+    summary="Результаты задания пакетной оценки (SSE)"
+)
+async def stream_eval_job_results(
+    job_id: str = Path(..., description="ID задания"),
+    after: int = Query(0, ge=0, description="Выдать результаты с порядковым номером больше указанного"),
+    current_user: User = Depends(auth.get_current_active_user)
+):
+    """
+    Потоковая выдача результатов в порядке завершения: события `result`
+    (поле `seq` можно передать в `after` при переподключении) и итоговое событие `done`.
+    """
+    await _get_eval_job_for_user(job_id, current_user)
+
+    async def event_stream():
+        async for event in jobs.job_manager.iter_results(job_id, after):
+            yield _sse_event(event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
+
 # Монтируем API роутер
 app.include_router(api_router)
 
+# Эндпоинт метрик в корне, как ожидает Prometheus; регистрируется до маршрута фронтенда /{path:path}
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics(current_user: User = Depends(auth.get_admin_user)):
+        """Метрики в текстовом формате Prometheus (в scrape_config нужен basic_auth администратора)."""
+        return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Добавляем маршрут для корневого URL и перенаправляем на frontend/index.html
 @app.get("/", include_in_schema=False)
 async def read_root():
@@ -967,13 +1603,6 @@ async def catch_all(path: str):
 if trusted_hosts and trusted_hosts != ["*"]:
     app.add_middleware(TrustedHostMiddleware, allowed_hosts=trusted_hosts)
 
-# Добавляем RateLimitMiddleware для ограничения частоты запросов
-app.add_middleware(
-    RateLimitMiddleware,
-    max_requests=settings.max_requests_per_minute,
-    window_size=60
-)
-
 # Запуск приложения (если файл запущен напрямую)
 if __name__ == "__main__":
     # Настраиваем логгер
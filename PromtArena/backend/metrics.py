@@ -0,0 +1,274 @@
+# backend/metrics.py
+
+import bisect
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счетчик. Метки передаются позиционно в порядке labelnames: inc("openai", "gpt-4o")."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        values = self._values
+        values[labels] = values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами. На каждый набор меток хранится один список:
+    счетчики корзин (включая +Inf) и сумма; observe - бинарный поиск корзины и два сложения.
+    Накопительные значения корзин считаются только при выводе.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._upper = tuple(sorted(buckets))
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self._upper) + 1) + [0.0]
+        series[bisect.bisect_left(self._upper, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series is not None else 0
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for upper, bucket_count in zip(self._upper + (math.inf,), series[:-1]):
+                cumulative += bucket_count
+                le = f'le="{_format_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Значения, которые вычисляются при выводе из уже существующих счетчиков модулей
+    (кеши, буферы, очереди): на горячем пути ничего не делается. callback возвращает
+    число или словарь {кортеж меток: число}.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, callback: Callable[[], Any],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = self._header()
+        for labels, value in values.items():
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик и вывод в текстовом формате Prometheus (exposition format 0.0.4).
+
+    Счетчики обновляются без блокировок: все инструментированные места выполняются в
+    потоке цикла событий (включая события SQLAlchemy - async драйвер вызывает их в том же
+    потоке), поэтому обновление - это одна операция со словарем.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str, callback: Callable[[], Any],
+                 labelnames: Sequence[str] = ()) -> CallbackMetric:
+        """Регистрирует метрику-обертку; повторная регистрация заменяет callback."""
+        self._metrics.pop(name, None)
+        return self.register(CallbackMetric(name, documentation, kind, callback, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Инференс ---
+
+inference_requests = registry.counter(
+    "promptarena_inference_requests_total", "Запросы к моделям", ("provider", "model", "mode", "status"))
+inference_errors = registry.counter(
+    "promptarena_inference_errors_total", "Ошибки запросов к моделям по классам", ("provider", "error_class"))
+inference_duration = registry.histogram(
+    "promptarena_inference_duration_seconds", "Полное время запроса к модели", ("provider", "model"))
+inference_ttft = registry.histogram(
+    "promptarena_inference_ttft_seconds", "Время до первого токена (потоковые запросы)", ("provider", "model"))
+inference_tokens = registry.counter(
+    "promptarena_inference_tokens_total", "Токены запросов и ответов", ("provider", "model", "kind"))
+
+# --- Каталог моделей ---
+
+catalog_refresh_duration = registry.histogram(
+    "promptarena_catalog_refresh_duration_seconds", "Запрос списка моделей у провайдера",
+    ("provider", "status"), buckets=FAST_BUCKETS + (5.0, 10.0, 30.0))
+catalog_sync_duration = registry.histogram(
+    "promptarena_catalog_sync_duration_seconds", "Сверка каталога моделей со всеми провайдерами",
+    buckets=FAST_BUCKETS + (5.0, 10.0, 30.0))
+
+# --- БД, лимиты, цикл событий ---
+
+db_query_duration = registry.histogram(
+    "promptarena_db_query_duration_seconds", "Время выполнения SQL запросов", ("operation",), buckets=FAST_BUCKETS)
+rate_limit_rejections = registry.counter(
+    "promptarena_rate_limit_rejections_total", "Запросы, отклоненные ограничением частоты", ("rule",))
+event_loop_lag = registry.histogram(
+    "promptarena_event_loop_lag_seconds", "Задержка пробуждения задачи-пульса цикла событий", buckets=FAST_BUCKETS)
+
+
+def record_inference(provider: Optional[str], model: Optional[str], mode: str, elapsed: float,
+                     error: bool, token_count: Optional[Dict[str, Any]] = None) -> None:
+    """Учитывает завершенный запрос к модели: количество, длительность и токены."""
+    provider = provider or "unknown"
+    model = model or "unknown"
+    inference_requests.inc(provider, model, mode, "error" if error else "ok")
+    inference_duration.observe(elapsed, provider, model)
+    if token_count:
+        for kind in ("prompt", "completion"):
+            tokens = token_count.get(kind)
+            if tokens:
+                inference_tokens.inc(provider, model, kind, amount=tokens)
+
+
+def _stats_by_key(stats: Dict[str, Dict[str, Any]], field: str) -> Dict[Labels, Any]:
+    return {(key,): values.get(field) for key, values in stats.items()}
+
+
+def register_default_collectors() -> None:
+    """Метрики из счетчиков, которые модули уже ведут (stats()); вызывается при запуске приложения."""
+    # Отложенные импорты: модули сами импортируют metrics
+    from backend import models_io
+    from backend.config_cache import config_cache
+    from backend.loop_monitor import loop_monitor
+    from backend.model_catalog import model_catalog
+    from backend.rating_buffer import rating_buffer
+
+    cache = models_io.response_cache
+    registry.callback("promptarena_response_cache_hits_total", "Попадания в кеш ответов", "counter", lambda: cache.hits)
+    registry.callback("promptarena_response_cache_misses_total", "Промахи кеша ответов", "counter", lambda: cache.misses)
+    registry.callback("promptarena_response_cache_evictions_total", "Вытеснения из кеша ответов", "counter",
+                      lambda: cache.evictions)
+    registry.callback("promptarena_response_cache_entries", "Записи в кеше ответов", "gauge",
+                      lambda: cache.stats()["entries"])
+    registry.callback("promptarena_response_cache_bytes", "Размер ответов в кеше", "gauge",
+                      lambda: cache.stats()["bytes"])
+    registry.callback("promptarena_inflight_coalesced_total", "Запросы, объединенные с идентичным выполняющимся",
+                      "counter", lambda: models_io.inflight_requests.coalesced)
+
+    scheduler = models_io.provider_scheduler
+    for field, kind, doc in (
+        ("in_flight", "gauge", "Выполняющиеся запросы в очереди провайдера"),
+        ("queue_depth", "gauge", "Запросы, ожидающие в очереди провайдера"),
+        ("rejected", "counter", "Запросы, не дождавшиеся очереди провайдера"),
+        ("rate_limited", "counter", "Ответы 429 от провайдера"),
+    ):
+        name = f"promptarena_scheduler_{field}" + ("_total" if kind == "counter" else "")
+        registry.callback(name, doc, kind, lambda field=field: _stats_by_key(scheduler.stats(), field), ("lane",))
+
+    registry.callback("promptarena_config_cache_hits_total", "Попадания в кеш ключей и системных промтов",
+                      "counter", lambda: config_cache.hits)
+    registry.callback("promptarena_config_cache_misses_total", "Промахи кеша ключей и системных промтов",
+                      "counter", lambda: config_cache.misses)
+    registry.callback("promptarena_rating_buffer_pending", "Оценки, ожидающие записи в БД", "gauge",
+                      lambda: rating_buffer.stats()["pending"] if rating_buffer.running else None)
+    registry.callback("promptarena_rating_buffer_flushed_total", "Оценки, записанные буфером", "counter",
+                      lambda: rating_buffer.flushed_rows)
+    registry.callback("promptarena_catalog_models", "Модели в каталоге", "gauge", lambda: len(model_catalog))
+    registry.callback("promptarena_event_loop_blocks_total", "Блокировки цикла событий дольше порога", "counter",
+                      lambda: loop_monitor.blocks)
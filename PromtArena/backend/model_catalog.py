@@ -0,0 +1,343 @@
+# backend/model_catalog.py
+
+import asyncio
+import bisect
+import datetime
+import json
+import logging
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from backend import database, metrics, models_io
+from backend.config import settings, ModelInfo, ModelSearchResponse
+
+logger = logging.getLogger(__name__)
+
+# Задержка записи снимка: обновления нескольких провайдеров сохраняются одной транзакцией
+_PERSIST_DELAY = 1.0
+
+# Разделители слов в ID и имени модели для поиска по префиксу
+_TOKEN_SPLIT = re.compile(r"[^0-9a-zа-яё]+")
+
+
+def _text_trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogIndex:
+    """
+    Неизменяемый поисковый индекс по снимку каталога; перестраивается при изменении каталога.
+
+    Поиск по подстроке в ID и имени: для запросов от трех символов - пересечение
+    списков позиций по триграммам с последующей проверкой подстроки, для коротких -
+    префиксы слов (бинарный поиск по отсортированному словарю). Категория и провайдер
+    фильтруются по заранее построенным множествам, возможности и лимит контекста -
+    проверкой полей у оставшихся кандидатов. version меняется при каждой перестройке
+    и служит основой ETag ответа.
+    """
+
+    def __init__(self, models: Iterable[ModelInfo], version: str):
+        self.version = version
+        # Стабильный порядок нужен для постраничной выдачи
+        self.models: List[ModelInfo] = sorted(models, key=lambda m: (m.provider, m.name.lower(), m.id))
+        self._texts: List[str] = []
+        self._trigrams: Dict[str, Set[int]] = {}
+        tokens: Set[Tuple[str, int]] = set()
+        self._by_provider: Dict[str, Set[int]] = {}
+        self._by_category: Dict[str, Set[int]] = {}
+        for pos, model in enumerate(self.models):
+            text = f"{model.id}\n{model.name}".lower()
+            self._texts.append(text)
+            for trigram in _text_trigrams(text):
+                self._trigrams.setdefault(trigram, set()).add(pos)
+            tokens.update((token, pos) for token in _TOKEN_SPLIT.split(text) if token)
+            self._by_provider.setdefault(model.provider, set()).add(pos)
+            if model.category:
+                self._by_category.setdefault(model.category, set()).add(pos)
+        self._tokens: List[Tuple[str, int]] = sorted(tokens)
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def _match_text(self, query: str) -> Set[int]:
+        if len(query) < 3:
+            matched = set()
+            start = bisect.bisect_left(self._tokens, (query, -1))
+            for token, pos in self._tokens[start:]:
+                if not token.startswith(query):
+                    break
+                matched.add(pos)
+            return matched
+        # Начинаем с самой короткой выборки, пустое пересечение завершает поиск
+        postings = sorted((self._trigrams.get(t, set()) for t in _text_trigrams(query)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        # Триграммы могут встречаться в тексте не подряд
+        return {pos for pos in candidates if query in self._texts[pos]}
+
+    def _match_category(self, category: str) -> Set[int]:
+        """Категория или ее подкатегории (как в фильтре лидерборда)."""
+        matched = set()
+        for model_category, positions in self._by_category.items():
+            if model_category == category or model_category.startswith(category + "_"):
+                matched |= positions
+        return matched
+
+    def filter(self, query: Optional[str] = None, category: Optional[str] = None,
+               provider: Optional[str] = None, supports_vision: Optional[bool] = None,
+               supports_tools: Optional[bool] = None, supports_system_prompt: Optional[bool] = None,
+               min_input_tokens: Optional[int] = None, max_input_tokens: Optional[int] = None) -> List[int]:
+        """Позиции подходящих моделей в порядке каталога."""
+        selections = []
+        query = (query or "").strip().lower()
+        if query:
+            selections.append(self._match_text(query))
+        if category:
+            selections.append(self._match_category(category))
+        if provider:
+            selections.append(self._by_provider.get(provider, set()))
+        if selections:
+            selections.sort(key=len)
+            positions = set(selections[0]).intersection(*selections[1:])
+        else:
+            positions = range(len(self.models))
+
+        flags = [(name, value) for name, value in (
+            ("supports_vision", supports_vision), ("supports_tools", supports_tools),
+            ("supports_system_prompt", supports_system_prompt)) if value is not None]
+        result = []
+        for pos in sorted(positions):
+            model = self.models[pos]
+            if any(getattr(model, name) != value for name, value in flags):
+                continue
+            # Модели без известного лимита контекста не проходят фильтр по диапазону
+            if min_input_tokens is not None or max_input_tokens is not None:
+                if model.max_input_tokens is None:
+                    continue
+                if min_input_tokens is not None and model.max_input_tokens < min_input_tokens:
+                    continue
+                if max_input_tokens is not None and model.max_input_tokens > max_input_tokens:
+                    continue
+            result.append(pos)
+        return result
+
+    def search(self, offset: int = 0, limit: int = 50, **filters) -> ModelSearchResponse:
+        """Страница результатов и количество найденных моделей по провайдерам и категориям."""
+        positions = self.filter(**filters)
+        found = [self.models[pos] for pos in positions]
+        return ModelSearchResponse(
+            items=found[offset:offset + limit],
+            total=len(found),
+            offset=offset,
+            limit=limit,
+            facets={
+                "provider": dict(Counter(model.provider for model in found)),
+                "category": dict(Counter(model.category for model in found if model.category)),
+            },
+        )
+
+
+class ModelCatalog:
+    """
+    Единый каталог моделей всех провайдеров: его используют /models, лидерборд
+    и детали модели (вместо отдельных копий в data_logic и models_io).
+
+    Источник данных - кеш списков провайдеров в models_io: каталог подписан на
+    каждое успешное обновление и хранит объединенный индекс model_id -> ModelInfo.
+    Списки сохраняются в таблицу model_catalog (по строке на провайдера, со временем
+    получения) и загружаются при запуске, поэтому после перезапуска каталог отдается
+    сразу, а обращения к API провайдеров идут в фоне.
+    """
+
+    def __init__(self, sync_interval: float = 60.0):
+        # Как часто сверять каталог с набором провайдеров и их кешами в models_io
+        self.sync_interval = sync_interval
+        self._providers: Dict[str, Tuple[List[ModelInfo], float]] = {}  # provider -> (модели, fetched_at)
+        self._models: Dict[str, ModelInfo] = {}
+        self._index: Optional[CatalogIndex] = None
+        self._version = 0
+        # Номер версии уникален только в пределах процесса; префикс отличает ETag после перезапуска
+        self._instance = uuid.uuid4().hex[:8]
+        self._dirty: Set[str] = set()
+        # Каталог нужно сверить при первой возможности (пустой каталог или изменились ключи)
+        self._sync_required = True
+        self._last_sync = 0.0
+        self._sync_lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+        self._persist_task: Optional[asyncio.Task] = None
+
+    # --- Содержимое ---
+
+    def _rebuild(self) -> None:
+        self._models = {model.id: model for models, _ in self._providers.values() for model in models}
+        # Индекс строится при первом запросе после изменения
+        self._index = None
+        self._version += 1
+
+    def update_provider(self, provider: str, models: List[ModelInfo], fetched_at: float) -> None:
+        """Обработчик обновления списка моделей провайдера в models_io."""
+        self._providers[provider] = (list(models), fetched_at)
+        self._rebuild()
+        self._dirty.add(provider)
+        self._schedule_persist()
+
+    def _drop_provider(self, provider: str) -> None:
+        if self._providers.pop(provider, None) is not None:
+            self._rebuild()
+            self._dirty.add(provider)
+            self._schedule_persist()
+
+    def invalidate(self, provider: str) -> None:
+        """Убирает модели провайдера после изменения его ключа; следующий запрос запустит сверку."""
+        self._drop_provider(provider)
+        self._sync_required = True
+
+    # --- Снимок в БД ---
+
+    async def load(self) -> int:
+        """Загружает сохраненный каталог (теплый старт) и заполняет им кеш списков models_io."""
+        async with database.AsyncSessionFactory() as db:
+            rows = await database.get_model_catalog_snapshot(db)
+        for provider, models_json, fetched_at in rows:
+            try:
+                models = [ModelInfo.model_validate(item) for item in json.loads(models_json)]
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Снимок каталога провайдера {provider} поврежден и будет пропущен: {e}")
+                continue
+            timestamp = fetched_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+            self._providers[provider] = (models, timestamp)
+            models_io.seed_models_cache(provider, models, timestamp)
+        self._rebuild()
+        if self._models:
+            # Каталог можно отдавать сразу, сверка с провайдерами пойдет в фоне
+            self._sync_required = False
+            logger.info(f"Каталог моделей загружен из снимка: {len(self._models)} моделей, {len(self._providers)} провайдеров")
+        return len(self._models)
+
+    def _schedule_persist(self) -> None:
+        if self._persist_task is None or self._persist_task.done():
+            self._persist_task = asyncio.create_task(self._persist_later(), name="model_catalog_persist")
+
+    async def _persist_later(self) -> None:
+        await asyncio.sleep(_PERSIST_DELAY)
+        await self.persist()
+
+    async def persist(self) -> None:
+        """Сохраняет изменившиеся списки провайдеров."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        entries = {}
+        for provider in dirty:
+            if provider in self._providers:
+                models, fetched_at = self._providers[provider]
+                models_json = json.dumps([model.model_dump(mode="json", exclude_defaults=True) for model in models],
+                                         ensure_ascii=False, separators=(",", ":"))
+                entries[provider] = (models_json, len(models), datetime.datetime.utcfromtimestamp(fetched_at))
+        removed = [provider for provider in dirty if provider not in self._providers]
+        try:
+            async with database.AsyncSessionFactory() as db:
+                await database.save_model_catalog_snapshot(db, entries, removed)
+        except Exception as e:
+            self._dirty |= dirty
+            logger.error(f"Не удалось сохранить снимок каталога моделей: {e}")
+
+    # --- Сверка с провайдерами ---
+
+    async def sync(self) -> None:
+        """
+        Сверяет каталог с провайдерами: убирает провайдеров без ключа и запрашивает
+        списки остальных через кеш models_io (свежие берутся из кеша, устаревшие
+        обновляются, результат приходит в update_provider). Списки провайдеров без
+        кеша в models_io (mock, OpenAI-совместимые) сохраняются, если изменились.
+        """
+        async with self._sync_lock:
+            started = time.perf_counter()
+            # Сбрасываем до чтения ключей: изменение ключа во время сверки потребует следующей
+            self._sync_required = False
+            try:
+                async with database.AsyncSessionFactory() as db:
+                    active = set(await models_io.get_catalog_providers(db))
+                    all_models = await models_io.get_available_models_details(db)
+            except Exception:
+                self._sync_required = True
+                raise
+            for provider in [p for p in self._providers if p not in active]:
+                self._drop_provider(provider)
+            by_provider: Dict[str, List[ModelInfo]] = {}
+            for model in all_models:
+                by_provider.setdefault(model.provider, []).append(model)
+            now = time.time()
+            for provider, models in by_provider.items():
+                if provider in active and (provider not in self._providers or self._providers[provider][0] != models):
+                    self.update_provider(provider, models, now)
+            self._last_sync = time.monotonic()
+            metrics.catalog_sync_duration.observe(time.perf_counter() - started)
+
+    async def _background_sync(self) -> None:
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.error(f"Ошибка фоновой сверки каталога моделей: {e}")
+
+    def schedule_sync(self) -> None:
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._background_sync(), name="model_catalog_sync")
+
+    async def get_models_map(self) -> Dict[str, ModelInfo]:
+        """
+        Индекс model_id -> ModelInfo. Отвечает текущим состоянием без ожидания:
+        запрос держит свою сессию БД, а сверка открывает собственную под блокировкой,
+        поэтому сверка (после изменения ключей или по интервалу) идет в фоне.
+        """
+        if self._sync_required or time.monotonic() - self._last_sync > self.sync_interval:
+            self.schedule_sync()
+        return self._models
+
+    async def get_index(self) -> CatalogIndex:
+        """Поисковый индекс текущего состояния каталога."""
+        await self.get_models_map()
+        if self._index is None:
+            self._index = CatalogIndex(self._models.values(), f"{self._instance}-{self._version}")
+        return self._index
+
+    async def list_models(self, category: Optional[str] = None) -> List[ModelInfo]:
+        """Модели каталога; category - ID категории или подкатегории (как в фильтре лидерборда)."""
+        index = await self.get_index()
+        return [index.models[pos] for pos in index.filter(category=category)]
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def stats(self) -> Dict[str, object]:
+        now = time.time()
+        return {
+            "models": len(self._models),
+            "version": self._version,
+            "providers": {
+                provider: {"models": len(models), "age_seconds": round(now - fetched_at)}
+                for provider, (models, fetched_at) in self._providers.items()
+            },
+        }
+
+    async def stop(self) -> None:
+        """Останавливает фоновые задачи и сохраняет несохраненные изменения."""
+        for task in (self._sync_task, self._persist_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._sync_task = self._persist_task = None
+        await self.persist()
+
+
+model_catalog = ModelCatalog(sync_interval=settings.models_catalog_sync_interval)
+models_io.add_models_cache_listener(model_catalog.update_provider)
@@ -5,271 +5,347 @@ import logging
 import time
 import functools
 import hashlib
-from typing import List, Optional, Dict, Tuple, Any, Set, Callable, Union
+from collections import OrderedDict
+from typing import List, Optional, Dict, Tuple, Any, Set, Callable, Union, AsyncIterator
 import aiohttp
 from sqlalchemy.ext.asyncio import AsyncSession
 import os
 import socket
 import json
-import importlib
 import sys
-import pkg_resources
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
-# Вспомогательная функция для безопасного импорта с подробной информацией об ошибке
-def safe_import(module_name, as_object=False):
-    try:
-        module = importlib.import_module(module_name)
-        logger.debug(f"Успешно импортирован модуль '{module_name}'")
-        return module if as_object else True
-    except ImportError as e:
-        logger.error(f"Ошибка импорта '{module_name}': {e}")
-        return None if as_object else False
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка при импорте '{module_name}': {e}")
-        return None if as_object else False
-
-# Проверка версии huggingface_hub
-def check_huggingface_version():
-    try:
-        # Проверяем установленную версию
-        installed_packages = pkg_resources.working_set
-        for pkg in installed_packages:
-            if pkg.key == 'huggingface-hub':
-                logger.info(f"Hugging Face Hub версия: {pkg.version}")
-                if pkg.version != "0.23.0":
-                    logger.warning(f"Установлена версия {pkg.version}, но требуется 0.23.0")
-                    return False
-                return True
-        logger.error("Hugging Face Hub не найден в установленных пакетах")
-        return False
-    except Exception as e:
-        logger.error(f"Ошибка при проверке версии huggingface_hub: {e}")
-        return False
-
-# Явная первичная попытка импорта huggingface_hub с диагностикой
-huggingface_hub_module = safe_import('huggingface_hub', as_object=True)
-if huggingface_hub_module:
-    # Проверяем версию
-    version = getattr(huggingface_hub_module, '__version__', 'неизвестно')
-    logger.info(f"Модуль huggingface_hub успешно импортирован, версия: {version}")
-    logger.info(f"Путь к huggingface_hub: {getattr(huggingface_hub_module, '__file__', 'не определен')}")
-    
-    # Если версия не та, которая нам нужна
-    if version != "0.23.0":
-        logger.warning(f"Неправильная версия huggingface_hub: {version}, требуется 0.23.0")
-        # Попытка переустановки правильной версии
-        try:
-            logger.info("Попытка переустановки huggingface_hub с правильной версией...")
-            import subprocess
-            result = subprocess.run([sys.executable, "-m", "pip", "install", "--force-reinstall", "--no-deps", "huggingface_hub==0.23.0"], 
-                                   check=True, capture_output=True, text=True)
-            logger.info(f"Результат переустановки: {result.stdout}")
-            # Перезагрузка модуля
-            if 'huggingface_hub' in sys.modules:
-                del sys.modules['huggingface_hub']
-            huggingface_hub_module = importlib.import_module('huggingface_hub')
-            version = getattr(huggingface_hub_module, '__version__', 'неизвестно')
-            logger.info(f"Модуль huggingface_hub перезагружен, версия: {version}")
-        except Exception as e:
-            logger.error(f"Ошибка при переустановке huggingface_hub: {e}")
-else:
-    logger.error("КРИТИЧЕСКИ ВАЖНЫЙ ИМПОРТ 'huggingface_hub' НЕУДАЧЕН.")
-    logger.error("Проверяем список установленных пакетов...")
-    try:
-        import pkg_resources
-        installed_packages = [pkg.key for pkg in pkg_resources.working_set]
-        logger.info(f"Установлены следующие пакеты: {', '.join(installed_packages)}")
-        
-        if 'huggingface-hub' in installed_packages:
-            logger.info("Пакет huggingface-hub найден в установленных, но импорт не работает. Возможно, проблема с путями импорта.")
-        else:
-            logger.error("Пакет huggingface-hub НЕ найден в установленных пакетах.")
-    except ImportError:
-        logger.error("Не удалось проверить список установленных пакетов.")
-
-# Импорты библиотек провайдеров
-try:
-    from openai import AsyncOpenAI, OpenAIError, AuthenticationError as OpenAIAuthenticationError, NotFoundError as OpenAINotFoundError, RateLimitError as OpenAIRateLimitError
-except ImportError:
-    AsyncOpenAI = None # type: ignore
-    OpenAIError = Exception # type: ignore
-    OpenAIAuthenticationError = Exception # type: ignore
-    OpenAINotFoundError = Exception # type: ignore
-    OpenAIRateLimitError = Exception # type: ignore
-    logging.warning("Библиотека 'openai' не установлена. Функциональность OpenAI будет недоступна.")
-
-try:
-    import google.generativeai as genai
-    from google.api_core.exceptions import ClientError as GoogleClientError, Unauthenticated as GoogleUnauthenticated, PermissionDenied as GooglePermissionDenied, NotFound as GoogleNotFound
-except ImportError:
-    genai = None # type: ignore
-    GoogleClientError = Exception # type: ignore
-    GoogleUnauthenticated = Exception # type: ignore
-    GooglePermissionDenied = Exception # type: ignore
-    GoogleNotFound = Exception # type: ignore
-    logging.warning("Библиотека 'google-generativeai' не установлена. Функциональность Google AI будет недоступна.")
-
-try:
-    from anthropic import AsyncAnthropic, AnthropicError, AuthenticationError as AnthropicAuthenticationError, NotFoundError as AnthropicNotFoundError, RateLimitError as AnthropicRateLimitError
-except ImportError:
-    AsyncAnthropic = None # type: ignore
-    AnthropicError = Exception # type: ignore
-    AnthropicAuthenticationError = Exception # type: ignore
-    AnthropicNotFoundError = Exception # type: ignore
-    AnthropicRateLimitError = Exception # type: ignore
-    logging.warning("Библиотека 'anthropic' не установлена. Функциональность Anthropic (Claude) будет недоступна.")
-
-try:
-    from mistralai.client import MistralClient # У Mistral пока нет официального async клиента, используем sync в executor или aiohttp
-    from mistralai.async_client import MistralAsyncClient
-    from mistralai.exceptions import MistralException, MistralAPIException, MistralConnectionException, MistralAPIStatusException
-except ImportError:
-    MistralAsyncClient = None # type: ignore
-    MistralException = Exception # type: ignore
-    MistralAPIException = Exception # type: ignore
-    MistralConnectionException = Exception # type: ignore
-    MistralAPIStatusException = Exception # type: ignore
-    logging.warning("Библиотека 'mistralai' не установлена. Функциональность Mistral AI будет недоступна.")
-
-try:
-    from groq import AsyncGroq, GroqError, AuthenticationError as GroqAuthenticationError, NotFoundError as GroqNotFoundError, RateLimitError as GroqRateLimitError
-except ImportError:
-    AsyncGroq = None # type: ignore
-    GroqError = Exception # type: ignore
-    GroqAuthenticationError = Exception # type: ignore
-    GroqNotFoundError = Exception # type: ignore
-    GroqRateLimitError = Exception # type: ignore
-    logging.warning("Библиотека 'groq' не установлена. Функциональность Groq будет недоступна.")
-
-# Повторная попытка импорта huggingface_hub после нашей диагностики
-try:
-    # Если модуль уже успешно импортирован, используем его
-    if huggingface_hub_module:
-        AsyncInferenceClient = huggingface_hub_module.AsyncInferenceClient
-        HfApi = huggingface_hub_module.HfApi
-        RepositoryNotFoundError = huggingface_hub_module.utils.RepositoryNotFoundError
-        GatedRepoError = huggingface_hub_module.utils.GatedRepoError
-        HFValidationError = huggingface_hub_module.utils.HFValidationError
-        
-        # Проверяем, существует ли InferenceTimeoutError в версии 0.23.0
-        # В этой версии он может находиться в другом месте или отсутствовать
-        try:
-            # Попытка импорта из модуля inference
-            if hasattr(huggingface_hub_module.inference, "InferenceTimeoutError"):
-                InferenceTimeoutError = huggingface_hub_module.inference.InferenceTimeoutError
-            # Попытка импорта из _common если существует
-            elif hasattr(huggingface_hub_module.inference, "_common") and hasattr(huggingface_hub_module.inference._common, "InferenceTimeoutError"):
-                InferenceTimeoutError = huggingface_hub_module.inference._common.InferenceTimeoutError
-            # Создаем заглушку если не найден
-            else:
-                logger.warning("InferenceTimeoutError не найден в huggingface_hub v0.23.0, создаем заглушку")
-                class InferenceTimeoutError(Exception):
-                    """Заглушка для InferenceTimeoutError."""
-                    pass
-        except AttributeError:
-            logger.warning("Структура huggingface_hub отличается, создаем заглушку для InferenceTimeoutError")
-            class InferenceTimeoutError(Exception):
-                """Заглушка для InferenceTimeoutError."""
-                pass
-        
-        logger.info("Успешно импортированы классы из имеющегося модуля huggingface_hub")
-    else:
-        # Иначе пытаемся импортировать явно
-        from huggingface_hub import AsyncInferenceClient, HfApi
-        from huggingface_hub.utils import RepositoryNotFoundError, GatedRepoError, HFValidationError
-        
-        # Создаем заглушку для InferenceTimeoutError
-        class InferenceTimeoutError(Exception):
-            """Заглушка для InferenceTimeoutError."""
-            pass
-        
-        logger.info("Успешно импортированы классы из huggingface_hub напрямую")
-except ImportError as e:
-    logger.error(f"Ошибка импорта классов из huggingface_hub: {e}")
-    # Пытаемся установить пакет внутри скрипта (это экстренное решение)
-    try:
-        logger.warning("Попытка автоматической установки huggingface_hub...")
-        import subprocess
-        # Принудительная установка с --no-deps для предотвращения конфликтов зависимостей
-        result = subprocess.run([sys.executable, "-m", "pip", "install", "--force-reinstall", "--no-deps", "huggingface_hub==0.23.0"], 
-                               check=True, capture_output=True, text=True)
-        logger.info(f"Результат установки: {result.stdout}")
-        
-        # Очистка кеша импорта если модуль уже был загружен
-        if 'huggingface_hub' in sys.modules:
-            del sys.modules['huggingface_hub']
-        
-        # Пробуем импортировать после установки
-        from huggingface_hub import AsyncInferenceClient, HfApi
-        from huggingface_hub.utils import RepositoryNotFoundError, GatedRepoError, HFValidationError
-        
-        # Создаем заглушку для InferenceTimeoutError вместо импорта
-        class InferenceTimeoutError(Exception):
-            """Заглушка для InferenceTimeoutError."""
-            pass
-            
-        logger.info("huggingface_hub успешно установлен и импортирован автоматически!")
-    except Exception as install_error:
-        AsyncInferenceClient = None # type: ignore
-        HfApi = None # type: ignore
-        RepositoryNotFoundError = Exception # type: ignore
-        GatedRepoError = Exception # type: ignore
-        HFValidationError = Exception # type: ignore
-        InferenceTimeoutError = Exception # type: ignore
-        logger.error(f"Автоматическая установка huggingface_hub не удалась: {install_error}")
-        logger.error("Библиотека 'huggingface_hub' не установлена. Функциональность Hugging Face будет недоступна.")
-except Exception as e:
-    AsyncInferenceClient = None # type: ignore
-    HfApi = None # type: ignore
-    RepositoryNotFoundError = Exception # type: ignore
-    GatedRepoError = Exception # type: ignore
-    HFValidationError = Exception # type: ignore
-    InferenceTimeoutError = Exception # type: ignore
-    logger.error(f"Неожиданная ошибка при импорте huggingface_hub: {e}")
+# --- SDK провайдеров ---
+# Библиотеки провайдеров загружаются лениво (backend.sdk_loader) при первом обращении
+# к провайдеру. До загрузки имена ниже указывают на заглушки; после загрузки
+# sdk_loader подставляет настоящие классы клиентов и исключений.
 
+def _sdk_placeholder(name: str) -> type:
+    """
+    Класс исключения-заглушки для еще не загруженного SDK. Такое исключение никогда
+    не выбрасывается, поэтому except/isinstance с ним не перехватывают чужие ошибки.
+    """
+    return type(name, (Exception,), {"__doc__": f"Заглушка для {name}: SDK провайдера не загружен."})
+
+AsyncOpenAI = None # type: ignore
+OpenAIError = _sdk_placeholder("OpenAIError")
+OpenAIAuthenticationError = _sdk_placeholder("OpenAIAuthenticationError")
+OpenAINotFoundError = _sdk_placeholder("OpenAINotFoundError")
+OpenAIRateLimitError = _sdk_placeholder("OpenAIRateLimitError")
+
+genai = None # type: ignore
+GoogleClientError = _sdk_placeholder("GoogleClientError")
+GoogleUnauthenticated = _sdk_placeholder("GoogleUnauthenticated")
+GooglePermissionDenied = _sdk_placeholder("GooglePermissionDenied")
+GoogleNotFound = _sdk_placeholder("GoogleNotFound")
+
+AsyncAnthropic = None # type: ignore
+AnthropicError = _sdk_placeholder("AnthropicError")
+AnthropicAuthenticationError = _sdk_placeholder("AnthropicAuthenticationError")
+AnthropicNotFoundError = _sdk_placeholder("AnthropicNotFoundError")
+AnthropicRateLimitError = _sdk_placeholder("AnthropicRateLimitError")
+
+MistralAsyncClient = None # type: ignore
+MistralException = _sdk_placeholder("MistralException")
+MistralAPIException = _sdk_placeholder("MistralAPIException")
+MistralConnectionException = _sdk_placeholder("MistralConnectionException")
+MistralAPIStatusException = _sdk_placeholder("MistralAPIStatusException")
+
+AsyncGroq = None # type: ignore
+GroqError = _sdk_placeholder("GroqError")
+GroqAuthenticationError = _sdk_placeholder("GroqAuthenticationError")
+GroqNotFoundError = _sdk_placeholder("GroqNotFoundError")
+GroqRateLimitError = _sdk_placeholder("GroqRateLimitError")
+
+AsyncInferenceClient = None # type: ignore
+HfApi = None # type: ignore
+RepositoryNotFoundError = _sdk_placeholder("RepositoryNotFoundError")
+GatedRepoError = _sdk_placeholder("GatedRepoError")
+HFValidationError = _sdk_placeholder("HFValidationError")
+InferenceTimeoutError = _sdk_placeholder("InferenceTimeoutError")
+
+def _bind_sdk(provider: str, names: Dict[str, Any]) -> None:
+    """Подставляет классы загруженного SDK вместо заглушек."""
+    globals().update(names)
 
 # Импорты из нашего проекта
-from backend import database
+from backend import database, metrics, tracing
+from backend.sdk_loader import sdk_loader
+from backend.loop_monitor import run_blocking
+from backend.providers import (
+    provider_registry, ProviderAdapter, MockProvider,
+    ERROR_AUTH, ERROR_NOT_FOUND, ERROR_RATE_LIMIT, ERROR_TIMEOUT, ERROR_NETWORK, ERROR_API
+)
+from backend.scheduler import ProviderScheduler, SchedulerTimeout, is_rate_limited, rate_limit_headers
 from backend.config import (
     settings, ModelInfo, InteractionRequest, InteractionResponse,
-    ComparisonRequest, ComparisonResponse, SUPPORTED_PROVIDERS
+    ComparisonRequest, ComparisonResponse, MultiModelRequest, MultiModelResponse
 )
 
+sdk_loader.subscribe(_bind_sdk)
+
 logger = logging.getLogger(__name__)
 
 # --- Кеширование ответов ---
 class ResponseCache:
-    """Простая реализация кеша в памяти."""
-    def __init__(self, ttl: int = 3600):
-        self.cache = {}
+    """
+    Кеш ответов моделей в памяти (LRU) с ограничением по числу записей и по суммарному
+    размеру ответов в байтах.
+    - вытеснение наименее используемой записи за O(1) (OrderedDict);
+    - индекс записей по модели: очистка одной модели/провайдера не перебирает весь кеш;
+    - фоновая очистка истекших записей (TTL одинаковый, поэтому порядок добавления
+      совпадает с порядком истечения и очистка стоит O(числа истекших записей));
+    - опциональный персистентный уровень (cache_store.ResponseCacheStore): aget() при
+      промахе в памяти читает с диска, set() ставит запись на диск в фоновую очередь.
+    """
+    def __init__(self, ttl: int = 3600, max_entries: int = 5000, max_bytes: int = 64 * 1024 * 1024):
         self.ttl = ttl  # время жизни кеша в секундах
-    
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, float, int, str]]" = OrderedDict()  # key -> (value, expires_at, size, model_id), порядок LRU
+        self._expiry_order: "OrderedDict[str, float]" = OrderedDict()  # key -> expires_at, порядок добавления
+        self._by_model: Dict[str, Set[str]] = {}  # model_id -> ключи
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._store = None  # cache_store.ResponseCacheStore, если включен
+
+    @staticmethod
+    def _estimate_size(key: str, value: Any) -> int:
+        """Оценивает размер записи: основную память занимает текст ответа."""
+        text = getattr(value, "response", value)
+        if isinstance(text, str):
+            size = len(text.encode("utf-8"))
+        else:
+            size = sys.getsizeof(text)
+        return size + len(key)
+
+    def _remove(self, key: str) -> None:
+        """Удаляет запись и все ссылки на нее из индексов."""
+        _, _, size, model_id = self._entries.pop(key)
+        self._expiry_order.pop(key, None)
+        self._bytes -= size
+        keys = self._by_model.get(model_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_model[model_id]
+
     def get(self, key: str) -> Optional[Any]:
         """Получает элемент из кеша по ключу."""
-        if key in self.cache:
-            entry, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                return entry
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[1] <= time.time():
             # Если время истекло, удаляем запись
-            del self.cache[key]
-        return None
-    
-    def set(self, key: str, value: Any) -> None:
-        """Устанавливает элемент в кеш с текущим временем."""
-        self.cache[key] = (value, time.time())
-    
-    def clear(self, prefix: Optional[str] = None) -> None:
-        """Очищает кеш или его часть по префиксу."""
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    @tracing.traced("response_cache.get")
+    async def aget(self, key: str) -> Optional[Any]:
+        """Получает элемент сначала из памяти, затем из персистентного уровня."""
+        value = self.get(key)
+        if value is not None or self._store is None:
+            return value
+        data = await self._store.get(key)
+        if data is None:
+            return None
+        value = InteractionResponse.model_validate(data)
+        # Поднимаем запись в память, не записывая ее повторно на диск
+        self._set_memory(key, value, data.get("model_id") or key.split(":", 1)[0])
+        return value
+
+    def set(self, key: str, value: Any, model_id: Optional[str] = None) -> None:
+        """
+        Сохраняет элемент в кеш. model_id используется для индекса по моделям;
+        если не указан, берется из ключа (часть до первого ':').
+        """
+        model_id = model_id or key.split(":", 1)[0]
+        self._set_memory(key, value, model_id)
+        if self._store is not None and hasattr(value, "model_dump"):
+            self._store.schedule_set(key, model_id, value.model_dump(mode="json"))
+
+    def _set_memory(self, key: str, value: Any, model_id: str) -> None:
+        size = self._estimate_size(key, value)
+        if size > self.max_bytes:
+            logger.debug(f"Ответ размером {size} байт превышает бюджет кеша и не кешируется")
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.time() + self.ttl
+        self._entries[key] = (value, expires_at, size, model_id)
+        self._expiry_order[key] = expires_at
+        self._by_model.setdefault(model_id, set()).add(key)
+        self._bytes += size
+
+        # Вытесняем наименее используемые записи, пока не уложимся в лимиты
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self, prefix: Optional[str] = None) -> int:
+        """
+        Очищает кеш или его часть. prefix - ID модели ('openai/gpt-4o') или провайдера
+        ('openai' / 'openai/'). Возвращает количество удаленных записей.
+        """
+        if self._store is not None:
+            self._store.schedule_clear(prefix)
         if prefix is None:
-            self.cache = {}
-        else:
-            self.cache = {k: v for k, v in self.cache.items() if not k.startswith(prefix)}
+            removed = len(self._entries)
+            self._entries.clear()
+            self._expiry_order.clear()
+            self._by_model.clear()
+            self._bytes = 0
+            return removed
+
+        # Перебираем только модели (а не все записи) и удаляем записи подходящих моделей
+        provider_prefix = prefix if prefix.endswith("/") else f"{prefix}/"
+        matched_models = [m for m in self._by_model if m == prefix or m.startswith(provider_prefix)]
+        removed = 0
+        for model_id in matched_models:
+            for key in list(self._by_model.get(model_id, ())):
+                self._remove(key)
+                removed += 1
+        return removed
+
+    def sweep(self) -> int:
+        """Удаляет истекшие записи. Возвращает количество удаленных записей."""
+        now = time.time()
+        removed = 0
+        while self._expiry_order:
+            key, expires_at = next(iter(self._expiry_order.items()))
+            if expires_at > now:
+                break
+            self._remove(key)
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику использования кеша."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "models": len(self._by_model),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "persistent": self._store is not None,
+        }
+
+    @property
+    def store(self) -> Optional[Any]:
+        """Персистентный уровень кеша или None."""
+        return self._store
+
+    def attach_store(self, store: Any) -> None:
+        """Подключает персистентный уровень кеша (уже открытый ResponseCacheStore)."""
+        self._store = store
+
+    async def detach_store(self) -> None:
+        """Отключает персистентный уровень, дописав отложенные изменения."""
+        store, self._store = self._store, None
+        if store is not None:
+            await store.close()
+
+    async def _sweep_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Из кеша ответов удалено истекших записей: {removed}")
+            if self._store is not None:
+                await self._store.compact()
+
+    def start_sweeper(self, interval: float) -> None:
+        """Запускает фоновую очистку истекших записей."""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweep_periodically(interval), name="response_cache_sweeper")
+
+    async def stop_sweeper(self) -> None:
+        """Останавливает фоновую очистку."""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+
+class SingleFlight:
+    """
+    Объединение одновременных идентичных запросов (single-flight): по ключу выполняется
+    только первый запрос, остальные ожидают его результат.
+    Общая задача защищена от отмены: если первый клиент отключится, остальные
+    все равно получат ответ.
+    """
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        """Возвращает выполняющуюся задачу по ключу, если она есть."""
+        return self._flights.get(key)
+
+    async def do(self, key: str, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Выполняет factory() или присоединяется к уже выполняющемуся вызову с тем же ключом.
+        Возвращает (результат, был_ли_запрос_объединен).
+        """
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.create_task(factory(), name=f"singleflight:{key[:40]}")
+        self._flights[key] = task
+
+        def _forget(finished: asyncio.Task) -> None:
+            if self._flights.get(key) is finished:
+                del self._flights[key]
+
+        task.add_done_callback(_forget)
+        return await asyncio.shield(task), False
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced}
+
+# Выполняющиеся кешируемые запросы к моделям (ключ - ключ кеша ответов)
+inflight_requests = SingleFlight()
+
+# Очереди исходящих запросов к провайдерам
+provider_scheduler = ProviderScheduler(
+    default_concurrency=settings.provider_max_concurrency,
+    default_tokens_per_minute=settings.provider_tokens_per_minute,
+    max_wait=settings.provider_queue_timeout,
+    max_retries=settings.provider_rate_limit_retries,
+    overrides=settings.provider_limits
+)
 
 # Создаем экземпляр кеша ответов
-response_cache = ResponseCache(ttl=settings.response_cache_ttl)
+response_cache = ResponseCache(
+    ttl=settings.response_cache_ttl,
+    max_entries=settings.response_cache_max_entries,
+    max_bytes=settings.response_cache_max_mb * 1024 * 1024
+)
 
 # --- Вспомогательные функции ---
 
@@ -281,47 +357,168 @@ def _parse_model_id(full_model_id: str) -> Tuple[str, str]:
         logger.warning(f"Неверный формат model_id '{full_model_id}'. Предполагается Hugging Face.")
         return "huggingface_hub", full_model_id
     provider, model_name = full_model_id.split('/', 1)
-    if provider not in SUPPORTED_PROVIDERS:
+    if provider not in provider_registry:
         raise ValueError(f"Неподдерживаемый провайдер '{provider}' в ID модели '{full_model_id}'")
     return provider, model_name
 
+def _key_fingerprint(api_key: str) -> str:
+    """Возвращает короткий отпечаток ключа, чтобы не хранить сам ключ в именах и логах."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+async def _close_client(client: Any) -> None:
+    """Закрывает клиент провайдера (или словарь клиентов), если он поддерживает закрытие."""
+    if isinstance(client, dict):
+        for sub_client in client.values():
+            await _close_client(sub_client)
+        return
+    for method_name in ("aclose", "close"):
+        close_method = getattr(client, method_name, None)
+        if callable(close_method):
+            result = close_method()
+            if asyncio.iscoroutine(result):
+                await result
+            return
+
+class ProviderClientRegistry:
+    """
+    Реестр долгоживущих клиентов провайдеров.
+    Хранит по одному "теплому" клиенту на пару (провайдер, отпечаток ключа),
+    чтобы переиспользовать пул HTTP-соединений и TLS-сессии между запросами.
+    Вытесненные клиенты закрываются через close_grace секунд: запросы, начатые
+    со старым ключом, продолжают пользоваться клиентом до завершения.
+    """
+    def __init__(self, close_grace: float = 300.0):
+        self.close_grace = close_grace
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        # Задача отложенного закрытия -> вытесненный клиент
+        self._retired: Dict[asyncio.Task, Any] = {}
+
+    def get_or_create(self, provider: str, api_key: str) -> Optional[Any]:
+        """Возвращает существующий клиент для ключа или создает новый."""
+        fingerprint = _key_fingerprint(api_key)
+        client = self._clients.get((provider, fingerprint))
+        if client is not None:
+            return client
+
+        # Ключ провайдера сменился - старые клиенты больше не нужны
+        self.invalidate(provider)
+
+        client = _create_provider_client(provider, api_key)
+        if client is not None:
+            self._clients[(provider, fingerprint)] = client
+            logger.debug(f"Создан клиент для провайдера {provider} (ключ {fingerprint[:8]}...)")
+        return client
+
+    def invalidate(self, provider: Optional[str] = None) -> None:
+        """Удаляет клиенты провайдера (или всех провайдеров) и закрывает их в фоне после close_grace."""
+        stale_keys = [key for key in self._clients if provider is None or key[0] == provider]
+        for key in stale_keys:
+            client = self._clients.pop(key)
+            try:
+                task = asyncio.get_running_loop().create_task(self._close_later(client))
+            except RuntimeError:
+                # Нет запущенного цикла событий - закрыть асинхронно нечем
+                continue
+            self._retired[task] = client
+            task.add_done_callback(lambda done: self._retired.pop(done, None))
+        if stale_keys:
+            logger.info(f"Сброшено клиентов провайдеров: {len(stale_keys)} ({provider or 'все'})")
+
+    async def _close_later(self, client: Any) -> None:
+        await asyncio.sleep(self.close_grace)
+        try:
+            await _close_client(client)
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии клиента провайдера: {e}")
+
+    async def aclose(self) -> None:
+        """Закрывает все клиенты, включая ожидающие отложенного закрытия. Вызывается при остановке приложения."""
+        # Запросы к этому моменту завершены: вытесненные клиенты закрываются сразу
+        retired = dict(self._retired)
+        for task in retired:
+            task.cancel()
+        if retired:
+            await asyncio.gather(*retired, return_exceptions=True)
+        clients = list(self._clients.values()) + list(retired.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await _close_client(client)
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии клиента провайдера: {e}")
+        logger.info(f"Закрыто клиентов провайдеров: {len(clients)}")
+
+# Глобальный реестр клиентов провайдеров
+provider_clients = ProviderClientRegistry(close_grace=settings.provider_client_close_grace)
+
+@tracing.traced("provider.client")
 async def _get_provider_client(db: AsyncSession, provider: str) -> Optional[Any]:
-    """Получает API ключ и инициализирует асинхронный клиент для провайдера."""
+    """Получает API ключ и возвращает долгоживущий асинхронный клиент для провайдера."""
+    adapter = provider_registry.get(provider)
+    if adapter is None:
+        logger.warning(f"Провайдер '{provider}' не зарегистрирован.")
+        return None
+    if not adapter.requires_key:
+        return adapter.create_client(None)
+
     api_key = await database.get_api_key(db, provider)
     if not api_key:
-        # Отдельно проверяем токен HF из настроек, если он есть
-        if provider == "huggingface_hub" and settings.hugging_face_hub_token:
-             api_key = settings.hugging_face_hub_token.get_secret_value()
-             logger.debug("Используется токен Hugging Face из настроек.")
+        # Отдельно проверяем ключ провайдера из настроек, если он есть
+        default_key = getattr(settings, adapter.settings_key) if adapter.settings_key else None
+        if default_key:
+            api_key = default_key.get_secret_value()
+            logger.debug(f"Используется ключ провайдера {provider} из настроек.")
         else:
             logger.warning(f"API ключ для провайдера '{provider}' не найден в БД.")
             return None
 
+    # SDK импортируется только при первом обращении к провайдеру
+    if adapter.sdk:
+        await sdk_loader.aload(adapter.sdk)
+    return provider_clients.get_or_create(provider, api_key)
+
+def _create_provider_client(provider: str, api_key: str) -> Optional[Any]:
+    """Инициализирует новый асинхронный клиент для провайдера через его адаптер."""
+    adapter = provider_registry.get(provider)
     try:
-        if provider == "openai" and AsyncOpenAI:
-            return AsyncOpenAI(api_key=api_key)
-        elif provider == "google" and genai:
-            # У Google нет явного async клиента для list_models, но есть для generate_content_async
-            # Настроим ключ для использования в genai.configure и вернем сам ключ для list_models
-            genai.configure(api_key=api_key)
-            return api_key # Возвращаем ключ для list_models, а generate_content_async будет использовать настроенный
-        elif provider == "anthropic" and AsyncAnthropic:
-            return AsyncAnthropic(api_key=api_key)
-        elif provider == "mistral" and MistralAsyncClient:
-            return MistralAsyncClient(api_key=api_key)
-        elif provider == "groq" and AsyncGroq:
-            return AsyncGroq(api_key=api_key)
-        elif provider == "huggingface_hub" and AsyncInferenceClient:
-            # Для листинга моделей может понадобиться HfApi, для инференса - AsyncInferenceClient
-            # Вернем кортеж или словарь
-            return {"inference": AsyncInferenceClient(token=api_key), "api": HfApi(token=api_key)}
-        else:
+        client = adapter.create_client(api_key) if adapter else None
+        if client is None:
             logger.error(f"Клиент для провайдера '{provider}' не может быть инициализирован (библиотека не установлена?).")
-            return None
+        return client
     except Exception as e:
         logger.exception(f"Ошибка инициализации клиента для провайдера {provider}: {e}", exc_info=e)
         return None
 
+def _create_openai_client(api_key: str) -> Optional[Any]:
+    return AsyncOpenAI(api_key=api_key, base_url=settings.openai_base_url) if AsyncOpenAI else None
+
+def _create_openai_compatible_client(api_key: str, base_url: str) -> Optional[Any]:
+    """Клиент OpenAI SDK для OpenAI-совместимого API (OpenRouter, Together)."""
+    return AsyncOpenAI(api_key=api_key, base_url=base_url) if AsyncOpenAI else None
+
+def _create_google_client(api_key: str) -> Optional[Any]:
+    if not genai:
+        return None
+    # У Google нет явного async клиента для list_models, но есть для generate_content_async
+    # Настроим ключ для использования в genai.configure и вернем сам ключ для list_models
+    genai.configure(api_key=api_key)
+    return api_key # Возвращаем ключ для list_models, а generate_content_async будет использовать настроенный
+
+def _create_anthropic_client(api_key: str) -> Optional[Any]:
+    return AsyncAnthropic(api_key=api_key, base_url=settings.anthropic_base_url) if AsyncAnthropic else None
+
+def _create_mistral_client(api_key: str) -> Optional[Any]:
+    return MistralAsyncClient(api_key=api_key) if MistralAsyncClient else None
+
+def _create_groq_client(api_key: str) -> Optional[Any]:
+    return AsyncGroq(api_key=api_key) if AsyncGroq else None
+
+def _create_huggingface_client(api_key: str) -> Optional[Any]:
+    if not AsyncInferenceClient:
+        return None
+    # Для листинга моделей нужен HfApi, для инференса - AsyncInferenceClient
+    return {"inference": AsyncInferenceClient(token=api_key), "api": HfApi(token=api_key)}
+
 def _guess_category(provider: str, model_name: str) -> Optional[str]:
     """Простая эвристика для определения категории модели."""
     model_name_lower = model_name.lower()
@@ -407,45 +604,115 @@ def _get_model_metadata(provider: str, model_name: str) -> Dict[str, Any]:
 # формат: {provider: {model_name: ModelInfo, ...}, ...}
 _models_cache: Dict[str, Dict[str, ModelInfo]] = {}
 _last_cache_refresh: Dict[str, float] = {}
-_CACHE_TTL = 3600  # Время жизни кеша в секундах (1 час)
-_cache_lock = asyncio.Lock()  # Для синхронизации доступа к кешу
+_CACHE_TTL = settings.models_cache_ttl  # Время жизни кеша в секундах
+# Блокировка на провайдера: медленный список одного провайдера не задерживает остальных
+_cache_locks: Dict[str, asyncio.Lock] = {}
+# Фоновые обновления устаревших списков (не больше одного на провайдера)
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+# Экспоненциальная задержка повторов после ошибок: provider -> (число ошибок подряд, время следующей попытки, ошибка)
+_refresh_backoff: Dict[str, Tuple[int, float, Exception]] = {}
+# Растет при очистке кеша провайдера: результат обновления, начатого до очистки, не сохраняется
+_cache_generation: Dict[str, int] = {}
+# Подписчики на обновление списка моделей провайдера: callback(provider, models, fetched_at)
+_models_cache_listeners: List[Callable[[str, List[ModelInfo], float], None]] = []
+
+def add_models_cache_listener(callback: Callable[[str, List[ModelInfo], float], None]) -> None:
+    """Подписывает callback на каждое успешное обновление списка моделей провайдера."""
+    _models_cache_listeners.append(callback)
+
+def seed_models_cache(provider: str, models: List[ModelInfo], fetched_at: float) -> None:
+    """
+    Заполняет кеш сохраненным списком (теплый старт). Время получения сохраняется,
+    поэтому устаревший снимок будет обновлен в фоне при первом обращении.
+    """
+    if provider in _models_cache:
+        return
+    _models_cache[provider] = {model.id.split('/', 1)[1]: model for model in models}
+    _last_cache_refresh[provider] = fetched_at
+
+def _get_cache_lock(provider: str) -> asyncio.Lock:
+    lock = _cache_locks.get(provider)
+    if lock is None:
+        lock = _cache_locks[provider] = asyncio.Lock()
+    return lock
+
+async def _refresh_models_cache(provider: str, func: Callable, args: tuple, kwargs: dict) -> List[ModelInfo]:
+    """Запрашивает список моделей у провайдера и обновляет кеш. При ошибке откладывает следующую попытку."""
+    generation = _cache_generation.get(provider, 0)
+    started = time.perf_counter()
+    try:
+        models = await func(*args, **kwargs)
+    except Exception as e:
+        metrics.catalog_refresh_duration.observe(time.perf_counter() - started, provider, "error")
+        failures = _refresh_backoff[provider][0] + 1 if provider in _refresh_backoff else 1
+        delay = min(settings.models_cache_retry_base * 2 ** (failures - 1), settings.models_cache_retry_max)
+        if generation == _cache_generation.get(provider, 0):
+            _refresh_backoff[provider] = (failures, time.time() + delay, e)
+        logger.error(f"Ошибка при обновлении кеша моделей для {provider} (попытка {failures}), повтор через {delay:.0f} сек.: {e}")
+        raise
+
+    metrics.catalog_refresh_duration.observe(time.perf_counter() - started, provider, "ok")
+    if generation == _cache_generation.get(provider, 0):
+        fetched_at = time.time()
+        _models_cache[provider] = {model.id.split('/', 1)[1]: model for model in models}
+        _last_cache_refresh[provider] = fetched_at
+        _refresh_backoff.pop(provider, None)
+        for listener in _models_cache_listeners:
+            try:
+                listener(provider, models, fetched_at)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика обновления списка моделей {provider}: {e}")
+    return models
+
+async def _background_refresh(provider: str, func: Callable, args: tuple, kwargs: dict) -> None:
+    try:
+        async with _get_cache_lock(provider):
+            await _refresh_models_cache(provider, func, args, kwargs)
+    except Exception:
+        # Ошибка уже записана, до следующей попытки отдаются устаревшие данные
+        pass
+    finally:
+        _refresh_tasks.pop(provider, None)
+
+def model_cache(provider: str, ttl: Optional[int] = None) -> Callable:
+    """
+    Декоратор для кеширования результатов fetch_*_models функций (stale-while-revalidate).
 
-def model_cache(provider: str, ttl: int = _CACHE_TTL) -> Callable:
-    """Декоратор для кеширования результатов fetch_*_models функций."""
+    Если список есть в кеше, он возвращается сразу, даже устаревший; по истечении TTL
+    обновление запускается в фоне. Ждать приходится только при пустом кеше, причем
+    одновременные запросы к одному провайдеру ждут один общий вызов API. После ошибки
+    следующая попытка откладывается экспоненциально (models_cache_retry_base ... _max).
+    """
     def decorator(func: Callable) -> Callable:
         @functools.wraps(func)
         async def wrapper(*args, **kwargs) -> List[ModelInfo]:
-            global _models_cache, _last_cache_refresh
-            
+            cache_ttl = _CACHE_TTL if ttl is None else ttl
             current_time = time.time()
-            
-            # Используем блокировку для предотвращения race condition
-            async with _cache_lock:
-                if (provider not in _models_cache or 
-                    provider not in _last_cache_refresh or 
-                    current_time - _last_cache_refresh[provider] > ttl):
-                    
-                    # Вызываем оригинальную функцию для обновления кеша
-                    logger.debug(f"Обновляем кеш моделей для провайдера {provider}")
-                    try:
-                        models = await func(*args, **kwargs)
-                        
-                        # Обновляем кеш
-                        _models_cache[provider] = {model.id.split('/', 1)[1]: model for model in models}
-                        _last_cache_refresh[provider] = current_time
-                        return models
-                    except Exception as e:
-                        logger.error(f"Ошибка при обновлении кеша моделей для {provider}: {e}")
-                        # Если в кеше уже есть данные, вернем их даже если обновление не удалось
-                        if provider in _models_cache:
-                            logger.info(f"Возвращаем устаревшие данные из кеша для {provider}")
-                            return list(_models_cache[provider].values())
-                        # Иначе пробросим исключение дальше
-                        raise
-                
-                # Возвращаем закешированные данные
+            backoff = _refresh_backoff.get(provider)
+            retry_allowed = backoff is None or current_time >= backoff[1]
+
+            cached = _models_cache.get(provider)
+            if cached is not None:
+                if (current_time - _last_cache_refresh.get(provider, 0) > cache_ttl
+                        and retry_allowed and provider not in _refresh_tasks):
+                    logger.debug(f"Кеш моделей для провайдера {provider} устарел, обновляем в фоне")
+                    _refresh_tasks[provider] = asyncio.create_task(
+                        _background_refresh(provider, func, args, kwargs), name=f"models_cache_refresh_{provider}"
+                    )
                 logger.debug(f"Используем кеш моделей для провайдера {provider}")
-                return list(_models_cache[provider].values())
+                return list(cached.values())
+
+            async with _get_cache_lock(provider):
+                # Пока ждали блокировку, список мог загрузить другой запрос
+                cached = _models_cache.get(provider)
+                if cached is not None:
+                    return list(cached.values())
+                backoff = _refresh_backoff.get(provider)
+                if backoff is not None and time.time() < backoff[1]:
+                    # Не обращаемся к API до окончания задержки после ошибки
+                    raise backoff[2]
+                logger.debug(f"Загружаем список моделей для провайдера {provider}")
+                return await _refresh_models_cache(provider, func, args, kwargs)
         
         return wrapper
     return decorator
@@ -495,7 +762,8 @@ async def _fetch_google_models(api_key: str) -> List[ModelInfo]:
     if not genai or not api_key: return models_info
     try:
         # genai.configure(api_key=api_key) # Уже сделано в _get_provider_client
-        google_models = genai.list_models() # Используем синхронный вызов, т.к. нет async версии
+        # У SDK нет async версии, а list_models лениво листает страницы: весь список читается в пуле потоков
+        google_models = await run_blocking(lambda: list(genai.list_models()))
         for model in google_models:
             # Фильтруем модели, поддерживающие генерацию контента ('generateContent')
             # и извлекаем только имя модели после 'models/'
@@ -662,6 +930,36 @@ async def _fetch_groq_models(client: AsyncGroq) -> List[ModelInfo]:
         raise
     return models_info
 
+async def _fetch_openai_compatible_models(provider: str, client: AsyncOpenAI) -> List[ModelInfo]:
+    """
+    Получает список моделей OpenAI-совместимого API (OpenRouter, Together).
+    Кеш подключается при регистрации адаптера: model_cache(provider).
+    """
+    models_info = []
+    if not client: return models_info
+    try:
+        models = await client.models.list()
+        for model in models.data:
+            models_info.append(ModelInfo(
+                id=f"{provider}/{model.id}",
+                name=model.id,
+                provider=provider,
+                category=_guess_category(provider, model.id),
+                # Все модели доступны через Chat Completion API, системный промт поддерживается
+                supports_system_prompt=True
+            ))
+        logger.info(f"Загружено {len(models_info)} моделей от {provider}.")
+    except OpenAIAuthenticationError:
+        logger.error(f"Ошибка аутентификации {provider}. Проверьте API ключ.")
+        raise
+    except OpenAIError as e:
+        logger.error(f"Ошибка API {provider} при получении списка моделей: {e}")
+        raise
+    except Exception as e:
+        logger.exception(f"Неизвестная ошибка при получении моделей {provider}: {e}", exc_info=True)
+        raise
+    return models_info
+
 @model_cache("huggingface_hub")
 async def _fetch_huggingface_models(clients: Dict[str, Any]) -> List[ModelInfo]:
     """Получает список моделей от Hugging Face Hub (текстовые модели)."""
@@ -669,18 +967,21 @@ async def _fetch_huggingface_models(clients: Dict[str, Any]) -> List[ModelInfo]:
     if not HfApi or not clients or "api" not in clients: return models_info
     hf_api: HfApi = clients["api"]
     try:
-        # Ищем популярные модели для text-generation и conversational
-        # Ограничиваем количество для производительности
-        models = list(hf_api.list_models(
-            filter="text-generation", sort="downloads", direction=-1, limit=50, cardData=True
-        ))
-        models.extend(list(hf_api.list_models(
-            filter="conversational", sort="downloads", direction=-1, limit=50, cardData=True
-        )))
-        # Добавим модели для кода
-        models.extend(list(hf_api.list_models(
-             filter="text2text-generation", tags="code", sort="downloads", direction=-1, limit=20, cardData=True
-        )))
+        # Ищем популярные модели для text-generation и conversational, плюс модели для кода.
+        # Ограничиваем количество для производительности. HfApi синхронный: три списка
+        # запрашиваются параллельно в пуле потоков
+        listings = await asyncio.gather(
+            run_blocking(lambda: list(hf_api.list_models(
+                filter="text-generation", sort="downloads", direction=-1, limit=50, cardData=True
+            ))),
+            run_blocking(lambda: list(hf_api.list_models(
+                filter="conversational", sort="downloads", direction=-1, limit=50, cardData=True
+            ))),
+            run_blocking(lambda: list(hf_api.list_models(
+                filter="text2text-generation", tags="code", sort="downloads", direction=-1, limit=20, cardData=True
+            ))),
+        )
+        models = [model for listing in listings for model in listing]
 
         seen_ids = set()
         for model in models:
@@ -711,24 +1012,39 @@ async def _fetch_huggingface_models(clients: Dict[str, Any]) -> List[ModelInfo]:
 async def clear_models_cache(provider: Optional[str] = None) -> None:
     """
     Очищает кеш моделей для указанного провайдера или для всех провайдеров.
-    Полезно вызывать после обновления API ключа.
+    Полезно вызывать после обновления API ключа: сбрасывает и задержку после ошибок.
     """
-    global _models_cache, _last_cache_refresh
-    
-    async with _cache_lock:
-        if provider:
-            if provider in _models_cache:
-                del _models_cache[provider]
-            if provider in _last_cache_refresh:
-                del _last_cache_refresh[provider]
-            logger.info(f"Кеш моделей для провайдера {provider} очищен.")
-        else:
-            _models_cache.clear()
-            _last_cache_refresh.clear()
-            logger.info("Кеш моделей для всех провайдеров очищен.")
+    providers = [provider] if provider else list(set(_models_cache) | set(_refresh_backoff) | set(_refresh_tasks))
+    for cached_provider in providers:
+        _models_cache.pop(cached_provider, None)
+        _last_cache_refresh.pop(cached_provider, None)
+        _refresh_backoff.pop(cached_provider, None)
+        # Результат уже запущенного обновления (со старым ключом) будет отброшен
+        _cache_generation[cached_provider] = _cache_generation.get(cached_provider, 0) + 1
+    if provider:
+        logger.info(f"Кеш моделей для провайдера {provider} очищен.")
+    else:
+        logger.info("Кеш моделей для всех провайдеров очищен.")
 
 # --- Оптимизируем функцию get_available_models_details ---
 
+async def get_catalog_providers(db: AsyncSession) -> List[str]:
+    """Провайдеры, модели которых попадают в каталог: с ключом в БД или в настройках и без ключа (mock)."""
+    # Получаем список провайдеров, для которых есть ключи
+    from sqlalchemy import select
+    stmt = select(database.ApiKey.provider)
+    result = await db.execute(stmt)
+    providers_with_keys = [row[0] for row in result.all() if row[0] in provider_registry]
+    
+    # Добавляем провайдеров с ключом в настройках (HF, OpenRouter, Together) и без ключа (mock)
+    for provider in provider_registry.names():
+        adapter = provider_registry.get(provider)
+        if provider in providers_with_keys:
+            continue
+        if not adapter.requires_key or (adapter.settings_key and getattr(settings, adapter.settings_key)):
+            providers_with_keys.append(provider)
+    return providers_with_keys
+
 async def get_available_models_details(db: AsyncSession) -> List[ModelInfo]:
     """
     Получает информацию о доступных моделях от всех провайдеров,
@@ -737,16 +1053,7 @@ async def get_available_models_details(db: AsyncSession) -> List[ModelInfo]:
     logger.info("Получение списка доступных моделей...")
     all_models: List[ModelInfo] = []
 
-    # Получаем список провайдеров, для которых есть ключи
-    from sqlalchemy import select
-    stmt = select(database.ApiKey.provider)
-    result = await db.execute(stmt)
-    providers_with_keys = [row[0] for row in result.all()]
-    
-    # Добавляем HuggingFace, если есть токен в настройках
-    if "huggingface_hub" not in providers_with_keys and settings.hugging_face_hub_token:
-        providers_with_keys.append("huggingface_hub")
-    
+    providers_with_keys = await get_catalog_providers(db)
     if not providers_with_keys:
         logger.warning("Нет доступных API ключей для получения моделей.")
         return []
@@ -763,19 +1070,7 @@ async def get_available_models_details(db: AsyncSession) -> List[ModelInfo]:
             continue
         
         # Создаем задачу для получения моделей провайдера
-        if provider == "openai":
-            tasks.append(_fetch_openai_models(client))
-        elif provider == "google":
-            tasks.append(_fetch_google_models(client))
-        elif provider == "anthropic":
-            tasks.append(_fetch_anthropic_models(client))
-        elif provider == "mistral":
-            tasks.append(_fetch_mistral_models(client))
-        elif provider == "groq":
-            tasks.append(_fetch_groq_models(client))
-        elif provider == "huggingface_hub":
-            tasks.append(_fetch_huggingface_models(client))
-        # Добавлять новых провайдеров здесь
+        tasks.append(provider_registry.get(provider).list_models(client))
     
     # Ожидаем завершения всех задач
     if tasks:
@@ -795,6 +1090,58 @@ async def get_available_models_details(db: AsyncSession) -> List[ModelInfo]:
 
 # --- Логика Выполнения Запросов к Моделям (Inference) ---
 
+def _chat_request_params(model_name: str, prompt: str, params: Dict,
+                         use_system_prompt: bool = True, use_penalties: bool = True) -> Dict[str, Any]:
+    """Собирает параметры запроса в формате Chat Completion (OpenAI, Groq, Mistral)."""
+    # Формируем сообщения
+    messages = []
+    
+    # Добавляем системный промт, если есть
+    if use_system_prompt and params.get("system_prompt"):
+        messages.append({"role": "system", "content": params["system_prompt"]})
+    
+    # Добавляем основной промт
+    messages.append({"role": "user", "content": prompt})
+    
+    # Собираем параметры запроса
+    request_params = {
+        "model": model_name,
+        "messages": messages,
+        "temperature": params.get("temperature"),
+        "max_tokens": params.get("max_tokens"),
+    }
+    
+    # Добавляем опциональные параметры, если они указаны
+    if params.get("top_p") is not None:
+        request_params["top_p"] = params["top_p"]
+    if use_penalties and params.get("frequency_penalty") is not None:
+        request_params["frequency_penalty"] = params["frequency_penalty"]
+    if use_penalties and params.get("presence_penalty") is not None:
+        request_params["presence_penalty"] = params["presence_penalty"]
+    if params.get("stop_sequences"):
+        request_params["stop"] = params["stop_sequences"]
+    return request_params
+
+def _anthropic_request_params(model_name: str, prompt: str, params: Dict) -> Dict[str, Any]:
+    """Собирает параметры запроса к Anthropic Messages API."""
+    request_params = {
+        "model": model_name,
+        "max_tokens": params.get("max_tokens", 1024),  # У Anthropic max_tokens обязательный
+        "temperature": params.get("temperature"),
+    }
+    
+    # Добавляем опциональные параметры
+    if params.get("top_p") is not None:
+        request_params["top_p"] = params["top_p"]
+    
+    # Добавляем системный промт, если есть
+    if params.get("system_prompt"):
+        request_params["system"] = params["system_prompt"]
+    
+    # Добавляем основной промт
+    request_params["messages"] = [{"role": "user", "content": prompt}]
+    return request_params
+
 async def _infer_openai(client: AsyncOpenAI, model_name: str, prompt: str, params: Dict) -> Tuple[str, Dict]:
     """Выполняет запрос к OpenAI Chat Completion API."""
     if not client: 
@@ -804,35 +1151,10 @@ async def _infer_openai(client: AsyncOpenAI, model_name: str, prompt: str, param
     token_count = {"prompt": 0, "completion": 0, "total": 0}
     
     try:
-        # Формируем сообщения
-        messages = []
-        
-        # Добавляем системный промт, если есть
-        if params.get("system_prompt"):
-            messages.append({"role": "system", "content": params["system_prompt"]})
-        
-        # Добавляем основной промт
-        messages.append({"role": "user", "content": prompt})
-        
-        # Собираем параметры запроса
-        request_params = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": params.get("temperature"),
-            "max_tokens": params.get("max_tokens"),
-        }
-        
-        # Добавляем опциональные параметры, если они указаны
-        if params.get("top_p") is not None:
-            request_params["top_p"] = params["top_p"]
-        if params.get("frequency_penalty") is not None:
-            request_params["frequency_penalty"] = params["frequency_penalty"]
-        if params.get("presence_penalty") is not None:
-            request_params["presence_penalty"] = params["presence_penalty"]
-        if params.get("stop_sequences"):
-            request_params["stop"] = params["stop_sequences"]
-        
-        response = await client.chat.completions.create(**request_params)
+        request_params = _chat_request_params(model_name, prompt, params)
+        # Сырой ответ нужен, чтобы прочитать заголовки x-ratelimit-* для планировщика
+        raw_response = await client.chat.completions.with_raw_response.create(**request_params)
+        response = raw_response.parse()
         
         # Получаем токены
         if hasattr(response, 'usage'):
@@ -843,7 +1165,11 @@ async def _infer_openai(client: AsyncOpenAI, model_name: str, prompt: str, param
         content = response.choices[0].message.content
         elapsed_time = time.time() - start_time
         
-        return content if content else "", {"elapsed_time": elapsed_time, "token_count": token_count}
+        return content if content else "", {
+            "elapsed_time": elapsed_time,
+            "token_count": token_count,
+            "rate_limit_headers": rate_limit_headers(raw_response.headers)
+        }
         
     except (OpenAIAuthenticationError, OpenAINotFoundError, OpenAIRateLimitError) as e:
         elapsed_time = time.time() - start_time
@@ -941,29 +1267,9 @@ async def _infer_anthropic(client: AsyncAnthropic, model_name: str, prompt: str,
     token_count = {"prompt": None, "completion": None, "total": None}
     
     try:
-        # Формируем запрос
-        request_params = {
-            "model": model_name,
-            "max_tokens": params.get("max_tokens", 1024),  # У Anthropic max_tokens обязательный
-            "temperature": params.get("temperature"),
-        }
-        
-        # Добавляем опциональные параметры
-        if params.get("top_p") is not None:
-            request_params["top_p"] = params["top_p"]
-            
-        # Формируем сообщения
-        messages = []
-        
-        # Добавляем системный промт, если есть
-        if params.get("system_prompt"):
-            request_params["system"] = params["system_prompt"]
-        
-        # Добавляем основной промт
-        messages = [{"role": "user", "content": prompt}]
-        request_params["messages"] = messages
-        
-        response = await client.messages.create(**request_params)
+        request_params = _anthropic_request_params(model_name, prompt, params)
+        raw_response = await client.messages.with_raw_response.create(**request_params)
+        response = raw_response.parse()
         
         # Ответ в response.content, который является списком блоков (обычно один TextBlock)
         text_content = "".join(block.text for block in response.content if hasattr(block, 'text'))
@@ -975,7 +1281,11 @@ async def _infer_anthropic(client: AsyncAnthropic, model_name: str, prompt: str,
             token_count["total"] = token_count["prompt"] + token_count["completion"] if token_count["prompt"] and token_count["completion"] else None
         
         elapsed_time = time.time() - start_time
-        return text_content, {"elapsed_time": elapsed_time, "token_count": token_count}
+        return text_content, {
+            "elapsed_time": elapsed_time,
+            "token_count": token_count,
+            "rate_limit_headers": rate_limit_headers(raw_response.headers)
+        }
         
     except (AnthropicAuthenticationError, AnthropicNotFoundError, AnthropicRateLimitError) as e:
         elapsed_time = time.time() - start_time
@@ -999,30 +1309,7 @@ async def _infer_mistral(client: MistralAsyncClient, model_name: str, prompt: st
     token_count = {"prompt": None, "completion": None, "total": None}
     
     try:
-        # Формируем сообщения
-        messages = []
-        
-        # Добавляем системный промт, если есть
-        if params.get("system_prompt"):
-            messages.append({"role": "system", "content": params["system_prompt"]})
-        
-        # Добавляем основной промт
-        messages.append({"role": "user", "content": prompt})
-        
-        # Формируем параметры запроса
-        request_params = {
-            "model": model_name,
-            "messages": messages,
-            "max_tokens": params.get("max_tokens"),
-            "temperature": params.get("temperature"),
-        }
-        
-        # Добавляем опциональные параметры
-        if params.get("top_p") is not None:
-            request_params["top_p"] = params["top_p"]
-        if params.get("stop_sequences"):
-            request_params["stop"] = params["stop_sequences"]
-        
+        request_params = _chat_request_params(model_name, prompt, params, use_penalties=False)
         response = await client.chat(**request_params)
         
         # Получаем информацию о токенах, если она есть
@@ -1066,36 +1353,13 @@ async def _infer_groq(client: AsyncGroq, model_name: str, prompt: str, params: D
     token_count = {"prompt": None, "completion": None, "total": None}
     
     try:
-        # Формируем сообщения
-        messages = []
-        
-        # Добавляем системный промт, если он поддерживается и указан
+        # Системный промт передаем, только если модель его поддерживает
         metadata = _get_model_metadata("groq", model_name)
-        if metadata["supports_system_prompt"] and params.get("system_prompt"):
-            messages.append({"role": "system", "content": params["system_prompt"]})
-        
-        # Добавляем основной промт
-        messages.append({"role": "user", "content": prompt})
-        
-        # Формируем параметры запроса
-        request_params = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": params.get("temperature"),
-            "max_tokens": params.get("max_tokens"),
-        }
-        
-        # Добавляем опциональные параметры
-        if params.get("top_p") is not None:
-            request_params["top_p"] = params["top_p"]
-        if params.get("frequency_penalty") is not None:
-            request_params["frequency_penalty"] = params["frequency_penalty"]
-        if params.get("presence_penalty") is not None:
-            request_params["presence_penalty"] = params["presence_penalty"]
-        if params.get("stop_sequences"):
-            request_params["stop"] = params["stop_sequences"]
-        
-        response = await client.chat.completions.create(**request_params)
+        request_params = _chat_request_params(
+            model_name, prompt, params, use_system_prompt=metadata["supports_system_prompt"]
+        )
+        raw_response = await client.chat.completions.with_raw_response.create(**request_params)
+        response = raw_response.parse()
         
         # Получаем токены, если они есть
         if hasattr(response, 'usage'):
@@ -1106,7 +1370,11 @@ async def _infer_groq(client: AsyncGroq, model_name: str, prompt: str, params: D
         content = response.choices[0].message.content
         elapsed_time = time.time() - start_time
         
-        return content if content else "", {"elapsed_time": elapsed_time, "token_count": token_count}
+        return content if content else "", {
+            "elapsed_time": elapsed_time,
+            "token_count": token_count,
+            "rate_limit_headers": rate_limit_headers(raw_response.headers)
+        }
         
     except (GroqAuthenticationError, GroqNotFoundError, GroqRateLimitError) as e:
         elapsed_time = time.time() - start_time
@@ -1280,15 +1548,12 @@ async def _infer_huggingface(clients: Dict[str, Any], model_name: str, prompt: s
         raise ConnectionError(f"Неизвестная ошибка при запросе к Hugging Face: {e}")
 
 
-async def run_single_inference(db: AsyncSession, request: InteractionRequest) -> InteractionResponse:
-    """Выполняет запрос к одной модели, обрабатывая ошибки."""
-    full_model_id = request.model_id
-    prompt = request.prompt
-    
-    # Соберем все параметры запроса
+async def _resolve_inference_params(db: AsyncSession, request: InteractionRequest) -> Dict[str, Any]:
+    """Собирает параметры запроса с учетом значений по умолчанию и системного промта модели."""
     params = {
         "max_tokens": request.max_tokens or settings.default_max_tokens,
-        "temperature": request.temperature or settings.default_temperature,
+        # temperature=0 - допустимое значение, поэтому сравниваем с None
+        "temperature": request.temperature if request.temperature is not None else settings.default_temperature,
         "top_p": request.top_p,
         "frequency_penalty": request.frequency_penalty,
         "presence_penalty": request.presence_penalty,
@@ -1297,152 +1562,184 @@ async def run_single_inference(db: AsyncSession, request: InteractionRequest) ->
     
     # Получаем системный промт, если он не указан в запросе
     if request.system_prompt is None:
-        params["system_prompt"] = await database.get_system_prompt(db, full_model_id)
+        params["system_prompt"] = await database.get_system_prompt(db, request.model_id)
     else:
         params["system_prompt"] = request.system_prompt
-    
-    response_text = ""
-    error_message = None
-    token_info = {"prompt": None, "completion": None, "total": None}
-    elapsed_time = 0
-    
-    # Проверяем кеш, если температура низкая
-    use_cache = params.get("temperature", 0.7) <= 0.1
-    cache_key = None
-    
-    if use_cache:
-        cache_key = f"{full_model_id}:{hashlib.md5(prompt.encode()).hexdigest()}:{params.get('max_tokens')}:{params.get('system_prompt', '')}"
-        cached_response = response_cache.get(cache_key)
-        if cached_response:
-            logger.info(f"Возвращаем кешированный ответ для {full_model_id}")
-            return cached_response
-
-    start_time = time.time()
-    logger.info(f"Запрос к модели {full_model_id} (prompt: '{prompt[:30]}...')")
-
-    try:
-        provider, model_name = _parse_model_id(full_model_id)
-        client_or_key = await _get_provider_client(db, provider)
-
-        if client_or_key is None:
-            raise ValueError(f"API ключ для провайдера '{provider}' не найден или клиент не инициализирован.")
+    return params
 
-        # Вызов соответствующей функции для провайдера
-        if provider == "openai":
-            response_text, meta = await _infer_openai(client_or_key, model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        elif provider == "google":
-            response_text, meta = await _infer_google(model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        elif provider == "anthropic":
-            response_text, meta = await _infer_anthropic(client_or_key, model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        elif provider == "mistral":
-            response_text, meta = await _infer_mistral(client_or_key, model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        elif provider == "groq":
-            response_text, meta = await _infer_groq(client_or_key, model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        elif provider == "huggingface_hub":
-            response_text, meta = await _infer_huggingface(client_or_key, model_name, prompt, params)
-            elapsed_time = meta.get("elapsed_time", 0)
-            token_info = meta.get("token_count", token_info)
-        else:
-            # Это не должно произойти из-за _parse_model_id
-            raise ValueError(f"Обработчик для провайдера '{provider}' не реализован.")
-        
-        # Если успешный запрос с низкой температурой, кешируем результат
-        if use_cache and cache_key and not error_message:
-            response = InteractionResponse(
-                model_id=full_model_id,
-                response=response_text,
-                error=error_message,
-                elapsed_time=elapsed_time,
-                token_count=token_info
-            )
-            response_cache.set(cache_key, response)
-            return response
+def _build_cache_key(full_model_id: str, prompt: str, params: Dict[str, Any]) -> Optional[str]:
+    """Возвращает ключ кеша ответа или None, если запрос не кешируется (высокая температура)."""
+    if params.get("temperature", 0.7) > 0.1:
+        return None
+    return f"{full_model_id}:{hashlib.md5(prompt.encode()).hexdigest()}:{params.get('max_tokens')}:{params.get('system_prompt', '')}"
+
+def _describe_inference_error(e: Exception, full_model_id: str, provider: Optional[str], model_name: Optional[str]) -> str:
+    """Логирует ошибку запроса к модели и возвращает понятное пользователю сообщение."""
+    # Очередь к провайдеру не освободилась за отведенное время
+    if isinstance(e, SchedulerTimeout):
+        metrics.inference_errors.inc(provider or "unknown", "queue_timeout")
+        logger.warning(f"Запрос к {full_model_id} не дождался очереди: {e}")
+        retry_hint = f" Повторите через {e.retry_after:.0f} сек." if e.retry_after else " Попробуйте позже."
+        return f"Провайдер {provider} перегружен запросами.{retry_hint}"
+
+    # Категорию ошибки SDK определяет адаптер провайдера
+    adapter = provider_registry.get(provider) if provider else None
+    category = adapter.classify_error(e) if adapter else None
+    error_type = type(e).__name__
+    metrics.inference_errors.inc(provider or "unknown", category or "other")
 
     # Обработка ошибок аутентификации
-    except (OpenAIAuthenticationError, AnthropicAuthenticationError, 
-            GroqAuthenticationError, GoogleUnauthenticated, GooglePermissionDenied) as e:
-        error_type = type(e).__name__
+    if category == ERROR_AUTH:
         logger.error(f"Ошибка аутентификации API {provider} для модели {full_model_id}: {error_type}: {e}")
-        error_message = f"Ошибка аутентификации API {provider}. Пожалуйста, проверьте ваш API ключ."
+        return f"Ошибка аутентификации API {provider}. Пожалуйста, проверьте ваш API ключ."
 
     # Обработка ошибок, связанных с отсутствием модели
-    except (OpenAINotFoundError, AnthropicNotFoundError, GroqNotFoundError, GoogleNotFound) as e:
-        error_type = type(e).__name__
+    if category == ERROR_NOT_FOUND:
         logger.error(f"Модель {full_model_id} не найдена у провайдера {provider}: {error_type}: {e}")
-        error_message = f"Модель '{model_name}' не найдена у провайдера {provider}."
+        return f"Модель '{model_name}' не найдена у провайдера {provider}."
 
     # Обработка ошибок, связанных с превышением лимитов запросов
-    except (OpenAIRateLimitError, AnthropicRateLimitError, GroqRateLimitError) as e:
-        error_type = type(e).__name__
+    if category == ERROR_RATE_LIMIT:
         logger.error(f"Превышен лимит запросов к API {provider} для модели {full_model_id}: {error_type}: {e}")
-        error_message = f"Превышен лимит запросов к API {provider}. Пожалуйста, попробуйте позже."
+        return f"Превышен лимит запросов к API {provider}. Пожалуйста, попробуйте позже."
         
     # Обработка ошибок, связанных с валидацией запросов
-    except (ValueError, NotImplementedError) as e:
+    if isinstance(e, (ValueError, NotImplementedError)):
         logger.warning(f"Ошибка конфигурации или реализации для {full_model_id}: {e}")
         if "API ключ" in str(e):
-            error_message = f"API ключ для провайдера '{provider}' не настроен. Добавьте ключ в настройках."
-        else:
-            error_message = f"Ошибка конфигурации: {e}"
+            return f"API ключ для провайдера '{provider}' не настроен. Добавьте ключ в настройках."
+        return f"Ошибка конфигурации: {e}"
             
     # Обработка сетевых ошибок
-    except (ConnectionAbortedError, TimeoutError, ConnectionError, 
-            InferenceTimeoutError, MistralConnectionException) as e:
-        error_type = type(e).__name__
+    if category in (ERROR_TIMEOUT, ERROR_NETWORK) or isinstance(e, (ConnectionAbortedError, TimeoutError, ConnectionError)):
         error_details = str(e)
         logger.error(f"Ошибка сети при запросе к {full_model_id}: {error_type}: {error_details}")
         
         # Определяем тип ошибки для понятного сообщения пользователю
-        if "timeout" in error_details.lower() or isinstance(e, TimeoutError) or isinstance(e, InferenceTimeoutError):
-            error_message = f"Превышено время ожидания ответа от модели {provider}/{model_name}. Попробуйте позже или уменьшите размер промта."
-        elif "currently loading" in error_details.lower() or "unavailable" in error_details.lower():
-            error_message = f"Модель {provider}/{model_name} в данный момент загружается или временно недоступна. Пожалуйста, попробуйте позже."
-        else:
-            error_message = f"Ошибка сети при запросе к {provider}. Проверьте подключение к интернету и попробуйте позже."
+        if category == ERROR_TIMEOUT or "timeout" in error_details.lower() or isinstance(e, TimeoutError):
+            return f"Превышено время ожидания ответа от модели {provider}/{model_name}. Попробуйте позже или уменьшите размер промта."
+        if "currently loading" in error_details.lower() or "unavailable" in error_details.lower():
+            return f"Модель {provider}/{model_name} в данный момент загружается или временно недоступна. Пожалуйста, попробуйте позже."
+        return f"Ошибка сети при запросе к {provider}. Проверьте подключение к интернету и попробуйте позже."
     
     # Обработка общих ошибок API
-    except (OpenAIError, AnthropicError, GroqError, MistralAPIException, 
-            MistralAPIStatusException, GoogleClientError) as e:
-        error_type = type(e).__name__
+    if category == ERROR_API:
         logger.error(f"Ошибка API {provider} для модели {full_model_id}: {error_type}: {e}")
         
         # Проверяем, содержит ли ошибка информацию о превышении размера контекста
         error_details = str(e).lower()
         if "context" in error_details and ("length" in error_details or "size" in error_details or "too long" in error_details):
-            error_message = f"Превышен максимальный размер контекста для модели {provider}/{model_name}. Уменьшите размер промта."
-        elif "content policy" in error_details or "moderation" in error_details or "harmful" in error_details:
-            error_message = f"Запрос был отклонен политикой безопасности {provider}. Измените содержание промта."
-        else:
-            error_message = f"Ошибка сервиса {provider}: {str(e)[:100]}..."
+            return f"Превышен максимальный размер контекста для модели {provider}/{model_name}. Уменьшите размер промта."
+        if "content policy" in error_details or "moderation" in error_details or "harmful" in error_details:
+            return f"Запрос был отклонен политикой безопасности {provider}. Измените содержание промта."
+        return f"Ошибка сервиса {provider}: {str(e)[:100]}..."
     
     # Обработка любых других исключений
-    except Exception as e:
-        logger.exception(f"Непредвиденная ошибка при запросе к {full_model_id}: {type(e).__name__}: {e}", exc_info=True)
-        
-        # Создаем идентификатор ошибки для отслеживания
-        import uuid
-        error_id = str(uuid.uuid4())[:8]
-        
-        # Записываем детальный лог с ID для облегчения отладки
-        logger.error(f"[Error ID: {error_id}] Подробная информация об ошибке: {str(e)}")
+    logger.exception(f"Непредвиденная ошибка при запросе к {full_model_id}: {type(e).__name__}: {e}", exc_info=e)
+    
+    # Создаем идентификатор ошибки для отслеживания
+    import uuid
+    error_id = str(uuid.uuid4())[:8]
+    
+    # Записываем детальный лог с ID для облегчения отладки; ID трассы связывает его со спанами запроса
+    trace_id = tracing.current_trace_id()
+    trace_info = f" [Trace ID: {trace_id}]" if trace_id else ""
+    logger.error(f"[Error ID: {error_id}]{trace_info} Подробная информация об ошибке: {str(e)}")
+    
+    # Отправляем пользователю сообщение с ID ошибки для обращения в поддержку
+    return f"Внутренняя ошибка сервера при обработке запроса. Идентификатор ошибки: {error_id}"
+
+
+async def run_single_inference(db: AsyncSession, request: InteractionRequest) -> InteractionResponse:
+    """Выполняет запрос к одной модели, обрабатывая ошибки."""
+    full_model_id = request.model_id
+    prompt = request.prompt
+    
+    # Соберем все параметры запроса
+    params = await _resolve_inference_params(db, request)
+    
+    # Проверяем кеш, если температура низкая
+    cache_key = _build_cache_key(full_model_id, prompt, params)
+    if cache_key is None:
+        return await _execute_inference(db, request, params, None)
+    
+    cached_response = await response_cache.aget(cache_key)
+    if cached_response:
+        logger.info(f"Возвращаем кешированный ответ для {full_model_id}")
+        return cached_response
+
+    # Идентичные запросы, которые уже выполняются, ждут общий результат вместо повторного вызова API.
+    # Общий запрос переживает отмену первого вызывающего, поэтому сессию запроса (db) ему
+    # передавать нельзя: она закроется вместе с отмененным вызовом
+    response, coalesced = await inflight_requests.do(
+        cache_key, lambda: _execute_inference_in_own_session(request, params, cache_key)
+    )
+    if coalesced:
+        logger.info(f"Запрос к {full_model_id} объединен с уже выполняющимся идентичным запросом")
+        return response.model_copy(update={"coalesced": True})
+    return response
+
+async def _execute_inference_in_own_session(request: InteractionRequest, params: Dict[str, Any],
+                                            cache_key: Optional[str]) -> InteractionResponse:
+    """_execute_inference с собственной сессией БД - для общего запроса inflight_requests."""
+    async with database.AsyncSessionFactory() as db:
+        return await _execute_inference(db, request, params, cache_key)
+
+async def _execute_inference(db: AsyncSession, request: InteractionRequest, params: Dict[str, Any],
+                             cache_key: Optional[str]) -> InteractionResponse:
+    """Вызывает API провайдера и сохраняет успешный ответ в кеш, если задан cache_key."""
+    full_model_id = request.model_id
+    prompt = request.prompt
+    use_cache = cache_key is not None
+    
+    response_text = ""
+    error_message = None
+    token_info = {"prompt": None, "completion": None, "total": None}
+    elapsed_time = 0
+    provider, model_name = None, None
+
+    start_time = time.time()
+    logger.info(f"Запрос к модели {full_model_id} (prompt: '{prompt[:30]}...')")
+
+    try:
+        provider, model_name = _parse_model_id(full_model_id)
+        adapter = provider_registry.get(provider)
+        client_or_key = await _get_provider_client(db, provider)
+
+        if client_or_key is None:
+            raise ValueError(f"API ключ для провайдера '{provider}' не найден или клиент не инициализирован.")
+
+        # Запрос выполняется в очереди провайдера: лимиты параллельности и токенов, повтор после 429.
+        # Время ожидания в очереди - разница между provider.request и вложенными provider.infer
+        with tracing.span("provider.request", provider=provider, model=model_name):
+            response_text, meta = await provider_scheduler.run(
+                provider, model_name, adapter.count_tokens(prompt, params),
+                lambda: adapter.infer(client_or_key, model_name, prompt, params)
+            )
+        elapsed_time = meta.get("elapsed_time", 0)
+        token_info = meta.get("token_count", token_info)
         
-        # Отправляем пользователю сообщение с ID ошибки для обращения в поддержку
-        error_message = f"Внутренняя ошибка сервера при обработке запроса. Идентификатор ошибки: {error_id}"
+        # Если успешный запрос с низкой температурой, кешируем результат
+        if use_cache and cache_key and not error_message:
+            response = InteractionResponse(
+                model_id=full_model_id,
+                response=response_text,
+                error=error_message,
+                elapsed_time=elapsed_time,
+                token_count=token_info
+            )
+            response_cache.set(cache_key, response, model_id=full_model_id)
+            metrics.record_inference(provider, model_name, "single", elapsed_time, False, token_info)
+            return response
+
+    except Exception as e:
+        error_message = _describe_inference_error(e, full_model_id, provider, model_name)
 
     if not elapsed_time:
         elapsed_time = time.time() - start_time
         
     logger.info(f"Ответ от {full_model_id} получен за {elapsed_time:.2f} сек. Ошибка: {error_message is not None}")
+    metrics.record_inference(provider, model_name, "single", elapsed_time, error_message is not None, token_info)
 
     return InteractionResponse(
         model_id=full_model_id,
@@ -1452,26 +1749,340 @@ async def run_single_inference(db: AsyncSession, request: InteractionRequest) ->
         token_count=token_info
     )
 
+# --- Потоковый инференс (streaming) ---
+
+async def _stream_openai_compatible(client: Any, model_name: str, prompt: str, params: Dict,
+                                    meta: Dict, use_system_prompt: bool = True,
+                                    extra_params: Optional[Dict] = None) -> AsyncIterator[str]:
+    """Потоковый запрос к API в формате OpenAI Chat Completion (OpenAI, Groq)."""
+    if not client:
+        raise ValueError("Клиент провайдера не инициализирован.")
+    request_params = _chat_request_params(model_name, prompt, params, use_system_prompt=use_system_prompt)
+    request_params.update(extra_params or {})
+    stream = await client.chat.completions.create(**request_params, stream=True)
+    async for chunk in stream:
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+        # Некоторые провайдеры присылают usage в последнем чанке
+        usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+        if usage:
+            meta["token_count"] = {
+                "prompt": usage.prompt_tokens,
+                "completion": usage.completion_tokens,
+                "total": usage.total_tokens
+            }
+
+async def _stream_openai(client: AsyncOpenAI, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к OpenAI Chat Completion API."""
+    # Без include_usage OpenAI не возвращает счетчики токенов в потоковом режиме
+    async for delta in _stream_openai_compatible(client, model_name, prompt, params, meta,
+                                                 extra_params={"stream_options": {"include_usage": True}}):
+        yield delta
+
+async def _stream_groq(client: AsyncGroq, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к Groq API (формат OpenAI)."""
+    metadata = _get_model_metadata("groq", model_name)
+    async for delta in _stream_openai_compatible(client, model_name, prompt, params, meta,
+                                                 use_system_prompt=metadata["supports_system_prompt"]):
+        yield delta
+
+async def _stream_anthropic(client: AsyncAnthropic, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к Anthropic Messages API."""
+    if not client:
+        raise ValueError("Клиент Anthropic не инициализирован.")
+    request_params = _anthropic_request_params(model_name, prompt, params)
+    async with client.messages.stream(**request_params) as stream:
+        async for text in stream.text_stream:
+            if text:
+                yield text
+        final_message = await stream.get_final_message()
+    if getattr(final_message, "usage", None):
+        prompt_tokens = final_message.usage.input_tokens
+        completion_tokens = final_message.usage.output_tokens
+        meta["token_count"] = {
+            "prompt": prompt_tokens,
+            "completion": completion_tokens,
+            "total": prompt_tokens + completion_tokens if prompt_tokens and completion_tokens else None
+        }
 
-async def run_comparison_inference(db: AsyncSession, request: ComparisonRequest) -> ComparisonResponse:
-    """Выполняет запросы к двум моделям параллельно."""
-    logger.info(f"Запрос на сравнение моделей {request.model_id_1} и {request.model_id_2}")
-
-    # Создаем запросы для каждой модели с их системными промтами
-    request1 = InteractionRequest(
-        model_id=request.model_id_1,
-        prompt=request.prompt,
-        max_tokens=request.max_tokens,
-        temperature=request.temperature,
-        top_p=request.top_p,
-        frequency_penalty=request.frequency_penalty,
-        presence_penalty=request.presence_penalty,
-        stop_sequences=request.stop_sequences,
-        system_prompt=request.system_prompt_1
+async def _stream_mistral(client: MistralAsyncClient, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к Mistral AI API."""
+    if not client:
+        raise ValueError("Клиент Mistral AI не инициализирован.")
+    request_params = _chat_request_params(model_name, prompt, params, use_penalties=False)
+    async for chunk in client.chat_stream(**request_params):
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+        if getattr(chunk, "usage", None):
+            meta["token_count"] = {
+                "prompt": chunk.usage.prompt_tokens,
+                "completion": chunk.usage.completion_tokens,
+                "total": chunk.usage.total_tokens
+            }
+
+async def _stream_google(model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к Google AI API."""
+    if not genai:
+        raise ValueError("Библиотека Google AI не установлена.")
+    model = genai.GenerativeModel(model_name)
+    generation_config = genai.types.GenerationConfig(
+         max_output_tokens=params.get("max_tokens"),
+         temperature=params.get("temperature"),
+         top_p=params.get("top_p"),
     )
-    
-    request2 = InteractionRequest(
-        model_id=request.model_id_2,
+    if params.get("system_prompt"):
+        contents = [
+            genai.types.Content(parts=[genai.types.Part(text=params["system_prompt"])], role="system"),
+            genai.types.Content(parts=[genai.types.Part(text=prompt)], role="user")
+        ]
+    else:
+        contents = prompt
+    response = await model.generate_content_async(contents, generation_config=generation_config, stream=True)
+    async for chunk in response:
+        if chunk.parts:
+            yield chunk.text
+        elif chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+            raise ValueError(f"Запрос к Google AI заблокирован: {chunk.prompt_feedback.block_reason.name}")
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            meta["token_count"] = {"prompt": None, "completion": None, "total": usage.total_token_count}
+
+async def _stream_huggingface(clients: Dict[str, Any], model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+    """Потоковый запрос к Hugging Face Inference API (text-generation)."""
+    if not clients or "inference" not in clients:
+        raise ValueError("Клиент Hugging Face Inference не инициализирован.")
+    request_params = {
+        "model": model_name,
+        "prompt": prompt,
+        "max_new_tokens": params.get("max_tokens"),
+        "temperature": params.get("temperature", 1.0),  # HF требует > 0
+        "stream": True
+    }
+    if params.get("top_p") is not None:
+        request_params["top_p"] = params["top_p"]
+    if params.get("stop_sequences"):
+        request_params["stop_sequences"] = params["stop_sequences"]
+    async for token in await clients["inference"].text_generation(**request_params):
+        if token:
+            yield token
+
+# --- Реестр адаптеров провайдеров ---
+# Имена классов исключений - из словарей, которые возвращают загрузчики sdk_loader
+
+_OPENAI_ERRORS = {
+    ERROR_AUTH: ("OpenAIAuthenticationError",),
+    ERROR_NOT_FOUND: ("OpenAINotFoundError",),
+    ERROR_RATE_LIMIT: ("OpenAIRateLimitError",),
+    ERROR_API: ("OpenAIError",),
+}
+
+provider_registry.register(ProviderAdapter(
+    "openai", sdk="openai", errors=_OPENAI_ERRORS,
+    create_client=_create_openai_client,
+    list_models=_fetch_openai_models,
+    infer=_infer_openai,
+    stream=_stream_openai,
+))
+provider_registry.register(ProviderAdapter(
+    "google", sdk="google",
+    errors={
+        ERROR_AUTH: ("GoogleUnauthenticated", "GooglePermissionDenied"),
+        ERROR_NOT_FOUND: ("GoogleNotFound",),
+        ERROR_API: ("GoogleClientError",),
+    },
+    create_client=_create_google_client,
+    list_models=_fetch_google_models,
+    # Google использует ключ, настроенный через genai.configure, клиент не нужен
+    infer=lambda client, model_name, prompt, params: _infer_google(model_name, prompt, params),
+    stream=lambda client, model_name, prompt, params, meta: _stream_google(model_name, prompt, params, meta),
+))
+provider_registry.register(ProviderAdapter(
+    "anthropic", sdk="anthropic",
+    errors={
+        ERROR_AUTH: ("AnthropicAuthenticationError",),
+        ERROR_NOT_FOUND: ("AnthropicNotFoundError",),
+        ERROR_RATE_LIMIT: ("AnthropicRateLimitError",),
+        ERROR_API: ("AnthropicError",),
+    },
+    create_client=_create_anthropic_client,
+    list_models=_fetch_anthropic_models,
+    infer=_infer_anthropic,
+    stream=_stream_anthropic,
+))
+provider_registry.register(ProviderAdapter(
+    "mistral", sdk="mistral",
+    errors={
+        ERROR_NETWORK: ("MistralConnectionException",),
+        ERROR_API: ("MistralAPIException", "MistralAPIStatusException"),
+    },
+    create_client=_create_mistral_client,
+    list_models=_fetch_mistral_models,
+    infer=_infer_mistral,
+    stream=_stream_mistral,
+))
+provider_registry.register(ProviderAdapter(
+    "groq", sdk="groq",
+    errors={
+        ERROR_AUTH: ("GroqAuthenticationError",),
+        ERROR_NOT_FOUND: ("GroqNotFoundError",),
+        ERROR_RATE_LIMIT: ("GroqRateLimitError",),
+        ERROR_API: ("GroqError",),
+    },
+    create_client=_create_groq_client,
+    list_models=_fetch_groq_models,
+    infer=_infer_groq,
+    stream=_stream_groq,
+))
+provider_registry.register(ProviderAdapter(
+    "huggingface_hub", sdk="huggingface_hub", settings_key="hugging_face_hub_token",
+    errors={ERROR_TIMEOUT: ("InferenceTimeoutError",)},
+    create_client=_create_huggingface_client,
+    list_models=_fetch_huggingface_models,
+    infer=_infer_huggingface,
+    stream=_stream_huggingface,
+))
+
+# OpenAI-совместимые API: клиент OpenAI SDK со своим base_url
+for _provider, _base_url, _settings_key in (
+    ("openrouter", settings.openrouter_base_url, "openrouter_api_key"),
+    ("together", settings.together_base_url, "together_api_key"),
+):
+    provider_registry.register(ProviderAdapter(
+        _provider, sdk="openai", errors=_OPENAI_ERRORS, settings_key=_settings_key,
+        create_client=functools.partial(_create_openai_compatible_client, base_url=_base_url),
+        list_models=model_cache(_provider)(functools.partial(_fetch_openai_compatible_models, _provider)),
+        infer=_infer_openai,
+        stream=_stream_openai_compatible,
+    ))
+
+if settings.mock_provider_enabled:
+    provider_registry.register(MockProvider(
+        latency_ms=settings.mock_provider_latency_ms,
+        token_latency_ms=settings.mock_provider_token_latency_ms,
+    ))
+    logger.warning("Включен mock провайдер (модели mock/*): ответы генерируются локально, без обращения к API.")
+
+async def stream_single_inference(db: AsyncSession, request: InteractionRequest) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Выполняет потоковый запрос к одной модели.
+    Отдает события {"event": "delta", "text": ...} по мере генерации и завершающее
+    событие {"event": "done", ...} с временем до первого токена (ttft) и общим временем.
+    Сессия БД используется только до первого события.
+    """
+    full_model_id = request.model_id
+    prompt = request.prompt
+    params = await _resolve_inference_params(db, request)
+
+    start_time = time.time()
+    done_event = {
+        "event": "done",
+        "model_id": full_model_id,
+        "error": None,
+        "ttft": None,
+        "elapsed_time": None,
+        "token_count": {"prompt": None, "completion": None, "total": None},
+        "cached": False,
+        "coalesced": False
+    }
+
+    # Низкая температура - ответ можно взять из кеша целиком
+    cache_key = _build_cache_key(full_model_id, prompt, params)
+    if cache_key:
+        cached_response = await response_cache.aget(cache_key)
+        if cached_response:
+            logger.info(f"Возвращаем кешированный ответ для {full_model_id} (stream)")
+            yield {"event": "delta", "model_id": full_model_id, "text": cached_response.response}
+            done_event.update(
+                ttft=time.time() - start_time,
+                elapsed_time=time.time() - start_time,
+                token_count=cached_response.token_count or done_event["token_count"],
+                cached=True
+            )
+            yield done_event
+            return
+
+        # Такой же запрос уже выполняется без потока - дожидаемся его результата
+        flight = inflight_requests.get(cache_key)
+        if flight is not None:
+            inflight_requests.coalesced += 1
+            response = await asyncio.shield(flight)
+            if response.response:
+                yield {"event": "delta", "model_id": full_model_id, "text": response.response}
+            done_event.update(
+                ttft=time.time() - start_time,
+                elapsed_time=time.time() - start_time,
+                token_count=response.token_count or done_event["token_count"],
+                error=response.error,
+                coalesced=True
+            )
+            yield done_event
+            return
+
+    logger.info(f"Потоковый запрос к модели {full_model_id} (prompt: '{prompt[:30]}...')")
+    provider, model_name = None, None
+    meta: Dict[str, Any] = {}
+    # Полный текст накапливаем только если его нужно положить в кеш
+    chunks: Optional[List[str]] = [] if cache_key else None
+
+    try:
+        provider, model_name = _parse_model_id(full_model_id)
+        adapter = provider_registry.get(provider)
+        client_or_key = await _get_provider_client(db, provider)
+        if client_or_key is None:
+            raise ValueError(f"API ключ для провайдера '{provider}' не найден или клиент не инициализирован.")
+
+        # Слот в очереди провайдера удерживается на все время генерации
+        estimated_tokens = adapter.count_tokens(prompt, params)
+        attempt = 0
+        while True:
+            async with provider_scheduler.slot(provider, model_name, estimated_tokens) as slot:
+                try:
+                    async for delta in adapter.stream(client_or_key, model_name, prompt, params, meta):
+                        if done_event["ttft"] is None:
+                            done_event["ttft"] = time.time() - start_time
+                        if chunks is not None:
+                            chunks.append(delta)
+                        yield {"event": "delta", "model_id": full_model_id, "text": delta}
+                except Exception as e:
+                    # Повторить после 429 можно, только пока клиенту ничего не отправлено
+                    if done_event["ttft"] is None and is_rate_limited(e) and attempt < provider_scheduler.max_retries:
+                        provider_scheduler.on_rate_limited(provider, model_name, e)
+                        attempt += 1
+                        continue
+                    raise
+                slot.settle(meta)
+            break
+    except Exception as e:
+        done_event["error"] = _describe_inference_error(e, full_model_id, provider, model_name)
+
+    done_event["elapsed_time"] = time.time() - start_time
+    done_event["token_count"] = meta.get("token_count", done_event["token_count"])
+    metrics.record_inference(provider, model_name, "stream", done_event["elapsed_time"],
+                             done_event["error"] is not None, done_event["token_count"])
+    if done_event["ttft"] is not None:
+        metrics.inference_ttft.observe(done_event["ttft"], provider, model_name)
+
+    if cache_key and chunks is not None and not done_event["error"]:
+        response_cache.set(cache_key, InteractionResponse(
+            model_id=full_model_id,
+            response="".join(chunks),
+            elapsed_time=done_event["elapsed_time"],
+            token_count=done_event["token_count"]
+        ), model_id=full_model_id)
+
+    ttft_text = f"{done_event['ttft']:.2f}" if done_event["ttft"] is not None else "-"
+    logger.info(f"Поток от {full_model_id} завершен за {done_event['elapsed_time']:.2f} сек. "
+                f"(первый токен: {ttft_text} сек.) Ошибка: {done_event['error'] is not None}")
+    yield done_event
+
+
+def _split_comparison_request(request: ComparisonRequest) -> Tuple[InteractionRequest, InteractionRequest]:
+    """Разбивает запрос сравнения на два одиночных запроса с их системными промтами."""
+    common = dict(
         prompt=request.prompt,
         max_tokens=request.max_tokens,
         temperature=request.temperature,
@@ -1479,12 +2090,32 @@ async def run_comparison_inference(db: AsyncSession, request: ComparisonRequest)
         frequency_penalty=request.frequency_penalty,
         presence_penalty=request.presence_penalty,
         stop_sequences=request.stop_sequences,
-        system_prompt=request.system_prompt_2
     )
+    request1 = InteractionRequest(model_id=request.model_id_1, system_prompt=request.system_prompt_1, **common)
+    request2 = InteractionRequest(model_id=request.model_id_2, system_prompt=request.system_prompt_2, **common)
+    return request1, request2
+
+
+async def run_single_inference_isolated(request: InteractionRequest) -> InteractionResponse:
+    """
+    Выполняет run_single_inference в собственной сессии БД.
+    AsyncSession не поддерживает одновременные операции, поэтому параллельные
+    запросы к нескольким моделям не должны делить одну сессию.
+    """
+    async with database.AsyncSessionFactory() as db:
+        return await run_single_inference(db, request)
+
+
+async def run_comparison_inference(request: ComparisonRequest) -> ComparisonResponse:
+    """Выполняет запросы к двум моделям параллельно."""
+    logger.info(f"Запрос на сравнение моделей {request.model_id_1} и {request.model_id_2}")
+
+    # Создаем запросы для каждой модели с их системными промтами
+    request1, request2 = _split_comparison_request(request)
 
-    # Запускаем запросы параллельно
-    task1 = asyncio.create_task(run_single_inference(db, request1), name=f"infer_{request.model_id_1}")
-    task2 = asyncio.create_task(run_single_inference(db, request2), name=f"infer_{request.model_id_2}")
+    # Запускаем запросы параллельно, каждый со своей сессией БД
+    task1 = asyncio.create_task(run_single_inference_isolated(request1), name=f"infer_{request.model_id_1}")
+    task2 = asyncio.create_task(run_single_inference_isolated(request2), name=f"infer_{request.model_id_2}")
 
     # Ожидаем результаты
     # Мы не используем return_exceptions=True здесь, т.к. run_single_inference
@@ -1496,6 +2127,127 @@ async def run_comparison_inference(db: AsyncSession, request: ComparisonRequest)
         response_2=response2
     )
 
+
+def _split_multi_request(request: MultiModelRequest) -> List[InteractionRequest]:
+    """Разбивает запрос к нескольким моделям на одиночные запросы с учетом индивидуальных параметров."""
+    common = request.model_dump(exclude={"models", "deadline"})
+    return [
+        InteractionRequest(**{**common, **target.model_dump(exclude_none=True)})
+        for target in request.models
+    ]
+
+
+async def iter_multi_inference(request: MultiModelRequest) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Отправляет один промт нескольким моделям параллельно и отдает результаты в порядке завершения:
+    - {"event": "result", "index": i, "response": {...}} - ответ модели (index - позиция в request.models);
+    - {"event": "timeout", "index": i, "model_id": ...} - модель не успела до срока и была отменена;
+    - {"event": "done", "elapsed_time": ..., "completed": n, "timed_out": [...]} - завершение.
+    """
+    single_requests = _split_multi_request(request)
+    logger.info(f"Запрос к {len(single_requests)} моделям (срок: {request.deadline or 'не задан'} сек.)")
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    deadline = start_time + request.deadline if request.deadline else None
+
+    tasks: Dict[asyncio.Task, int] = {
+        asyncio.create_task(run_single_inference_isolated(single), name=f"infer_{single.model_id}"): index
+        for index, single in enumerate(single_requests)
+    }
+    pending = set(tasks)
+    completed = 0
+    try:
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break  # срок истек
+            for task in done:
+                index = tasks[task]
+                exc = task.exception()
+                if exc is None:
+                    response = task.result()
+                else:
+                    # run_single_inference сам обрабатывает ошибки провайдера; сюда попадают ошибки БД
+                    logger.exception(f"Ошибка запроса к {single_requests[index].model_id}: {exc}", exc_info=exc)
+                    response = InteractionResponse(model_id=single_requests[index].model_id, response="",
+                                                   error="Внутренняя ошибка сервера при обработке запроса.")
+                completed += 1
+                yield {"event": "result", "index": index, "response": response.model_dump()}
+    finally:
+        # Отменяем опоздавшие запросы (или все, если клиент отключился)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    timed_out = sorted(tasks[task] for task in pending)
+    for index in timed_out:
+        yield {"event": "timeout", "index": index, "model_id": single_requests[index].model_id}
+    if timed_out:
+        logger.info(f"Не успели до срока {len(timed_out)} моделей: {[single_requests[i].model_id for i in timed_out]}")
+    yield {
+        "event": "done",
+        "elapsed_time": loop.time() - start_time,
+        "completed": completed,
+        "timed_out": [single_requests[i].model_id for i in timed_out],
+    }
+
+
+async def run_multi_inference(request: MultiModelRequest) -> MultiModelResponse:
+    """Выполняет запрос к нескольким моделям и собирает ответы в порядке завершения."""
+    responses: List[InteractionResponse] = []
+    timed_out: List[str] = []
+    elapsed_time = 0.0
+    async for event in iter_multi_inference(request):
+        if event["event"] == "result":
+            responses.append(InteractionResponse(**event["response"]))
+        elif event["event"] == "timeout":
+            timed_out.append(event["model_id"])
+        elif event["event"] == "done":
+            elapsed_time = event["elapsed_time"]
+    return MultiModelResponse(responses=responses, timed_out=timed_out, elapsed_time=elapsed_time)
+
+
+async def stream_comparison_inference(request: ComparisonRequest) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Потоковое сравнение двух моделей: события обоих потоков чередуются по мере поступления.
+    Каждое событие помечено полем "slot" ('model_1' или 'model_2'). Каждый поток
+    работает со своей сессией БД.
+    """
+    logger.info(f"Потоковое сравнение моделей {request.model_id_1} и {request.model_id_2}")
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce(slot: str, single_request: InteractionRequest) -> None:
+        try:
+            async with database.AsyncSessionFactory() as db:
+                async for event in stream_single_inference(db, single_request):
+                    await queue.put({**event, "slot": slot})
+        except Exception as e:
+            # stream_single_inference сам обрабатывает ошибки провайдера; сюда попадают ошибки БД
+            logger.exception(f"Ошибка потока {slot} при сравнении: {e}", exc_info=e)
+            await queue.put({"event": "done", "slot": slot, "model_id": single_request.model_id,
+                             "error": "Внутренняя ошибка сервера при обработке запроса."})
+
+    request1, request2 = _split_comparison_request(request)
+    producers = [
+        asyncio.create_task(produce("model_1", request1), name=f"stream_{request.model_id_1}"),
+        asyncio.create_task(produce("model_2", request2), name=f"stream_{request.model_id_2}"),
+    ]
+    try:
+        remaining = len(producers)
+        while remaining:
+            event = await queue.get()
+            if event["event"] == "done":
+                remaining -= 1
+            yield event
+    finally:
+        # Клиент отключился или поток завершен - останавливаем незавершенные запросы
+        for task in producers:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+
 # --- Вспомогательные функции для диагностики сети ---
 
 def get_ip_addresses() -> Dict[str, Any]:
@@ -1555,54 +2307,3 @@ def get_ip_addresses() -> Dict[str, Any]:
         pass
     
     return ip_info
-
-# --- Утилиты для работы с кешем ---
-
-class ResponseCache:
-    """Простой кеш для хранения ответов моделей."""
-    
-    def __init__(self, ttl: int = 3600):
-        self.cache = {}  # key -> (value, timestamp)
-        self.ttl = ttl
-    
-    def get(self, key: str) -> Optional[Any]:
-        """Получает значение из кеша, если оно не истекло."""
-        if key in self.cache:
-            value, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                return value
-            else:
-                # Удаляем истекшее значение
-                del self.cache[key]
-        return None
-    
-    def set(self, key: str, value: Any) -> None:
-        """Сохраняет значение в кеш."""
-        self.cache[key] = (value, time.time())
-    
-    def clear(self, prefix: Optional[str] = None) -> None:
-        """Очищает весь кеш или только элементы с определенным префиксом."""
-        if prefix is None:
-            self.cache.clear()
-        else:
-            keys_to_delete = [k for k in self.cache.keys() if k.startswith(prefix)]
-            for k in keys_to_delete:
-                del self.cache[k]
-
-# Инициализация глобального кеша
-response_cache = ResponseCache(ttl=settings.response_cache_ttl)
-_CACHE_TTL = settings.models_cache_ttl  # TTL для кеша моделей
-
-# --- Утилиты для парсинга и доступа к провайдерам ---
-
-def _parse_model_id(full_model_id: str) -> Tuple[str, str]:
-    """Разбирает полный ID модели (e.g., 'openai/gpt-4o') на провайдера и имя."""
-    if '/' not in full_model_id:
-        # По умолчанию считаем Hugging Face, если нет префикса
-        # Или можно выбросить ошибку, если формат неверный
-        logger.warning(f"Неверный формат model_id '{full_model_id}'. Предполагается Hugging Face.")
-        return "huggingface_hub", full_model_id
-    provider, model_name = full_model_id.split('/', 1)
-    if provider not in SUPPORTED_PROVIDERS:
-        raise ValueError(f"Неподдерживаемый провайдер '{provider}' в ID модели '{full_model_id}'")
-    return provider, model_name
\ No newline at end of file
@@ -0,0 +1,236 @@
+# backend/providers.py
+
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend import tracing
+from backend.config import ModelInfo
+from backend.sdk_loader import sdk_loader
+
+logger = logging.getLogger(__name__)
+
+# Категории ошибок провайдеров; по ним models_io выбирает сообщение для пользователя
+ERROR_AUTH = "auth"
+ERROR_NOT_FOUND = "not_found"
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_TIMEOUT = "timeout"
+ERROR_NETWORK = "network"
+ERROR_API = "api"
+
+# Порядок проверки категорий: от частных классов исключений к общим (OpenAIError и т.п.)
+_ERROR_CATEGORY_ORDER = (ERROR_AUTH, ERROR_NOT_FOUND, ERROR_RATE_LIMIT, ERROR_TIMEOUT, ERROR_NETWORK, ERROR_API)
+
+
+def estimate_tokens(prompt: str, params: Dict[str, Any]) -> int:
+    """Грубая оценка расхода токенов для бюджета планировщика (~4 символа на токен + лимит ответа)."""
+    prompt_chars = len(prompt) + len(params.get("system_prompt") or "")
+    return prompt_chars // 4 + (params.get("max_tokens") or 0)
+
+
+class ProviderAdapter:
+    """
+    Адаптер провайдера: все, что pipeline запросов знает о конкретном API.
+
+    - create_client(api_key) - долгоживущий клиент (или ключ, если клиента нет);
+    - list_models(client) - список моделей;
+    - infer(client, model_name, prompt, params) -> (текст, meta);
+    - stream(client, model_name, prompt, params, meta) - асинхронный итератор дельт;
+    - count_tokens(prompt, params) - оценка токенов для планировщика;
+    - classify_error(e) - категория ошибки (ERROR_*) или None.
+
+    Классы исключений берутся из SDK, загруженного sdk_loader, по именам из `errors`,
+    поэтому адаптер можно создать до загрузки SDK.
+    """
+
+    def __init__(self, name: str,
+                 create_client: Callable[[str], Any],
+                 list_models: Callable[[Any], Awaitable[List[ModelInfo]]],
+                 infer: Callable[[Any, str, str, Dict], Awaitable[Tuple[str, Dict]]],
+                 stream: Callable[[Any, str, str, Dict, Dict], AsyncIterator[str]],
+                 sdk: Optional[str] = None,
+                 errors: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 settings_key: Optional[str] = None,
+                 requires_key: bool = True):
+        self.name = name
+        self._create_client = create_client
+        self._list_models = list_models
+        self._infer = infer
+        self._stream = stream
+        # SDK, который нужно загрузить перед созданием клиента (у OpenAI-совместимых - openai)
+        self.sdk = sdk
+        self.errors = errors or {}
+        # Поле Settings с ключом по умолчанию, если ключ не сохранен в БД
+        self.settings_key = settings_key
+        self.requires_key = requires_key
+
+    def create_client(self, api_key: Optional[str]) -> Any:
+        return self._create_client(api_key)
+
+    async def list_models(self, client: Any) -> List[ModelInfo]:
+        return await self._list_models(client)
+
+    async def infer(self, client: Any, model_name: str, prompt: str, params: Dict) -> Tuple[str, Dict]:
+        with tracing.span("provider.infer", provider=self.name, model=model_name):
+            return await self._infer(client, model_name, prompt, params)
+
+    async def stream(self, client: Any, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+        # Спан не становится текущим: между дельтами управление у вызывающего кода
+        span = tracing.span("provider.stream", provider=self.name, model=model_name)
+        try:
+            async for delta in self._stream(client, model_name, prompt, params, meta):
+                yield delta
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end()
+
+    def count_tokens(self, prompt: str, params: Dict[str, Any]) -> int:
+        return estimate_tokens(prompt, params)
+
+    def classify_error(self, e: Exception) -> Optional[str]:
+        if not self.errors or not self.sdk or not sdk_loader.is_loaded(self.sdk):
+            # Пока SDK не загружен, его исключения возникнуть не могли
+            return None
+        names = sdk_loader.names(self.sdk)
+        for category in _ERROR_CATEGORY_ORDER:
+            error_types = tuple(names[name] for name in self.errors.get(category, ()) if name in names)
+            if error_types and isinstance(e, error_types):
+                return category
+        return None
+
+
+class ProviderRegistry:
+    """Реестр адаптеров провайдеров: поиск по имени провайдера за O(1)."""
+
+    def __init__(self):
+        self._adapters: Dict[str, ProviderAdapter] = {}
+
+    def register(self, adapter: ProviderAdapter) -> None:
+        if adapter.name in self._adapters:
+            logger.warning(f"Адаптер провайдера {adapter.name} зарегистрирован повторно и будет заменен")
+        self._adapters[adapter.name] = adapter
+
+    def get(self, provider: str) -> Optional[ProviderAdapter]:
+        return self._adapters.get(provider)
+
+    def __contains__(self, provider: str) -> bool:
+        return provider in self._adapters
+
+    def names(self) -> List[str]:
+        return list(self._adapters)
+
+    def keyless(self) -> List[str]:
+        """Провайдеры, которым не нужен API ключ (например, mock)."""
+        return [name for name, adapter in self._adapters.items() if not adapter.requires_key]
+
+
+provider_registry = ProviderRegistry()
+
+
+# --- Mock провайдер для нагрузочных тестов ---
+
+class MockProviderError(Exception):
+    """Ошибка mock-провайдера; status_code позволяет планировщику распознать 429."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_MOCK_WORDS = (
+    "arena", "prompt", "model", "token", "answer", "context", "latency", "vector",
+    "signal", "stream", "cache", "queue", "rating", "sample", "output", "input",
+)
+
+# Имя модели -> описание; поведение модели определяется ее именем
+MOCK_MODELS: Dict[str, str] = {
+    "echo": "Возвращает промт без изменений",
+    "lorem": "Детерминированный текст длиной max_tokens слов",
+    "flaky": "Каждый 5-й промт (по хешу) завершается ошибкой 429",
+    "error": "Всегда завершается ошибкой сервиса",
+}
+
+
+class MockProvider(ProviderAdapter):
+    """
+    Детерминированный провайдер внутри процесса: без сети и ключей, но через
+    тот же pipeline (планировщик, кеш, объединение запросов, учет токенов).
+    Ответ зависит только от модели и промта; задержка задается настройками.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, token_latency_ms: float = 0.0):
+        super().__init__(
+            "mock",
+            create_client=lambda api_key: self,
+            list_models=self._mock_list_models,
+            infer=self._mock_infer,
+            stream=self._mock_stream,
+            requires_key=False,
+        )
+        self.latency = latency_ms / 1000.0
+        self.token_latency = token_latency_ms / 1000.0
+
+    @staticmethod
+    def _digest(model_name: str, prompt: str) -> int:
+        return int.from_bytes(hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).digest()[:8], "big")
+
+    def _generate(self, model_name: str, prompt: str, params: Dict) -> List[str]:
+        """Слова ответа (без задержек)."""
+        digest = self._digest(model_name, prompt)
+        if model_name == "error":
+            raise MockProviderError("Mock: внутренняя ошибка сервиса", status_code=500)
+        if model_name == "flaky" and digest % 5 == 0:
+            raise MockProviderError("Mock: превышен лимит запросов", status_code=429)
+        if model_name == "echo":
+            return prompt.split()
+        if model_name not in MOCK_MODELS:
+            raise MockProviderError(f"Mock: модель '{model_name}' не найдена", status_code=404)
+        length = params.get("max_tokens") or 64
+        return [_MOCK_WORDS[(digest >> (i % 60)) % len(_MOCK_WORDS)] for i in range(length)]
+
+    @staticmethod
+    def _token_count(prompt: str, params: Dict, words: List[str]) -> Dict[str, int]:
+        prompt_tokens = len(prompt.split()) + len((params.get("system_prompt") or "").split())
+        return {"prompt": prompt_tokens, "completion": len(words), "total": prompt_tokens + len(words)}
+
+    async def _mock_list_models(self, client: Any) -> List[ModelInfo]:
+        return [
+            ModelInfo(
+                id=f"mock/{model_name}",
+                name=f"Mock {model_name}",
+                provider="mock",
+                category="text_generation",
+                supports_system_prompt=True,
+            )
+            for model_name in MOCK_MODELS
+        ]
+
+    async def _mock_infer(self, client: Any, model_name: str, prompt: str, params: Dict) -> Tuple[str, Dict]:
+        start_time = time.time()
+        words = self._generate(model_name, prompt, params)
+        await asyncio.sleep(self.latency + self.token_latency * len(words))
+        return " ".join(words), {
+            "elapsed_time": time.time() - start_time,
+            "token_count": self._token_count(prompt, params, words),
+        }
+
+    async def _mock_stream(self, client: Any, model_name: str, prompt: str, params: Dict, meta: Dict) -> AsyncIterator[str]:
+        words = self._generate(model_name, prompt, params)
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(words):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield word if i == 0 else f" {word}"
+        meta["token_count"] = self._token_count(prompt, params, words)
+
+    def count_tokens(self, prompt: str, params: Dict[str, Any]) -> int:
+        return len(prompt.split()) + (params.get("max_tokens") or 0)
+
+    def classify_error(self, e: Exception) -> Optional[str]:
+        if not isinstance(e, MockProviderError):
+            return None
+        return {429: ERROR_RATE_LIMIT, 404: ERROR_NOT_FOUND}.get(e.status_code, ERROR_API)
@@ -0,0 +1,156 @@
+# backend/rate_limit.py
+
+import fnmatch
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from backend.shared_state import SharedState
+
+
+class RateLimitRule(NamedTuple):
+    """Правило ограничения: name - имя группы ключей, pattern - шаблон пути (fnmatch) или None."""
+    name: str
+    limit: int
+    window: float
+    pattern: Optional[str] = None
+    methods: Tuple[str, ...] = ()
+    # True - один счетчик на все пути правила, False - отдельный счетчик на каждый путь
+    shared: bool = True
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    # Через сколько секунд лимит восстановится полностью
+    reset_after: float
+    # Через сколько секунд можно повторить отклоненный запрос
+    retry_after: float
+
+
+class GcraLimiter:
+    """
+    Ограничитель частоты по алгоритму GCRA (эквивалент token bucket).
+
+    Для каждого ключа хранится одно число - теоретическое время следующего
+    запроса (TAT), поэтому проверка выполняется за O(1) по времени и памяти.
+    Ключи хранятся в порядке последнего обращения; при превышении max_keys
+    вытесняются давно неактивные. Ключ с TAT в прошлом эквивалентен полному
+    лимиту, поэтому его удаление не меняет поведения.
+    """
+
+    # Сколько самых старых ключей проверяется на истечение при каждом запросе
+    _SWEEP_PER_CALL = 2
+
+    def __init__(self, max_keys: int = 100_000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        """Учитывает запрос по ключу: limit запросов за window секунд (с допуском всплеска до limit)."""
+        now = self._clock()
+        interval = window / limit
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + interval
+        allow_at = new_tat - window
+
+        if now < allow_at:
+            self._touch(key, tat, now)
+            return RateLimitResult(False, limit, 0, tat - now, allow_at - now)
+
+        self._touch(key, new_tat, now)
+        remaining = min(limit, int(math.floor((window - (new_tat - now)) / interval + 1e-9)))
+        return RateLimitResult(True, limit, remaining, new_tat - now, 0.0)
+
+    def _touch(self, key: str, tat: float, now: float) -> None:
+        self._tat[key] = tat
+        self._tat.move_to_end(key)
+        # Ключи с истекшим TAT больше ничего не ограничивают
+        for _ in range(self._SWEEP_PER_CALL):
+            oldest_key, oldest_tat = next(iter(self._tat.items()))
+            if oldest_tat > now or oldest_key == key:
+                break
+            del self._tat[oldest_key]
+        while len(self._tat) > self.max_keys:
+            self._tat.popitem(last=False)
+
+
+class SharedWindowLimiter:
+    """
+    Ограничитель частоты поверх общего хранилища (несколько воркеров или узлов).
+
+    Хранилище умеет только атомарно увеличивать счетчик с временем жизни, поэтому
+    вместо GCRA используется скользящее окно, приближенное двумя фиксированными:
+    оценка = счетчик прошлого окна * (непрошедшая доля текущего) + счетчик текущего.
+    На запрос - одна пачка из двух операций (один round trip). Отклоненные
+    запросы тоже учитываются.
+    """
+
+    def __init__(self, state: SharedState, prefix: str = "rl", clock=time.time):
+        self.state = state
+        self.prefix = prefix
+        self._clock = clock
+
+    async def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        now = self._clock()
+        index = int(now // window)
+        elapsed = now / window - index  # прошедшая доля текущего окна
+        (current, _), (previous, _) = await self.state.batch([
+            ("incr", f"{self.prefix}:{key}:{index}", 1, window * 2),
+            ("get", f"{self.prefix}:{key}:{index - 1}", 0, 0),
+        ])
+        estimate = previous * (1.0 - elapsed) + current
+        until_window_end = window * (1.0 - elapsed)
+        if estimate <= limit:
+            reset_after = until_window_end if previous == 0 else window
+            return RateLimitResult(True, limit, int(limit - estimate), reset_after, 0.0)
+
+        if current >= limit or previous == 0:
+            retry_after = until_window_end
+        else:
+            # Момент, когда вклад прошлого окна уменьшится достаточно
+            retry_after = ((1.0 - (limit - current) / previous) - elapsed) * window
+        return RateLimitResult(False, limit, 0, until_window_end, max(retry_after, 0.0))
+
+
+class RuleMatcher:
+    """
+    Выбирает правило для запроса: сначала правила с шаблоном пути (в порядке
+    объявления), затем правила по методу, затем правило по умолчанию.
+    Результат для пары (метод, путь) кешируется с ограничением размера.
+    """
+
+    def __init__(self, rules: List[RateLimitRule], default: RateLimitRule, cache_size: int = 4096):
+        self._path_rules: List[Tuple[Pattern, RateLimitRule]] = [
+            (re.compile(fnmatch.translate(rule.pattern)), rule) for rule in rules if rule.pattern
+        ]
+        self._method_rules: Dict[str, RateLimitRule] = {
+            method: rule for rule in rules if not rule.pattern for method in rule.methods
+        }
+        self._default = default
+        self._cache: "OrderedDict[Tuple[str, str], RateLimitRule]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def match(self, method: str, path: str) -> RateLimitRule:
+        cache_key = (method, path)
+        rule = self._cache.get(cache_key)
+        if rule is not None:
+            return rule
+        rule = self._find(method, path)
+        self._cache[cache_key] = rule
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return rule
+
+    def _find(self, method: str, path: str) -> RateLimitRule:
+        for pattern, rule in self._path_rules:
+            if (not rule.methods or method in rule.methods) and pattern.match(path):
+                return rule
+        return self._method_rules.get(method, self._default)
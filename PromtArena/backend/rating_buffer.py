@@ -0,0 +1,339 @@
+# backend/rating_buffer.py
+
+import asyncio
+import datetime
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend import database
+from backend.config import settings, RatingCreate, RatingReceipt
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной записью после ошибки БД
+_RETRY_DELAY = 1.0
+
+
+def _process_journal_path(base_path: str, pid: int) -> str:
+    """Журнал процесса: ./data/ratings_journal.jsonl -> ./data/ratings_journal.<pid>.jsonl"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.{pid}{ext}"
+
+
+def _try_lock(f) -> bool:
+    """Неблокирующая исключительная блокировка открытого файла; ОС снимает ее при завершении процесса."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class RatingWriteBuffer:
+    """
+    Буфер отложенной записи оценок: вместо INSERT и commit на каждый голос оценки
+    накапливаются и записываются одной транзакцией (executemany) каждые flush_interval
+    секунд или сразу при накоплении max_rows.
+
+    Каждая принятая оценка до ответа клиенту дописывается строкой в журнал (JSONL).
+    Журнал переживает падение процесса: при запуске незаписанные строки повторно
+    отправляются в БД. Номер последней записанной строки сохраняется в той же транзакции,
+    что и пачка оценок, поэтому повторное чтение журнала не создает дубликатов.
+    После успешной записи журнал переписывается и содержит только ожидающие оценки.
+
+    Каждый процесс (воркер uvicorn) ведет свой журнал с PID в имени и держит блокировку
+    его файла .lock, пока работает. При запуске процесс досылает журналы, блокировку
+    которых удается взять (их процессы завершились), и удаляет их.
+    """
+
+    def __init__(self, journal_path: str, flush_interval: float = 0.2, max_rows: int = 500):
+        # Базовый путь; журнал процесса и ключ контрольной точки в БД определяются при запуске
+        self.base_path = journal_path
+        self.journal_path = journal_path
+        self.journal_name = os.path.basename(journal_path)
+        self._lock_file = None
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._pending: List[Tuple[int, Dict[str, Any], str]] = []  # (seq, строка для БД, строка журнала)
+        self._seq = 0
+        self._journal = None
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # --- Журнал ---
+
+    @staticmethod
+    def _encode(seq: int, row: Dict[str, Any]) -> str:
+        return json.dumps({"seq": seq, **row, "timestamp": row["timestamp"].isoformat()}, ensure_ascii=False) + "\n"
+
+    @staticmethod
+    def _read_journal(path: str) -> List[Tuple[int, Dict[str, Any], str]]:
+        entries = []
+        if not os.path.exists(path):
+            return entries
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная последняя строка (падение во время записи): оценка не была подтверждена
+                    logger.warning(f"Пропущена поврежденная строка журнала оценок {path}")
+                    continue
+                seq = data.pop("seq")
+                data.pop("receipt_id", None)
+                data["timestamp"] = datetime.datetime.fromisoformat(data["timestamp"])
+                entries.append((seq, data, line if line.endswith("\n") else line + "\n"))
+        return entries
+
+    def _rewrite_journal(self) -> None:
+        """Оставляет в журнале только ожидающие записи (атомарная замена файла)."""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(line for _, _, line in self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _other_journals(self) -> List[str]:
+        """Журналы других процессов, а также общий журнал версий без журналов по процессам."""
+        root, ext = os.path.splitext(self.base_path)
+        paths = [
+            path for path in glob.glob(f"{glob.escape(root)}.*{ext}")
+            if path[len(root) + 1:len(path) - len(ext)].isdigit()
+        ]
+        if os.path.exists(self.base_path):
+            paths.append(self.base_path)
+        return [path for path in paths if os.path.abspath(path) != os.path.abspath(self.journal_path)]
+
+    async def _recover_journal(self, path: str) -> int:
+        """
+        Досылает в БД оценки из журнала завершившегося процесса и удаляет журнал.
+        Журнал живого процесса (блокировка занята) пропускается. Возвращает число оценок.
+        """
+        lock_path = f"{path}.lock"
+        lock_file = open(lock_path, "a")
+        if not _try_lock(lock_file):
+            lock_file.close()
+            return 0
+        try:
+            if not os.path.exists(path):
+                # Журнал уже дослал другой процесс
+                return 0
+            name = os.path.basename(path)
+            entries = await asyncio.to_thread(self._read_journal, path)
+            async with database.AsyncSessionFactory() as db:
+                checkpoint = await database.get_rating_journal_checkpoint(db, name)
+                pending = [entry for entry in entries if entry[0] > checkpoint]
+                if pending:
+                    await database.create_ratings_bulk(
+                        db, [row for _, row, _ in pending], journal=name, last_seq=pending[-1][0]
+                    )
+                    await db.commit()
+            os.remove(path)
+            # Контрольная точка удаляется только после журнала, иначе строки могли бы записаться повторно
+            async with database.AsyncSessionFactory() as db:
+                await database.delete_rating_journal_checkpoint(db, name)
+                await db.commit()
+            return len(pending)
+        finally:
+            lock_file.close()
+            _remove_file(lock_path)
+
+    # --- Прием оценок ---
+
+    def submit(self, rating_data: RatingCreate, prompt_hash: str) -> RatingReceipt:
+        """
+        Принимает оценку в буфер и возвращает квитанцию. Строка журнала сбрасывается
+        в ОС до возврата, поэтому оценка не теряется при падении процесса.
+        """
+        receipt_id = str(uuid.uuid4())
+        timestamp = datetime.datetime.utcnow()
+        row = {
+            "model_id": rating_data.model_id,
+            "prompt_hash": prompt_hash,
+            "prompt_excerpt": rating_data.prompt_text[:100] if rating_data.prompt_text else "",
+            "rating": rating_data.rating,
+            "comparison_winner": rating_data.comparison_winner,
+            "user_identifier": rating_data.user_identifier,
+            "system_prompt": rating_data.system_prompt,
+            "temperature": rating_data.temperature,
+            "max_tokens": rating_data.max_tokens,
+            "timestamp": timestamp,
+        }
+        self._seq += 1
+        line = self._encode(self._seq, {**row, "receipt_id": receipt_id})
+        self._journal.write(line)
+        self._journal.flush()
+        self._pending.append((self._seq, row, line))
+
+        self._wakeup.set()
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return RatingReceipt(receipt_id=receipt_id, model_id=row["model_id"], rating=row["rating"], timestamp=timestamp)
+
+    # --- Запись в БД ---
+
+    async def flush(self) -> bool:
+        """Записывает все накопленные оценки одной транзакцией. Возвращает False при ошибке БД."""
+        async with self._flush_lock:
+            batch = list(self._pending)
+            if not batch:
+                return True
+            started = time.perf_counter()
+            try:
+                async with database.AsyncSessionFactory() as db:
+                    await database.create_ratings_bulk(
+                        db, [row for _, row, _ in batch], journal=self.journal_name, last_seq=batch[-1][0]
+                    )
+                    await db.commit()
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error(f"Не удалось записать пачку из {len(batch)} оценок, повтор позже: {e}")
+                return False
+
+            # Пока шла запись, в конец буфера могли добавиться новые оценки
+            del self._pending[:len(batch)]
+            try:
+                self._rewrite_journal()
+            except OSError as e:
+                # Записанные строки останутся в журнале; контрольная точка не даст вставить их повторно
+                logger.warning(f"Не удалось сжать журнал оценок {self.journal_path}: {e}")
+            self.flushed_rows += len(batch)
+            self.flush_count += 1
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            logger.debug(f"Записана пачка из {len(batch)} оценок за {self.last_flush_ms:.1f} мс")
+            return True
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Ждем накопления пачки, но не дольше flush_interval
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._full.clear()
+            if not await self.flush():
+                await asyncio.sleep(_RETRY_DELAY)
+            if self._pending:
+                self._wakeup.set()
+
+    # --- Жизненный цикл ---
+
+    async def start(self) -> None:
+        """Восстанавливает незаписанные оценки из журнала и запускает фоновую запись."""
+        if self._task is not None:
+            return
+        self.journal_path = _process_journal_path(self.base_path, os.getpid())
+        self.journal_name = os.path.basename(self.journal_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        # Блокировка берется до создания журнала: другие процессы не примут его за брошенный
+        self._lock_file = open(f"{self.journal_path}.lock", "a")
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(f"Журнал оценок {self.journal_path} занят другим процессом")
+
+        # Журнал с тем же PID остался от завершившегося процесса (PID после перезапуска совпал)
+        entries = await asyncio.to_thread(self._read_journal, self.journal_path)
+        async with database.AsyncSessionFactory() as db:
+            checkpoint = await database.get_rating_journal_checkpoint(db, self.journal_name)
+        self._pending = [entry for entry in entries if entry[0] > checkpoint]
+        self._seq = max([checkpoint] + [seq for seq, _, _ in entries])
+        self._rewrite_journal()
+        if self._pending:
+            logger.warning(f"Из журнала {self.journal_path} восстановлено {len(self._pending)} незаписанных оценок")
+            self._wakeup.set()
+
+        for path in self._other_journals():
+            try:
+                recovered = await self._recover_journal(path)
+            except Exception as e:
+                logger.error(f"Не удалось дослать оценки из журнала {path}, повтор при следующем запуске: {e}")
+                continue
+            if recovered:
+                logger.warning(f"Из журнала {path} досланы в БД {recovered} незаписанных оценок")
+        self._task = asyncio.create_task(self._flush_loop(), name="rating_write_buffer")
+        logger.info(f"Буфер записи оценок: сброс каждые {self.flush_interval * 1000:.0f} мс или {self.max_rows} оценок")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и сбрасывает оставшиеся оценки в БД."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        flushed = await self.flush()
+        if not flushed:
+            logger.warning(f"{len(self._pending)} оценок не записаны в БД и будут восстановлены из журнала при запуске")
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if flushed and not self._pending:
+            # Все оценки в БД: пустой журнал и его контрольная точка больше не нужны
+            try:
+                _remove_file(self.journal_path)
+                async with database.AsyncSessionFactory() as db:
+                    await database.delete_rating_journal_checkpoint(db, self.journal_name)
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить записанный журнал оценок {self.journal_path}: {e}")
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            _remove_file(f"{self.journal_path}.lock")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.running,
+            "pending": len(self._pending),
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flush_count,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+rating_buffer = RatingWriteBuffer(
+    settings.rating_buffer_journal_path,
+    flush_interval=settings.rating_buffer_flush_ms / 1000.0,
+    max_rows=settings.rating_buffer_max_rows,
+)
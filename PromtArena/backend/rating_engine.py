@@ -0,0 +1,203 @@
+# backend/rating_engine.py
+
+import asyncio
+import importlib.util
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# numpy импортируется при первом пересчете, чтобы не замедлять запуск приложения
+np = None # type: ignore
+
+from backend import database
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Очки первой модели пары в зависимости от результата сравнения
+WINNER_SCORES = {"model_1": 1.0, "model_2": 0.0, "tie": 0.5}
+
+# Метод, под которым сохраняются снимки пакетного пересчета
+BRADLEY_TERRY = "bradley_terry"
+
+# Псевдонаблюдения (по одной победе и поражению против "средней" модели):
+# не дают силе непобежденной или ни разу не выигравшей модели уйти в бесконечность
+_BT_PRIOR = 1.0
+_BT_MAX_ITERATIONS = 1000
+_BT_TOLERANCE = 1e-6
+
+
+# --- Эло: инкрементальное обновление за O(1) ---
+
+def expected_score(rating_a: float, rating_b: float) -> float:
+    """Ожидаемый результат модели A против модели B по формуле Эло."""
+    return 1.0 / (1.0 + 10 ** ((rating_b - rating_a) / 400.0))
+
+def elo_update(rating_a: float, rating_b: float, score_a: float, k: float) -> Tuple[float, float]:
+    """Возвращает новые рейтинги пары после одного сравнения (score_a: 1 - победа A, 0.5 - ничья)."""
+    delta = k * (score_a - expected_score(rating_a, rating_b))
+    return rating_a + delta, rating_b - delta
+
+
+# --- Брэдли-Терри: пакетный пересчет по всем сравнениям ---
+
+def numpy_available() -> bool:
+    """Установлен ли numpy (без импорта)."""
+    return np is not None or importlib.util.find_spec("numpy") is not None
+
+def _load_numpy() -> bool:
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def _group_sum(values: "np.ndarray", index: "np.ndarray", size: int) -> "np.ndarray":
+    """Построчная сумма values (B x K) по группам index (K,) -> массив B x size."""
+    rows = values.shape[0]
+    flat_index = (index[None, :] + size * np.arange(rows)[:, None]).ravel()
+    return np.bincount(flat_index, weights=values.ravel(), minlength=rows * size).reshape(rows, size)
+
+def _fit_strengths(counts: "np.ndarray", pair_lo: "np.ndarray", pair_hi: "np.ndarray",
+                   category_pair: "np.ndarray", category_score: "np.ndarray",
+                   model_count: int, start: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    MM-алгоритм (Hunter, 2004) сразу для нескольких выборок.
+    counts - число исходов каждой категории (пара, результат) в каждой выборке, B x K.
+    Возвращает силы моделей B x M, нормированные к среднему геометрическому 1.
+    """
+    pair_count = pair_lo.shape[0]
+    games = _group_sum(counts, category_pair, pair_count)  # B x P
+    # Ничья засчитывается как половина победы каждой модели
+    wins = (
+        _group_sum(counts * category_score, pair_lo[category_pair], model_count)
+        + _group_sum(counts * (1.0 - category_score), pair_hi[category_pair], model_count)
+    )
+    strengths = np.ones((counts.shape[0], model_count)) if start is None else np.array(start, dtype=float)
+    for _ in range(_BT_MAX_ITERATIONS):
+        ratio = games / (strengths[:, pair_lo] + strengths[:, pair_hi])
+        denominator = _group_sum(ratio, pair_lo, model_count) + _group_sum(ratio, pair_hi, model_count)
+        updated = (wins + _BT_PRIOR) / (denominator + 2 * _BT_PRIOR / (strengths + 1.0))
+        updated /= np.exp(np.log(updated).mean(axis=1, keepdims=True))
+        converged = np.max(np.abs(np.log(updated) - np.log(strengths))) < _BT_TOLERANCE
+        strengths = updated
+        if converged:
+            break
+    return strengths
+
+def fit_bradley_terry(outcomes: Sequence[Tuple[str, str, str]], bootstrap_rounds: int = 0,
+                      base_rating: float = 1500.0, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Оценивает силы моделей по модели Брэдли-Терри по всем сравнениям (model_a, model_b, winner).
+    Результат переводится в шкалу Эло: base_rating + 400 * log10(сила).
+    Доверительные интервалы (95%) считаются бутстрэпом по голосам: все выборки
+    обрабатываются одним векторизованным проходом.
+    """
+    if not _load_numpy():
+        raise RuntimeError("Для расчета рейтинга Брэдли-Терри требуется библиотека numpy")
+    if not outcomes:
+        return []
+
+    model_ids = sorted({model for a, b, _ in outcomes for model in (a, b)})
+    model_index = {model_id: i for i, model_id in enumerate(model_ids)}
+    first = np.array([model_index[a] for a, _, _ in outcomes])
+    second = np.array([model_index[b] for _, b, _ in outcomes])
+    score = np.array([WINNER_SCORES[winner] for _, _, winner in outcomes])
+
+    # Приводим пары к виду (меньший индекс, больший индекс) и сворачиваем голоса
+    # в категории (пара, результат): бутстрэп по голосам = мультиномиальная выборка по категориям
+    swap = first > second
+    lo = np.where(swap, second, first)
+    hi = np.where(swap, first, second)
+    score = np.where(swap, 1.0 - score, score)
+    model_count = len(model_ids)
+    category_keys, category_counts = np.unique(
+        (lo * model_count + hi) * 3 + (score * 2).astype(int), return_counts=True
+    )
+    pair_keys, category_pair = np.unique(category_keys // 3, return_inverse=True)
+    category_score = (category_keys % 3) / 2.0
+    pair_lo, pair_hi = pair_keys // model_count, pair_keys % model_count
+
+    strengths = _fit_strengths(
+        category_counts[None, :].astype(float), pair_lo, pair_hi, category_pair, category_score, model_count
+    )[0]
+    scores = base_rating + 400.0 * np.log10(strengths)
+    games = np.bincount(lo, minlength=model_count) + np.bincount(hi, minlength=model_count)
+
+    ci_lower = ci_upper = None
+    if bootstrap_rounds > 0:
+        rng = np.random.default_rng(seed)
+        total = int(category_counts.sum())
+        samples = rng.multinomial(total, category_counts / total, size=bootstrap_rounds).astype(float)
+        sample_strengths = _fit_strengths(
+            samples, pair_lo, pair_hi, category_pair, category_score, model_count,
+            start=np.repeat(strengths[None, :], bootstrap_rounds, axis=0)
+        )
+        sample_scores = base_rating + 400.0 * np.log10(sample_strengths)
+        ci_lower, ci_upper = np.percentile(sample_scores, [2.5, 97.5], axis=0)
+
+    return [
+        {
+            "model_id": model_id,
+            "score": round(float(scores[i]), 2),
+            "ci_lower": round(float(ci_lower[i]), 2) if ci_lower is not None else None,
+            "ci_upper": round(float(ci_upper[i]), 2) if ci_upper is not None else None,
+            "games": int(games[i]),
+        }
+        for i, model_id in enumerate(model_ids)
+    ]
+
+async def refit_bradley_terry(db, bootstrap_rounds: Optional[int] = None) -> Optional[str]:
+    """
+    Пересчитывает рейтинг Брэдли-Терри по всем сравнениям и сохраняет снимок.
+    Расчет выполняется в отдельном потоке. Возвращает ID снимка или None, если сравнений нет.
+    """
+    rounds = settings.rating_bootstrap_rounds if bootstrap_rounds is None else bootstrap_rounds
+    outcomes = await database.get_all_comparison_outcomes(db)
+    if not outcomes:
+        return None
+
+    started = asyncio.get_running_loop().time()
+    rows = await asyncio.to_thread(fit_bradley_terry, outcomes, rounds, settings.elo_initial_rating)
+    snapshot_id = str(uuid.uuid4())
+    await database.save_rating_snapshot(db, snapshot_id, BRADLEY_TERRY, rows)
+    elapsed = asyncio.get_running_loop().time() - started
+    logger.info(f"Рейтинг Брэдли-Терри пересчитан: {len(outcomes)} сравнений, {len(rows)} моделей, {elapsed:.2f} сек.")
+    return snapshot_id
+
+
+# --- Периодический пересчет ---
+
+_refit_task: Optional[asyncio.Task] = None
+
+async def _refit_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with database.AsyncSessionFactory() as db:
+                await refit_bradley_terry(db)
+        except Exception as e:
+            logger.error(f"Ошибка пересчета рейтинга Брэдли-Терри: {e}")
+
+def start_refit_task(interval: float) -> None:
+    """Запускает периодический пересчет рейтинга Брэдли-Терри (interval=0 - только вручную)."""
+    global _refit_task
+    if not numpy_available():
+        logger.warning("Библиотека 'numpy' не установлена. Рейтинг Брэдли-Терри будет недоступен.")
+        return
+    if _refit_task is None and interval > 0:
+        _refit_task = asyncio.create_task(_refit_loop(interval), name="bradley_terry_refit")
+
+async def stop_refit_task() -> None:
+    """Останавливает периодический пересчет."""
+    global _refit_task
+    if _refit_task is not None:
+        _refit_task.cancel()
+        try:
+            await _refit_task
+        except asyncio.CancelledError:
+            pass
+        _refit_task = None
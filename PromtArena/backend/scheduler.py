@@ -0,0 +1,334 @@
+# backend/scheduler.py
+
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Заголовки, из которых берется информация о лимитах провайдеров
+_RATE_LIMIT_HEADER_PREFIXES = ("x-ratelimit-", "anthropic-ratelimit-", "retry-after")
+
+# Формат длительности OpenAI/Groq в x-ratelimit-reset-*: "1s", "6m0s", "20ms", "1h2m3.5s"
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Верхняя граница паузы, которую принимаем от провайдера
+_MAX_COOLDOWN = 300.0
+
+
+class SchedulerTimeout(Exception):
+    """Запрос не дождался своей очереди к провайдеру за отведенное время."""
+
+    def __init__(self, lane: str, waited: float, retry_after: Optional[float] = None):
+        self.lane = lane
+        self.waited = waited
+        self.retry_after = retry_after
+        super().__init__(f"Превышено время ожидания очереди к '{lane}' ({waited:.1f} сек.)")
+
+
+def rate_limit_headers(headers: Optional[Mapping[str, str]]) -> Dict[str, str]:
+    """Выбирает из заголовков ответа только относящиеся к лимитам."""
+    if not headers:
+        return {}
+    return {k.lower(): v for k, v in headers.items() if k.lower().startswith(_RATE_LIMIT_HEADER_PREFIXES)}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Разбирает длительность в секундах: число, формат '6m0s' или дату RFC 3339 (Anthropic)."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if parts and "".join(f"{n}{u}" for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return None
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """Ищет HTTP-статус в исключении и в цепочке исключений, из которых оно возникло."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        for attr in ("status_code", "http_status", "code"):
+            value = getattr(exc, attr, None)
+            if isinstance(value, int):
+                return value
+        response = getattr(exc, "response", None)
+        if isinstance(getattr(response, "status_code", None), int):
+            return response.status_code
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def _exception_headers(exc: BaseException) -> Dict[str, str]:
+    """Достает заголовки ответа провайдера из исключения SDK (или из цепочки)."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+        if isinstance(headers, Mapping) and headers:
+            return rate_limit_headers(headers)
+        exc = exc.__cause__ or exc.__context__
+    return {}
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Проверяет, что ошибка вызвана превышением лимита запросов (HTTP 429)."""
+    return _status_code(exc) == 429
+
+
+class _TokenBucket:
+    """Бюджет токенов в минуту: пополняется непрерывно, может уходить в минус после расчета."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Через сколько секунд бюджет позволит списать amount токенов."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def cap(self, remaining: float) -> None:
+        """Не даем локальному бюджету превышать остаток, сообщенный провайдером."""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+
+class _Lane:
+    """Очередь к одному провайдеру или модели: лимит параллельности, бюджет токенов и пауза после 429."""
+
+    def __init__(self, name: str, concurrency: int, tokens_per_minute: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = _TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.served = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.consecutive_rate_limited = 0  # сбрасывается после успешного ответа
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def cooldown_remaining(self) -> float:
+        return max(0.0, self.cooldown_until - time.monotonic())
+
+    def set_cooldown(self, seconds: float) -> None:
+        seconds = min(max(seconds, 0.0), _MAX_COOLDOWN)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """Подстраивается под лимиты, сообщенные провайдером в заголовках ответа."""
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens") or headers.get("anthropic-ratelimit-tokens-remaining")
+        if remaining_tokens is not None and self.bucket is not None:
+            try:
+                self.bucket.cap(float(remaining_tokens))
+            except ValueError:
+                pass
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}") or headers.get(f"anthropic-ratelimit-{kind}-remaining")
+            reset = headers.get(f"x-ratelimit-reset-{kind}") or headers.get(f"anthropic-ratelimit-{kind}-reset")
+            if remaining is not None and reset is not None and remaining.strip() == "0":
+                delay = _parse_duration(reset)
+                if delay:
+                    self.set_cooldown(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "tokens_available": round(self.bucket.tokens, 1) if self.bucket is not None else None,
+            "tokens_per_minute": int(self.bucket.capacity) if self.bucket is not None else None,
+            "cooldown_remaining": round(self.cooldown_remaining(), 2),
+            "served": self.served,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "avg_wait": round(self.total_wait / self.served, 4) if self.served else 0.0,
+            "max_wait": round(self.max_wait_seen, 4),
+        }
+
+
+class Slot:
+    """Выданное разрешение на запрос; позволяет уточнить фактический расход токенов."""
+
+    def __init__(self, lanes: List[_Lane], estimated_tokens: int):
+        self._lanes = lanes
+        self._estimated = estimated_tokens
+
+    def settle(self, meta: Optional[Dict[str, Any]]) -> None:
+        """Учитывает фактический расход токенов и заголовки лимитов из meta ответа."""
+        meta = meta or {}
+        total = (meta.get("token_count") or {}).get("total")
+        headers = meta.get("rate_limit_headers") or {}
+        for lane in self._lanes:
+            lane.consecutive_rate_limited = 0
+            if total and lane.bucket is not None:
+                lane.bucket.take(total - self._estimated)
+            if headers:
+                lane.observe_headers(headers)
+
+
+class ProviderScheduler:
+    """
+    Планировщик исходящих запросов к провайдерам.
+    Для каждого провайдера (и, при наличии настройки, для отдельной модели) ограничивает
+    число одновременных запросов и расход токенов в минуту. При 429 выдерживает паузу
+    из retry-after / x-ratelimit-* и повторяет запрос вместо ошибки. Ожидание в очереди
+    ограничено max_wait секундами.
+    """
+
+    def __init__(self, default_concurrency: int = 8, default_tokens_per_minute: int = 0,
+                 max_wait: float = 30.0, max_retries: int = 2,
+                 overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.default_concurrency = default_concurrency
+        self.default_tokens_per_minute = default_tokens_per_minute
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.overrides = overrides or {}
+        self._lanes: Dict[str, _Lane] = {}
+
+    def _lane(self, name: str) -> _Lane:
+        lane = self._lanes.get(name)
+        if lane is None:
+            override = self.overrides.get(name, {})
+            lane = _Lane(
+                name,
+                concurrency=int(override.get("concurrency", self.default_concurrency)),
+                tokens_per_minute=int(override.get("tokens_per_minute", self.default_tokens_per_minute)),
+            )
+            self._lanes[name] = lane
+        return lane
+
+    def _lanes_for(self, provider: str, model_name: Optional[str]) -> List[_Lane]:
+        """Очередь провайдера и, если для модели заданы свои лимиты, очередь модели."""
+        lanes = [self._lane(provider)]
+        model_key = f"{provider}/{model_name}" if model_name else None
+        if model_key and model_key in self.overrides:
+            lanes.append(self._lane(model_key))
+        return lanes
+
+    async def _acquire(self, lane: _Lane, estimated_tokens: int, deadline: float) -> None:
+        start = time.monotonic()
+        lane.waiting += 1
+        try:
+            # Пауза после 429 и бюджет токенов
+            while True:
+                delay = lane.cooldown_remaining()
+                if lane.bucket is not None:
+                    delay = max(delay, lane.bucket.wait_time(estimated_tokens))
+                if delay <= 0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    lane.rejected += 1
+                    raise SchedulerTimeout(lane.name, time.monotonic() - start, retry_after=delay)
+                await asyncio.sleep(delay)
+
+            # Лимит параллельных запросов
+            try:
+                await asyncio.wait_for(lane.semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                lane.rejected += 1
+                raise SchedulerTimeout(lane.name, time.monotonic() - start)
+        finally:
+            lane.waiting -= 1
+
+        if lane.bucket is not None:
+            lane.bucket.take(estimated_tokens)
+        waited = time.monotonic() - start
+        lane.in_flight += 1
+        lane.served += 1
+        lane.total_wait += waited
+        lane.max_wait_seen = max(lane.max_wait_seen, waited)
+
+    @staticmethod
+    def _release(lane: _Lane) -> None:
+        lane.in_flight -= 1
+        lane.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model_name: Optional[str] = None,
+                   estimated_tokens: int = 0) -> AsyncIterator[Slot]:
+        """Ожидает разрешения на запрос к провайдеру (не дольше max_wait) и удерживает его."""
+        deadline = time.monotonic() + self.max_wait
+        acquired: List[_Lane] = []
+        try:
+            for lane in self._lanes_for(provider, model_name):
+                await self._acquire(lane, estimated_tokens, deadline)
+                acquired.append(lane)
+            yield Slot(acquired, estimated_tokens)
+        finally:
+            for lane in acquired:
+                self._release(lane)
+
+    def on_rate_limited(self, provider: str, model_name: Optional[str], exc: BaseException) -> float:
+        """Регистрирует 429 от провайдера и выставляет паузу. Возвращает длительность паузы."""
+        headers = _exception_headers(exc)
+        delay = None
+        if "retry-after-ms" in headers:
+            delay = (_parse_duration(headers["retry-after-ms"]) or 0) / 1000
+        elif "retry-after" in headers:
+            delay = _parse_duration(headers["retry-after"])
+        lanes = self._lanes_for(provider, model_name)
+        target = lanes[-1]  # лимиты обычно считаются на модель, если она настроена отдельно
+        target.rate_limited += 1
+        target.consecutive_rate_limited += 1
+        if headers:
+            target.observe_headers(headers)
+        if delay is None:
+            # Провайдер не сообщил время - экспоненциальная пауза по числу 429 подряд
+            delay = min(2.0 ** target.consecutive_rate_limited, 30.0)
+        target.set_cooldown(delay)
+        logger.warning(f"Провайдер {target.name} вернул 429, пауза {delay:.1f} сек.")
+        return delay
+
+    async def run(self, provider: str, model_name: Optional[str], estimated_tokens: int,
+                  call: Callable[[], Awaitable[Tuple[Any, Dict[str, Any]]]]) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Выполняет call() в очереди провайдера. call возвращает (результат, meta); из meta
+        берутся фактический расход токенов и заголовки лимитов. При 429 запрос повторяется
+        до max_retries раз после паузы.
+        """
+        attempt = 0
+        while True:
+            async with self.slot(provider, model_name, estimated_tokens) as slot:
+                try:
+                    result, meta = await call()
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt >= self.max_retries:
+                        raise
+                    self.on_rate_limited(provider, model_name, e)
+                    attempt += 1
+                    continue
+                slot.settle(meta)
+                return result, meta
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Статистика очередей: глубина, ожидание, отказы, 429."""
+        return {name: lane.stats() for name, lane in self._lanes.items()}
@@ -0,0 +1,209 @@
+# backend/sdk_loader.py
+
+import asyncio
+import importlib
+import importlib.util
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Версия huggingface_hub, с которой проверена работа клиента
+HUGGINGFACE_HUB_VERSION = "0.23.0"
+
+
+# --- Загрузчики SDK провайдеров ---
+# Каждый загрузчик импортирует SDK и возвращает словарь имен, которые models_io
+# использует как глобальные (клиенты и классы исключений).
+
+def _load_openai() -> Dict[str, Any]:
+    from openai import AsyncOpenAI, OpenAIError, AuthenticationError, NotFoundError, RateLimitError
+    return {
+        "AsyncOpenAI": AsyncOpenAI,
+        "OpenAIError": OpenAIError,
+        "OpenAIAuthenticationError": AuthenticationError,
+        "OpenAINotFoundError": NotFoundError,
+        "OpenAIRateLimitError": RateLimitError,
+    }
+
+def _load_google() -> Dict[str, Any]:
+    import google.generativeai as genai
+    from google.api_core.exceptions import ClientError, Unauthenticated, PermissionDenied, NotFound
+    return {
+        "genai": genai,
+        "GoogleClientError": ClientError,
+        "GoogleUnauthenticated": Unauthenticated,
+        "GooglePermissionDenied": PermissionDenied,
+        "GoogleNotFound": NotFound,
+    }
+
+def _load_anthropic() -> Dict[str, Any]:
+    from anthropic import AsyncAnthropic, AnthropicError, AuthenticationError, NotFoundError, RateLimitError
+    return {
+        "AsyncAnthropic": AsyncAnthropic,
+        "AnthropicError": AnthropicError,
+        "AnthropicAuthenticationError": AuthenticationError,
+        "AnthropicNotFoundError": NotFoundError,
+        "AnthropicRateLimitError": RateLimitError,
+    }
+
+def _load_mistral() -> Dict[str, Any]:
+    from mistralai.async_client import MistralAsyncClient
+    from mistralai.exceptions import MistralException, MistralAPIException, MistralConnectionException, MistralAPIStatusException
+    return {
+        "MistralAsyncClient": MistralAsyncClient,
+        "MistralException": MistralException,
+        "MistralAPIException": MistralAPIException,
+        "MistralConnectionException": MistralConnectionException,
+        "MistralAPIStatusException": MistralAPIStatusException,
+    }
+
+def _load_groq() -> Dict[str, Any]:
+    from groq import AsyncGroq, GroqError, AuthenticationError, NotFoundError, RateLimitError
+    return {
+        "AsyncGroq": AsyncGroq,
+        "GroqError": GroqError,
+        "GroqAuthenticationError": AuthenticationError,
+        "GroqNotFoundError": NotFoundError,
+        "GroqRateLimitError": RateLimitError,
+    }
+
+def _load_huggingface_hub() -> Dict[str, Any]:
+    import huggingface_hub
+    from huggingface_hub import AsyncInferenceClient, HfApi
+    from huggingface_hub.utils import RepositoryNotFoundError, GatedRepoError, HFValidationError
+
+    version = getattr(huggingface_hub, "__version__", "неизвестно")
+    if version != HUGGINGFACE_HUB_VERSION:
+        logger.warning(f"Установлена версия huggingface_hub {version}, проверенная версия - {HUGGINGFACE_HUB_VERSION}")
+
+    names = {
+        "AsyncInferenceClient": AsyncInferenceClient,
+        "HfApi": HfApi,
+        "RepositoryNotFoundError": RepositoryNotFoundError,
+        "GatedRepoError": GatedRepoError,
+        "HFValidationError": HFValidationError,
+    }
+    # В разных версиях InferenceTimeoutError экспортируется из разных мест (или отсутствует)
+    timeout_error = getattr(huggingface_hub, "InferenceTimeoutError", None)
+    if timeout_error is not None:
+        names["InferenceTimeoutError"] = timeout_error
+    return names
+
+
+# провайдер -> (модуль для проверки установки, пакет pip, загрузчик)
+SDK_SPECS: Dict[str, Tuple[str, str, Callable[[], Dict[str, Any]]]] = {
+    "openai": ("openai", "openai==1.30.1", _load_openai),
+    "google": ("google.generativeai", "google-generativeai==0.6.0", _load_google),
+    "anthropic": ("anthropic", "anthropic==0.27.0", _load_anthropic),
+    "mistral": ("mistralai", "mistralai==0.3.0", _load_mistral),
+    "groq": ("groq", "groq==0.8.0", _load_groq),
+    "huggingface_hub": ("huggingface_hub", f"huggingface_hub=={HUGGINGFACE_HUB_VERSION}", _load_huggingface_hub),
+}
+
+
+def _is_installed(module_name: str) -> bool:
+    """Проверяет наличие модуля без его импорта (и без обращения к pip)."""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        # find_spec для вложенного модуля импортирует родительский пакет, которого может не быть
+        return False
+
+
+class ProviderSdkLoader:
+    """
+    Ленивая загрузка SDK провайдеров: библиотека импортируется только при первом
+    обращении к провайдеру (когда для него есть ключ и нужен клиент), а не при
+    импорте models_io. Результат загрузки (успех или ошибка) запоминается.
+
+    Подписчики (models_io) получают словарь имен загруженного SDK и подставляют
+    их в свои глобальные переменные.
+    """
+
+    def __init__(self, specs: Dict[str, Tuple[str, str, Callable[[], Dict[str, Any]]]]):
+        self._specs = specs
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, Dict[str, Any]] = {}
+        self._errors: Dict[str, str] = {}
+        self._load_times: Dict[str, float] = {}
+        self._installed: Dict[str, bool] = {}
+        self._subscribers: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    def subscribe(self, callback: Callable[[str, Dict[str, Any]], None]) -> None:
+        """Регистрирует обработчик, вызываемый после успешной загрузки SDK."""
+        self._subscribers.append(callback)
+        for provider, names in self._loaded.items():
+            callback(provider, names)
+
+    def is_installed(self, provider: str) -> bool:
+        """Установлен ли SDK провайдера (без импорта)."""
+        if provider not in self._installed:
+            spec = self._specs.get(provider)
+            self._installed[provider] = spec is not None and _is_installed(spec[0])
+        return self._installed[provider]
+
+    def is_loaded(self, provider: str) -> bool:
+        return provider in self._loaded
+
+    def names(self, provider: str) -> Dict[str, Any]:
+        """Имена (классы клиентов и исключений) загруженного SDK; пустой словарь, если SDK не загружен."""
+        return self._loaded.get(provider, {})
+
+    def load(self, provider: str) -> bool:
+        """Импортирует SDK провайдера (один раз). Возвращает True, если SDK доступен."""
+        if provider in self._loaded:
+            return True
+        if provider in self._errors or provider not in self._specs:
+            return False
+
+        with self._lock:
+            if provider in self._loaded:
+                return True
+            if provider in self._errors:
+                return False
+            module_name, pip_name, loader = self._specs[provider]
+            started = time.perf_counter()
+            try:
+                names = loader()
+            except ImportError as e:
+                self._errors[provider] = str(e)
+                logger.warning(f"Библиотека '{module_name}' не установлена ({e}). Для установки выполните: pip install {pip_name}")
+                return False
+            except Exception as e:
+                self._errors[provider] = str(e)
+                logger.error(f"Ошибка загрузки SDK провайдера {provider}: {e}")
+                return False
+            self._load_times[provider] = time.perf_counter() - started
+            for callback in self._subscribers:
+                callback(provider, names)
+            self._loaded[provider] = names
+
+        logger.info(f"SDK провайдера {provider} загружен за {self._load_times[provider] * 1000:.0f} мс")
+        return True
+
+    async def aload(self, provider: str) -> bool:
+        """Асинхронная загрузка: импорт выполняется в потоке, чтобы не блокировать цикл событий."""
+        if provider in self._loaded:
+            return True
+        if provider in self._errors or provider not in self._specs:
+            return False
+        return await asyncio.to_thread(self.load, provider)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние SDK по провайдерам: установлен ли, загружен ли, время загрузки, ошибка."""
+        return {
+            provider: {
+                "package": pip_name,
+                "installed": self.is_installed(provider),
+                "loaded": provider in self._loaded,
+                "load_time_ms": round(self._load_times[provider] * 1000, 1) if provider in self._load_times else None,
+                "error": self._errors.get(provider),
+            }
+            for provider, (_, pip_name, _) in self._specs.items()
+        }
+
+
+sdk_loader = ProviderSdkLoader(SDK_SPECS)
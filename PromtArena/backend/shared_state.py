@@ -0,0 +1,355 @@
+# backend/shared_state.py
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Операция пакета: ("incr", ключ, приращение, ttl) или ("get", ключ, 0, 0)
+StateOp = Tuple[str, str, int, float]
+# Результат операции: (значение, сколько секунд ключ еще будет жить; 0 - ключа нет)
+StateValue = Tuple[int, float]
+
+
+class SharedState:
+    """
+    Общее состояние счетчиков для лимитов запросов и блокировок входа.
+
+    Единственный примитив - атомарное увеличение счетчика с временем жизни:
+    TTL задается при создании ключа и не продлевается последующими увеличениями
+    (фиксированное окно). Операции передаются пачкой и выполняются за одно
+    обращение к хранилищу (одна транзакция SQLite, один pipeline Redis).
+    """
+
+    name = "base"
+
+    async def open(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    async def batch(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        raise NotImplementedError
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = 60.0) -> StateValue:
+        return (await self.batch([("incr", key, amount, ttl)]))[0]
+
+    async def get(self, key: str) -> StateValue:
+        return (await self.batch([("get", key, 0, 0)]))[0]
+
+
+class MemorySharedState(SharedState):
+    """Счетчики в памяти процесса (по умолчанию): общие только для одного воркера."""
+
+    name = "memory"
+
+    # Сколько самых старых ключей проверяется на истечение при каждой пачке
+    _SWEEP_PER_CALL = 4
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()  # key -> [value, expires_at]
+
+    async def batch(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        return self.batch_sync(ops)
+
+    def batch_sync(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        now = time.monotonic()
+        results = []
+        for op, key, amount, ttl in ops:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._data[key]
+                entry = None
+            if op == "incr":
+                if entry is None:
+                    entry = self._data[key] = [0, now + ttl]
+                entry[0] += amount
+                self._data.move_to_end(key)
+            results.append((int(entry[0]), entry[1] - now) if entry is not None else (0, 0.0))
+        self._evict(now)
+        return results
+
+    def _evict(self, now: float) -> None:
+        for _ in range(self._SWEEP_PER_CALL):
+            if not self._data:
+                break
+            oldest_key, (_, expires_at) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[oldest_key]
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+
+class SqliteSharedState(SharedState):
+    """
+    Счетчики в файле SQLite: общие для всех воркеров на одном хосте (WAL + busy_timeout).
+    Пачка выполняется одной транзакцией в отдельном потоке.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # одно соединение используется из разных потоков
+        self._ops_since_cleanup = 0
+
+    def _open_sync(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_counters ("
+            " key TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn = conn
+
+    def _batch_sync(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        # Время - wall clock: TTL должен одинаково пониматься всеми процессами
+        now = time.time()
+        results = []
+        with self._lock:
+            if self._conn is None:
+                self._open_sync()
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for op, key, amount, ttl in ops:
+                    if op == "incr":
+                        row = conn.execute(
+                            "INSERT INTO shared_counters (key, value, expires_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT(key) DO UPDATE SET "
+                            " value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,"
+                            " expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+                            "RETURNING value, expires_at",
+                            (key, amount, now + ttl, now, now)
+                        ).fetchone()
+                    else:
+                        row = conn.execute(
+                            "SELECT value, expires_at FROM shared_counters WHERE key = ? AND expires_at > ?", (key, now)
+                        ).fetchone()
+                    results.append((int(row[0]), row[1] - now) if row else (0, 0.0))
+
+                # Истекшие ключи удаляются изредка, чтобы не замедлять каждую пачку
+                self._ops_since_cleanup += len(ops)
+                if self._ops_since_cleanup >= 1000:
+                    self._ops_since_cleanup = 0
+                    conn.execute("DELETE FROM shared_counters WHERE expires_at <= ?", (now,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return results
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._batch_sync, [])
+        logger.info(f"Общее состояние лимитов: SQLite ({self.path})")
+
+    async def aclose(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    async def batch(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        return await asyncio.to_thread(self._batch_sync, ops)
+
+
+class RespError(Exception):
+    """Ошибка, которую вернул сервер по протоколу Redis (RESP)."""
+
+
+class _RedisConnection:
+    """Одно соединение с сервером Redis; ответы читаются в порядке отправки команд."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Сервер Redis закрыл соединение")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            return RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [await self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"Некорректный ответ сервера Redis: {line[:50]!r}")
+
+    async def pipeline(self, commands: List[tuple]) -> list:
+        self.writer.write(b"".join(self._encode(*command) for command in commands))
+        await self.writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+# Увеличение счетчика одним атомарным шагом на сервере. PEXPIRE выставляется, если у ключа
+# нет TTL: ключ только что создан или остался без TTL после сбоя - иначе счетчик не сбросится никогда
+_INCR_SCRIPT = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl < 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    pttl = tonumber(ARGV[2])
+end
+return {value, pttl}
+"""
+
+
+class RedisSharedState(SharedState):
+    """
+    Счетчики на сервере с протоколом Redis (Redis, Valkey, KeyDB или локальная замена в тестах).
+    Увеличение выполняется Lua-скриптом (EVAL: INCRBY, PTTL и PEXPIRE для нового ключа),
+    чтение - GET и PTTL. Пачка отправляется одним pipeline по одному соединению из
+    небольшого пула: одновременные запросы не ждут друг друга.
+    """
+
+    name = "redis"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 1.0, pool_size: int = 8):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: List[_RedisConnection] = []
+        # Не больше pool_size соединений одновременно заняты pipeline
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout
+        )
+        connection = _RedisConnection(reader, writer)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            replies = await asyncio.wait_for(connection.pipeline(setup), timeout=self.timeout)
+            errors = [reply for reply in replies if isinstance(reply, RespError)]
+            if errors:
+                connection.close()
+                raise errors[0]
+        return connection
+
+    async def _execute(self, commands: List[tuple]) -> list:
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await self._connect()
+                replies = await asyncio.wait_for(connection.pipeline(commands), timeout=self.timeout)
+            except BaseException:
+                # После сбоя посреди pipeline соединение в неизвестном состоянии
+                if connection is not None:
+                    connection.close()
+                raise
+            self._idle.append(connection)
+            return replies
+
+    async def open(self) -> None:
+        await self._execute([("PING",)])
+        logger.info(f"Общее состояние лимитов: Redis ({self.host}:{self.port}/{self.db}), пул {self.pool_size} соединений")
+
+    async def aclose(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    async def batch(self, ops: Sequence[StateOp]) -> List[StateValue]:
+        commands = []
+        for op, key, amount, ttl in ops:
+            if op == "incr":
+                # TTL выставляется только при создании ключа: окно не продлевается
+                commands.append(("EVAL", _INCR_SCRIPT, 1, key, amount, max(1, int(ttl * 1000))))
+            else:
+                commands.append(("GET", key))
+                commands.append(("PTTL", key))
+
+        replies = await self._execute(commands)
+
+        results = []
+        position = 0
+        for op, _, _, _ in ops:
+            if op == "incr":
+                reply = replies[position]
+                position += 1
+                if isinstance(reply, RespError):
+                    raise reply
+                value, pttl = reply
+            else:
+                value, pttl = replies[position:position + 2]
+                position += 2
+                for reply in (value, pttl):
+                    if isinstance(reply, RespError):
+                        raise reply
+            ttl_left = pttl / 1000.0 if isinstance(pttl, int) and pttl > 0 else 0.0
+            results.append((int(value) if value is not None else 0, ttl_left))
+        return results
+
+
+def create_shared_state(url: str, max_keys: int = 100_000) -> SharedState:
+    """
+    Создает хранилище по URL:
+    memory:// - в памяти процесса; sqlite:///path/to/file.db - файл SQLite;
+    redis://[:password@]host[:port][/db] - сервер с протоколом Redis.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    if scheme in ("", "memory"):
+        return MemorySharedState(max_keys=max_keys)
+    if scheme == "sqlite":
+        path = url.split("://", 1)[1]
+        # sqlite:///relative.db -> relative.db, sqlite:////abs/path.db -> /abs/path.db
+        return SqliteSharedState(path[1:] if path.startswith("/") else path)
+    if scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisSharedState(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, parsed.password,
+                                pool_size=settings.shared_state_pool_size)
+    raise ValueError(f"Неподдерживаемое хранилище общего состояния: '{url}'")
+
+
+shared_state = create_shared_state(settings.shared_state_url, max_keys=settings.rate_limit_max_keys)
@@ -0,0 +1,314 @@
+# backend/tracing.py
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Виды спанов OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# Коды статуса OTLP
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Спан трассировки (совместим с моделью OpenTelemetry). Используется как контекстный
+    менеджер: на время блока становится текущим, вложенные спаны получают его родителем;
+    исключение из блока помечает спан ошибкой.
+    """
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind",
+                 "start_ns", "end_ns", "attributes", "status", "status_message", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 kind: int, attributes: Optional[Dict[str, Any]]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.status = _STATUS_OK
+        self.status_message = ""
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = _STATUS_ERROR
+        self.status_message = message[:500]
+
+    def record_exception(self, e: BaseException) -> None:
+        self.set_error(f"{type(e).__name__}: {e}")
+        self.attributes["exception.type"] = type(e).__name__
+
+    def end(self) -> None:
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        self.tracer._on_end(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None and not isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+            self.record_exception(exc)
+        _current_span.reset(self._token)
+        self.end()
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status_message else {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Спан, который не записывается: трассировка выключена или запрос не попал в выборку."""
+    __slots__ = ()
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def record_exception(self, e: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Разбирает заголовок W3C traceparent: (trace_id, parent_span_id, sampled) или None."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Tracer:
+    """
+    Трассировка запросов с выгрузкой в формате OTLP/JSON: в файл (построчно, формат
+    приемника otlpjsonfile коллектора OpenTelemetry) или HTTP POST в коллектор (/v1/traces).
+
+    Решение о записи принимается один раз для корневого спана запроса (доля sample_ratio
+    или флаг sampled из входящего traceparent). Для запросов вне выборки и при выключенной
+    трассировке start_root_span возвращает NOOP_SPAN, а вложенные span() и traced() стоят
+    одного чтения ContextVar. Завершенные спаны копятся в памяти и выгружаются фоновой
+    задачей пачками; при переполнении буфера новые спаны отбрасываются.
+    """
+
+    def __init__(self, enabled: bool = False, sample_ratio: float = 0.01, exporter: str = "file",
+                 file_path: str = "", endpoint: str = "", service_name: str = "prompt-arena",
+                 export_interval: float = 5.0, max_queue: int = 10000):
+        self.enabled = enabled
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.export_interval = export_interval
+        self.max_queue = max_queue
+        self._finished: List[Span] = []
+        self._task: Optional[asyncio.Task] = None
+        self._http_session = None
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    # --- Создание спанов ---
+
+    def start_root_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                        traceparent: Optional[str] = None, kind: int = SPAN_KIND_SERVER):
+        """Корневой спан запроса; здесь принимается решение о выборке."""
+        if not self.enabled:
+            return NOOP_SPAN
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id, sampled = None, None, random.random() < self.sample_ratio
+        if not sampled:
+            return NOOP_SPAN
+        return Span(self, name, trace_id or os.urandom(16).hex(), parent_id, kind, attributes)
+
+    def _on_end(self, span: Span) -> None:
+        if len(self._finished) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._finished.append(span)
+
+    # --- Выгрузка ---
+
+    def _build_request(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                _otlp_attribute("service.name", self.service_name),
+                _otlp_attribute("service.version", settings.app_version),
+            ]},
+            "scopeSpans": [{"scope": {"name": "backend.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+
+    def _write_file(self, payload: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.write(payload + "\n")
+
+    async def export(self) -> None:
+        """Выгружает накопленные спаны одной пачкой."""
+        if not self._finished:
+            return
+        spans, self._finished = self._finished, []
+        payload = json.dumps(self._build_request(spans), ensure_ascii=False, separators=(",", ":"))
+        try:
+            if self.exporter == "otlp":
+                import aiohttp
+                if self._http_session is None:
+                    self._http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+                async with self._http_session.post(
+                    self.endpoint, data=payload, headers={"Content-Type": "application/json"}
+                ) as response:
+                    if response.status >= 300:
+                        raise RuntimeError(f"коллектор ответил {response.status}")
+            else:
+                await asyncio.to_thread(self._write_file, payload)
+            self.exported += len(spans)
+        except Exception as e:
+            self.export_errors += 1
+            self.dropped += len(spans)
+            logger.warning(f"Не удалось выгрузить {len(spans)} спанов трассировки ({self.exporter}): {e}")
+
+    async def _export_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.export_interval)
+            await self.export()
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._export_loop(), name="tracing_export")
+        target = self.endpoint if self.exporter == "otlp" else self.file_path
+        logger.info(f"Трассировка включена: выборка {self.sample_ratio:.2%}, выгрузка {self.exporter} -> {target}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.export()
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_ratio": self.sample_ratio,
+            "pending": len(self._finished),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }
+
+
+tracer = Tracer(
+    enabled=settings.tracing_enabled,
+    sample_ratio=settings.tracing_sample_ratio,
+    exporter=settings.tracing_exporter,
+    file_path=settings.tracing_file_path,
+    endpoint=settings.tracing_otlp_endpoint,
+    service_name=settings.tracing_service_name,
+)
+
+
+def span(name: str, **attributes: Any):
+    """Дочерний спан текущей трассы: `with tracing.span("cache.get", key=...)`."""
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(tracer, name, parent.trace_id, parent.span_id, SPAN_KIND_INTERNAL, attributes)
+
+
+def traced(name: str) -> Callable:
+    """Декоратор корутины: вызов оборачивается в дочерний спан с именем name."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace_id() -> Optional[str]:
+    """ID трассы текущего запроса, если он попал в выборку."""
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
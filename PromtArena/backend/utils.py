@@ -281,8 +281,12 @@ def print_startup_banner(version: str = "0.1.0"):
     print(system_info)
 
 def check_dependencies():
-    """Проверяет наличие всех необходимых зависимостей и выводит предупреждения в случае их отсутствия."""
-    import importlib
+    """
+    Проверяет наличие всех необходимых зависимостей и выводит предупреждения в случае их отсутствия.
+    Пакеты не импортируются (importlib.util.find_spec), поэтому проверка не замедляет запуск:
+    SDK провайдеров загружаются лениво при первом обращении (backend.sdk_loader).
+    """
+    import importlib.util
     import logging
     
     logger = logging.getLogger(__name__)
@@ -327,19 +331,10 @@ def check_dependencies():
     
     for package_import, info in required_packages.items():
         try:
-            if "." in package_import:  # Обрабатываем импорты с точкой, как google.generativeai
-                main_package = package_import.split(".")[0]
-                importlib.import_module(main_package)
-            else:
-                importlib.import_module(package_import)
-                
-            # Проверяем версию для huggingface_hub
-            if package_import == "huggingface_hub":
-                import huggingface_hub
-                version = getattr(huggingface_hub, "__version__", "неизвестно")
-                logger.info(f"Библиотека 'huggingface_hub' успешно импортирована, версия: {version}")
-                
-        except ImportError:
+            # Для вложенных модулей (google.generativeai) find_spec импортирует только родительский пакет
+            if importlib.util.find_spec(package_import) is None:
+                raise ImportError(package_import)
+        except (ImportError, ValueError):
             package_name = info.get("package_name", package_import)
             purpose = info.get("purpose", "не указано")
             install_command = info.get("install_command", f"pip install {package_name}")
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+"""
+Нагрузочный бенчмарк API без сети: приложение (uvicorn) работает с локальными mock
+серверами OpenAI и Anthropic (benchmarks/mock_providers.py) через настоящие SDK.
+
+Сценарии выполняются по очереди с заданной конкурентностью:
+    interact         POST /api/v1/interact (попеременно openai и anthropic)
+    interact_stream  POST /api/v1/interact/stream (SSE, дополнительно время до первого токена)
+    compare          POST /api/v1/interactions/compare
+    leaderboard      GET  /api/v1/leaderboard (после загрузки --seed-ratings оценок)
+    models           GET  /api/v1/models
+
+Промты уникальны, поэтому кеш ответов не влияет на результат. Каждый запрос идет с
+собственным X-Forwarded-For, чтобы ограничение частоты по IP не отсекало нагрузку.
+Итог - пропускная способность и p50/p95/p99 задержки по сценариям - записывается в JSON.
+С --baseline результат сравнивается с сохраненным: если p95 вырос или пропускная
+способность упала больше чем на --max-regression, код возврата 1.
+
+Запуск из каталога PromtArena:
+    python benchmarks/bench_load.py --concurrency 32 --requests 400
+    python benchmarks/bench_load.py --baseline benchmarks/baselines/bench_load.json
+    python benchmarks/bench_load.py --save-baseline benchmarks/baselines/bench_load.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+import mock_providers  # noqa: E402
+
+SCENARIOS = ("interact", "interact_stream", "compare", "leaderboard", "models")
+MODELS = ("openai/gpt-4o-mini", "anthropic/claude-3-haiku-20240307")
+AUTH = aiohttp.BasicAuth("admin", "bench-password")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _summary(latencies, elapsed: float) -> dict:
+    return {
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+# --- Запуск процессов ---
+
+def _start_mock(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, str(BENCH_DIR / "mock_providers.py"), "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--tokens-per-sec", str(args.tokens_per_sec),
+        "--response-tokens", str(args.response_tokens), "--rate-limit-ratio", str(args.rate_limit_ratio),
+        "--retry-after-ms", str(args.retry_after_ms),
+    ]
+    return subprocess.Popen(command, cwd=PROJECT_DIR)
+
+
+def _start_app(port: int, mock_url: str, tmp: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{tmp}/bench.db",
+        "RATING_BUFFER_JOURNAL_PATH": f"{tmp}/ratings_journal.jsonl",
+        "RESPONSE_CACHE_PATH": f"{tmp}/response_cache.db",
+        "OPENAI_BASE_URL": f"{mock_url}/v1",
+        "ANTHROPIC_BASE_URL": mock_url,
+        "AUTH_PASSWORD": AUTH.password,
+        "MOCK_PROVIDER_ENABLED": "0",
+        "TRACING_ENABLED": "0",
+        "LOG_LEVEL": "ERROR",
+    })
+    if not env.get("ENCRYPTION_KEY"):
+        from cryptography.fernet import Fernet
+        env["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+    env.setdefault("JWT_SECRET_KEY", "bench-jwt-secret")
+    command = [sys.executable, "-m", "uvicorn", "backend.main:app",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(command, cwd=PROJECT_DIR, env=env)
+
+
+def _stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# --- Нагрузка ---
+
+class LoadClient:
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self._ip_counter = itertools.count(1)
+        self.session = aiohttp.ClientSession(
+            auth=AUTH,
+            connector=aiohttp.TCPConnector(limit=concurrency * 2),
+            timeout=aiohttp.ClientTimeout(total=120),
+        )
+
+    def _headers(self) -> dict:
+        n = next(self._ip_counter)
+        return {"X-Forwarded-For": f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"}
+
+    async def wait_ready(self, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                async with self.session.get(f"{self.base_url}/api/v1/categories", headers=self._headers()) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("Приложение не запустилось")
+            await asyncio.sleep(0.2)
+
+    async def setup(self, seed_ratings: int, timeout: float = 60.0) -> None:
+        """Ключи провайдеров, ожидание моделей в каталоге и начальные оценки для лидерборда."""
+        for provider in ("openai", "anthropic"):
+            async with self.session.post(f"{self.base_url}/api/v1/keys", headers=self._headers(),
+                                         json={"provider": provider, "api_key": f"mock-{provider}-key"}) as response:
+                if response.status != 201:
+                    raise RuntimeError(f"Не удалось добавить ключ {provider}: {response.status} {await response.text()}")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            async with self.session.get(f"{self.base_url}/api/v1/models", headers=self._headers()) as response:
+                ids = {model["id"] for model in await response.json()} if response.status == 200 else set()
+            if all(model in ids for model in MODELS):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Модели mock провайдеров не появились в каталоге: {sorted(ids)}")
+            await asyncio.sleep(0.5)
+
+        async def rate(i: int) -> None:
+            rating = {"model_id": MODELS[i % 2], "prompt_text": f"seed prompt {i % 500}", "rating": 1 + (i * 7) % 10}
+            async with self.session.post(f"{self.base_url}/api/v1/rate", headers=self._headers(), json=rating) as response:
+                await response.read()
+
+        await self._run_many(rate, seed_ratings)
+
+    async def _run_many(self, func, count: int) -> None:
+        counter = itertools.count()
+
+        async def worker() -> None:
+            for i in counter:
+                if i >= count:
+                    return
+                await func(i)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def _request(self, scenario: str, i: int) -> dict:
+        """Один запрос сценария: {"ok": bool, "provider_error": bool, "ttft": float | None}."""
+        prompt = f"bench {scenario} {i} {time.time_ns()}"
+        model = MODELS[i % 2]
+        result = {"ok": False, "provider_error": False, "ttft": None}
+        started = time.perf_counter()
+
+        if scenario == "interact":
+            async with self.session.post(f"{self.base_url}/api/v1/interact", headers=self._headers(),
+                                         json={"model_id": model, "prompt": prompt}) as response:
+                body = await response.json() if response.status == 200 else None
+                result["ok"] = body is not None
+                result["provider_error"] = bool(body and body.get("error"))
+        elif scenario == "interact_stream":
+            async with self.session.post(f"{self.base_url}/api/v1/interact/stream", headers=self._headers(),
+                                         json={"model_id": model, "prompt": prompt}) as response:
+                result["ok"] = response.status == 200
+                async for line in response.content:
+                    if result["ttft"] is None and line.startswith(b"event: delta"):
+                        result["ttft"] = time.perf_counter() - started
+                    if line.startswith(b"data:") and b'"event": "done"' in line:
+                        result["provider_error"] = b'"error": null' not in line
+        elif scenario == "compare":
+            request = {"model_id_1": MODELS[0], "model_id_2": MODELS[1], "prompt": prompt}
+            async with self.session.post(f"{self.base_url}/api/v1/interactions/compare", headers=self._headers(),
+                                         json=request) as response:
+                body = await response.json() if response.status == 200 else None
+                result["ok"] = body is not None
+                result["provider_error"] = bool(body and any(
+                    (body.get(key) or {}).get("error") for key in ("response_1", "response_2")))
+        elif scenario in ("leaderboard", "models"):
+            async with self.session.get(f"{self.base_url}/api/v1/{scenario}", headers=self._headers()) as response:
+                await response.read()
+                result["ok"] = response.status == 200
+        else:
+            raise ValueError(f"Неизвестный сценарий: {scenario}")
+        return result
+
+    async def run_scenario(self, scenario: str, requests: int, warmup: int) -> dict:
+        latencies, ttfts = [], []
+        errors = provider_errors = 0
+
+        async def warm(i: int) -> None:
+            try:
+                await self._request(scenario, i)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+        await self._run_many(warm, warmup)
+
+        async def measured(i: int) -> None:
+            nonlocal errors, provider_errors
+            started = time.perf_counter()
+            try:
+                result = await self._request(scenario, i)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+                return
+            if not result["ok"]:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            provider_errors += result["provider_error"]
+            if result["ttft"] is not None:
+                ttfts.append(result["ttft"])
+
+        started = time.perf_counter()
+        await self._run_many(measured, requests)
+        elapsed = time.perf_counter() - started
+
+        summary = {"requests": requests, "errors": errors, "provider_errors": provider_errors}
+        summary.update(_summary(latencies, elapsed))
+        if ttfts:
+            summary["ttft_p50_ms"] = round(_percentile(ttfts, 0.50) * 1000, 2)
+            summary["ttft_p95_ms"] = round(_percentile(ttfts, 0.95) * 1000, 2)
+        return summary
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+async def _run(args, app_url: str, mock_url: str) -> dict:
+    client = LoadClient(app_url, args.concurrency)
+    try:
+        await client.wait_ready()
+        await client.setup(args.seed_ratings)
+        results = {}
+        for scenario in args.scenarios:
+            results[scenario] = await client.run_scenario(scenario, args.requests, args.warmup)
+            r = results[scenario]
+            print(f"{scenario:<16}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+                  f"{r['p99_ms']:>9.1f}{r['errors']:>8}{r['provider_errors']:>10}", flush=True)
+        async with client.session.get(f"{mock_url}/stats") as response:
+            mock_stats = await response.json()
+        return {"scenarios": results, "mock": mock_stats}
+    finally:
+        await client.close()
+
+
+# --- Сравнение с базовой линией ---
+
+def compare_with_baseline(results: dict, baseline: dict, max_regression: float) -> list:
+    """Список описаний регрессий: рост p95 или падение пропускной способности больше порога."""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        if base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{scenario}: p95 {base['p95_ms']:.1f} -> {current['p95_ms']:.1f} мс")
+        if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(
+                f"{scenario}: пропускная способность {base['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} запр/с")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных клиентов")
+    parser.add_argument("--requests", type=int, default=400, help="запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=32, help="прогревочных запросов на сценарий (не учитываются)")
+    parser.add_argument("--seed-ratings", type=int, default=2000, help="оценок, загружаемых перед сценариями")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument("--output", default=str(BENCH_DIR / "results" / "bench_load.json"), help="файл с результатами")
+    parser.add_argument("--baseline", help="сравнить с базовой линией (JSON)")
+    parser.add_argument("--save-baseline", help="сохранить результат как базовую линию")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="допустимое ухудшение относительно базовой линии")
+    mock_providers.add_arguments(parser)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    mock_port, app_port = _free_port(), _free_port()
+    mock_url, app_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{app_port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        mock = _start_mock(args, mock_port)
+        app = _start_app(app_port, mock_url, tmp)
+        try:
+            print(f"concurrency={args.concurrency} requests={args.requests} latency={args.latency_ms:.0f} мс "
+                  f"tokens/s={args.tokens_per_sec:g} 429={args.rate_limit_ratio:.1%}")
+            print(f"{'':<16}{'запр/с':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'ошибки':>8}{'провайдер':>10}")
+            run = asyncio.run(_run(args, app_url, mock_url))
+        finally:
+            _stop(app)
+            _stop(mock)
+
+    results = {
+        "config": {
+            "concurrency": args.concurrency, "requests": args.requests, "seed_ratings": args.seed_ratings,
+            "latency_ms": args.latency_ms, "tokens_per_sec": args.tokens_per_sec,
+            "response_tokens": args.response_tokens, "rate_limit_ratio": args.rate_limit_ratio,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        **run,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(results, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"Результаты: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != results["config"]:
+            print("Внимание: параметры запуска отличаются от базовой линии, сравнение может быть некорректным")
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Регрессии относительно {args.baseline} (порог {args.max_regression:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий относительно {args.baseline} нет (порог {args.max_regression:.0%})")
+
+
+if __name__ == "__main__":
+    main()
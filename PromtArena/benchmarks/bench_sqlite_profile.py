@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Бенчмарк профиля SQLite: конкурентная запись оценок и чтение лидерборда.
+
+Запускает один и тот же сценарий дважды в отдельных процессах: без профиля
+(SQLITE_TUNING_ENABLED=0 - журнал по умолчанию, общий пул соединений) и с профилем
+(WAL, одно соединение записи с очередью, пул соединений только для чтения).
+
+Запуск из каталога PromtArena:
+    python benchmarks/bench_sqlite_profile.py --writers 16 --readers 8 --ratings 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _run_scenario(writers: int, readers: int, ratings: int) -> dict:
+    from backend import database, data_logic
+    from backend.config import RatingCreate
+
+    await database.init_db()
+    write_latencies, read_latencies = [], []
+    errors = 0
+    writers_done = asyncio.Event()
+
+    async def writer(worker_id: int) -> None:
+        nonlocal errors
+        for i in range(ratings):
+            rating = RatingCreate(
+                model_id=f"bench/model-{(worker_id + i) % 20}",
+                prompt_text=f"prompt {worker_id}-{i}",
+                rating=1 + (worker_id * 7 + i) % 10,
+            )
+            started = time.perf_counter()
+            try:
+                async with database.AsyncSessionFactory() as db:
+                    await data_logic.process_and_save_rating(db, rating)
+                    await db.commit()
+            except Exception:
+                errors += 1
+                continue
+            write_latencies.append(time.perf_counter() - started)
+
+    async def reader() -> None:
+        nonlocal errors
+        while not writers_done.is_set():
+            started = time.perf_counter()
+            try:
+                async with database.AsyncSessionFactory() as db:
+                    await database.get_leaderboard_data(db)
+                    await database.get_rating_statistics(db)
+            except Exception:
+                errors += 1
+                continue
+            read_latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    reader_tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+    await asyncio.gather(*(writer(i) for i in range(writers)))
+    write_elapsed = time.perf_counter() - started
+    writers_done.set()
+    await asyncio.gather(*reader_tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "writes_per_sec": len(write_latencies) / write_elapsed,
+        "write_p50_ms": statistics.median(write_latencies) * 1000 if write_latencies else 0.0,
+        "write_p95_ms": _percentile(write_latencies, 0.95) * 1000,
+        "reads_per_sec": len(read_latencies) / elapsed,
+        "read_p50_ms": statistics.median(read_latencies) * 1000 if read_latencies else 0.0,
+        "read_p95_ms": _percentile(read_latencies, 0.95) * 1000,
+        "errors": errors,
+    }
+
+
+def _run_child(profile: bool, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite+aiosqlite:///{tmp}/bench.db",
+            "SQLITE_TUNING_ENABLED": "1" if profile else "0",
+            "LOG_LEVEL": "ERROR",
+        })
+        output = subprocess.run(
+            [sys.executable, __file__, "--child",
+             "--writers", str(args.writers), "--readers", str(args.readers), "--ratings", str(args.ratings)],
+            cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=16, help="одновременных писателей")
+    parser.add_argument("--readers", type=int, default=8, help="одновременных читателей")
+    parser.add_argument("--ratings", type=int, default=200, help="оценок на одного писателя")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(PROJECT_DIR))
+        print(json.dumps(asyncio.run(_run_scenario(args.writers, args.readers, args.ratings))))
+        return
+
+    results = {"без профиля": _run_child(False, args), "с профилем": _run_child(True, args)}
+    print(f"writers={args.writers} readers={args.readers} ratings/writer={args.ratings}")
+    header = f"{'':<14}{'запись/с':>10}{'p50 мс':>9}{'p95 мс':>9}{'чтение/с':>10}{'p50 мс':>9}{'p95 мс':>9}{'ошибки':>8}"
+    print(header)
+    for name, r in results.items():
+        print(f"{name:<14}{r['writes_per_sec']:>10.0f}{r['write_p50_ms']:>9.1f}{r['write_p95_ms']:>9.1f}"
+              f"{r['reads_per_sec']:>10.0f}{r['read_p50_ms']:>9.1f}{r['read_p95_ms']:>9.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""Расшифровка API ключей (decrypt_data) и проверка JWT (auth.decode_token)."""
+
+from backend import auth
+from backend.database import decrypt_data, encrypt_data
+
+
+def bench_decrypt_data(benchmark):
+    encrypted = encrypt_data("sk-bench-" + "x" * 48)
+    assert benchmark(decrypt_data, encrypted).startswith("sk-bench-")
+
+
+def bench_decode_token(benchmark):
+    token = auth.create_access_token({"sub": "admin", "is_admin": True})
+    assert benchmark(auth.decode_token, token).username == "admin"
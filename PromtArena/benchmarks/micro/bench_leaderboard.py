@@ -0,0 +1,87 @@
+"""
+generate_leaderboard на --bench-ratings синтетических оценках (1000 моделей) и каталоге
+из --bench-models моделей. Оценки вставляются напрямую через sqlite3, агрегаты
+лидерборда строятся сверкой reconcile_rating_aggregates, как после восстановления из бэкапа.
+"""
+
+import datetime
+import random
+import sqlite3
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import pytest
+
+from backend import data_logic, database
+from backend.config import ModelInfo, settings
+from backend.model_catalog import model_catalog
+from backend.models_io import _get_model_metadata, _guess_category
+
+RATED_MODELS = 1000
+
+
+def _insert_ratings(model_ids, count: int) -> None:
+    rng = random.Random(42)
+    started = datetime.datetime(2024, 1, 1)
+    rows = (
+        (model_ids[i % len(model_ids)], f"{i % 50_000:064x}", rng.randint(1, 10),
+         (started + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f"))
+        for i in range(count)
+    )
+    path = urlparse(settings.database_url.replace("sqlite+aiosqlite", "sqlite")).path
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO ratings (model_id, prompt_hash, rating, timestamp) VALUES (?, ?, ?, ?)", rows)
+
+
+@pytest.fixture(scope="module")
+def rated_db(loop, model_names, ratings_count):
+    catalog = [
+        ModelInfo(id=f"{provider}/{name}", name=name, provider=provider, category=_guess_category(provider, name),
+                  **_get_model_metadata(provider, name))
+        for provider, name in model_names
+    ]
+    by_provider = defaultdict(list)
+    for model in catalog:
+        by_provider[model.provider].append(model)
+
+    async def setup():
+        await database.init_db()
+        await model_catalog.sync()
+        for provider, models in by_provider.items():
+            model_catalog.update_provider(provider, models, time.time())
+        await model_catalog.persist()
+        # Фоновая сверка с провайдерами не должна попадать в замер
+        model_catalog.sync_interval = float("inf")
+
+    loop.run_until_complete(setup())
+    # Часть оценок приходится на модели, которых нет в каталоге (удаленные у провайдера)
+    rated = [model.id for model in catalog[:RATED_MODELS - 50]] + [f"retired/model-{i}" for i in range(50)]
+    _insert_ratings(rated, ratings_count)
+
+    async def reconcile():
+        async with database.AsyncSessionFactory() as db:
+            await database.reconcile_rating_aggregates(db)
+            await db.commit()
+
+    loop.run_until_complete(reconcile())
+    yield
+    loop.run_until_complete(model_catalog.stop())
+
+
+def _generate(loop, category=None):
+    async def run():
+        async with database.AsyncSessionFactory() as db:
+            return await data_logic.generate_leaderboard(db, category)
+
+    return loop.run_until_complete(run())
+
+
+def bench_generate_leaderboard(benchmark, loop, rated_db):
+    leaderboard = benchmark(_generate, loop)
+    assert len(leaderboard) == RATED_MODELS
+
+
+def bench_generate_leaderboard_category(benchmark, loop, rated_db):
+    leaderboard = benchmark(_generate, loop, "programming")
+    assert leaderboard and all(entry.category.startswith("programming") for entry in leaderboard)
@@ -0,0 +1,19 @@
+"""Эвристики каталога моделей (_guess_category, _get_model_metadata) на каталоге из --bench-models моделей."""
+
+from backend.models_io import _get_model_metadata, _guess_category
+
+
+def bench_guess_category(benchmark, model_names):
+    def run():
+        for provider, name in model_names:
+            _guess_category(provider, name)
+
+    benchmark(run)
+
+
+def bench_get_model_metadata(benchmark, model_names):
+    def run():
+        for provider, name in model_names:
+            _get_model_metadata(provider, name)
+
+    benchmark(run)
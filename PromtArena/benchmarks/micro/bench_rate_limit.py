@@ -0,0 +1,55 @@
+"""RateLimitMiddleware.__call__: пакет запросов с 10 000 разных IP (X-Forwarded-For)."""
+
+import pytest
+
+from backend.main import RateLimitMiddleware
+
+IPS = 10_000
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b"[]"})
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+def _scopes(method: str, path: str):
+    return [{
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(b"x-forwarded-for", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}".encode()),
+                    (b"user-agent", b"bench")],
+        "client": ("127.0.0.1", 50000),
+    } for i in range(IPS)]
+
+
+def _run_batch(loop, middleware, scopes):
+    async def batch():
+        for scope in scopes:
+            await middleware(scope, _receive, _send)
+
+    loop.run_until_complete(batch())
+
+
+@pytest.mark.parametrize("method,path", [("GET", "/api/v1/models"), ("POST", "/api/v1/interact")])
+def bench_allowed(benchmark, loop, method, path):
+    """Запросы в пределах лимита: поиск правила, шаг GCRA, заголовки X-RateLimit-* в ответе."""
+    # 11 проходов на IP укладываются и в лимит правила interact (30 в минуту)
+    middleware = RateLimitMiddleware(_app, max_requests=10 ** 9, max_keys=100_000)
+    scopes = _scopes(method, path)
+    benchmark.pedantic(_run_batch, args=(loop, middleware, scopes), rounds=10, warmup_rounds=1)
+
+
+def bench_rejected(benchmark, loop):
+    """Все 10 000 IP исчерпали лимит: ответ 429 формирует сам middleware."""
+    middleware = RateLimitMiddleware(_app, max_requests=1, max_keys=100_000)
+    scopes = _scopes("GET", "/api/v1/models")
+    benchmark.pedantic(_run_batch, args=(loop, middleware, scopes), rounds=10, warmup_rounds=1)
@@ -0,0 +1,93 @@
+"""ResponseCache: попадания и промахи, запись с вытеснением, очистка по модели и полностью."""
+
+import pytest
+
+from backend.config import InteractionResponse
+from backend.models_io import ResponseCache
+
+ENTRIES = 5000
+MODELS = 50
+
+
+def _key(i: int) -> str:
+    return f"provider{i % 5}/model-{i % MODELS}:{i:032x}:1024:"
+
+
+def _response(i: int) -> InteractionResponse:
+    return InteractionResponse(model_id=f"provider{i % 5}/model-{i % MODELS}", response="ответ " * 200,
+                               elapsed_time=0.5, token_count={"prompt": 10, "completion": 200, "total": 210})
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return [_key(i) for i in range(ENTRIES * 4)]
+
+
+@pytest.fixture(scope="module")
+def response():
+    return _response(0)
+
+
+def _filled(keys, response) -> ResponseCache:
+    cache = ResponseCache(ttl=3600, max_entries=ENTRIES)
+    for key in keys[:ENTRIES]:
+        cache.set(key, response)
+    return cache
+
+
+def bench_get_hit(benchmark, keys, response):
+    """5000 попаданий подряд (каждое переносит запись в конец LRU)."""
+    cache = _filled(keys, response)
+    hit_keys = keys[:ENTRIES]
+
+    def run():
+        get = cache.get
+        for key in hit_keys:
+            get(key)
+
+    benchmark(run)
+
+
+def bench_get_miss(benchmark, keys, response):
+    cache = _filled(keys, response)
+    miss_keys = keys[ENTRIES:ENTRIES * 2]
+
+    def run():
+        get = cache.get
+        for key in miss_keys:
+            get(key)
+
+    benchmark(run)
+
+
+def bench_set_with_eviction(benchmark, keys, response):
+    """5000 новых записей в заполненный кеш: каждая вытесняет самую старую."""
+    cache = _filled(keys, response)
+    batches = [keys[start:start + ENTRIES] for start in range(ENTRIES, len(keys), ENTRIES)]
+    state = {"batch": 0}
+
+    def run():
+        batch = batches[state["batch"] % len(batches)]
+        state["batch"] += 1
+        set_ = cache.set
+        for key in batch:
+            set_(key, response)
+
+    benchmark(run)
+
+
+def bench_clear_model(benchmark, keys, response):
+    """Очистка одной модели из 50 (100 записей) в кеше на 5000 записей."""
+    benchmark.pedantic(lambda cache: cache.clear("provider0/model-0"),
+                       setup=lambda: ((_filled(keys, response),), {}), rounds=50)
+
+
+def bench_clear_provider(benchmark, keys, response):
+    """Очистка провайдера (10 моделей, 1000 записей)."""
+    benchmark.pedantic(lambda cache: cache.clear("provider0"),
+                       setup=lambda: ((_filled(keys, response),), {}), rounds=50)
+
+
+def bench_clear_all(benchmark, keys, response):
+    benchmark.pedantic(lambda cache: cache.clear(),
+                       setup=lambda: ((_filled(keys, response),), {}), rounds=50)
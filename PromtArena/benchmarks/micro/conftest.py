@@ -0,0 +1,63 @@
+"""
+Окружение микробенчмарков: временная БД и ключи задаются до импорта backend
+(настройки читаются при импорте), общий цикл событий для асинхронных функций.
+
+Требуется pytest-benchmark: pip install pytest-benchmark
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent.parent
+_TMP_DIR = tempfile.mkdtemp(prefix="promptarena-micro-")
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_TMP_DIR}/bench.db",
+    "RATING_BUFFER_JOURNAL_PATH": f"{_TMP_DIR}/ratings_journal.jsonl",
+    "RESPONSE_CACHE_PERSIST": "0",
+    "MOCK_PROVIDER_ENABLED": "0",
+    "TRACING_ENABLED": "0",
+    "LOG_LEVEL": "ERROR",
+})
+if not os.environ.get("ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+os.environ.setdefault("JWT_SECRET_KEY", "bench-jwt-secret")
+sys.path.insert(0, str(PROJECT_DIR))
+
+
+def pytest_addoption(parser):
+    parser.addoption("--bench-ratings", type=int, default=1_000_000, help="синтетических оценок для лидерборда")
+    parser.addoption("--bench-models", type=int, default=10_000, help="моделей в синтетическом каталоге")
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def catalog_size(request) -> int:
+    return request.config.getoption("--bench-models")
+
+
+@pytest.fixture(scope="session")
+def ratings_count(request) -> int:
+    return request.config.getoption("--bench-ratings")
+
+
+@pytest.fixture(scope="session")
+def model_names(catalog_size):
+    """(provider, model_name) синтетического каталога: имена похожи на реальные, чтобы эвристики шли по всем веткам."""
+    providers = ("openai", "anthropic", "google", "mistral", "groq", "huggingface_hub", "openrouter", "together")
+    variants = ("gpt-4o", "gpt-3.5-turbo-16k", "claude-3-haiku", "gemini-1.5-pro-vision", "mistral-large",
+                "llama-3-70b-instruct", "deepseek-coder", "bart-large-summarization", "stable-diffusion-xl",
+                "opus-mt-translate", "text-embedding-3")
+    return [(providers[i % len(providers)], f"{variants[i % len(variants)]}-{i}") for i in range(catalog_size)]
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Локальные mock серверы API провайдеров для нагрузочных тестов без сети.
+
+Один aiohttp сервер отвечает в форматах OpenAI (/v1/models, /v1/chat/completions)
+и Anthropic (/v1/messages), включая потоковые ответы (SSE), поэтому приложение
+работает с ним через настоящие SDK: достаточно указать OPENAI_BASE_URL=http://host:port/v1
+и ANTHROPIC_BASE_URL=http://host:port.
+
+Настраиваются задержка до первого токена, скорость потока (токенов в секунду),
+длина ответа и доля ответов 429 (с заголовками retry-after, которые читают SDK
+и планировщик провайдеров).
+
+Запуск из каталога PromtArena:
+    python benchmarks/mock_providers.py --port 9100 --latency-ms 200 --tokens-per-sec 200 --rate-limit-ratio 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+OPENAI_MODELS = ("gpt-4o-mini", "gpt-4o", "gpt-3.5-turbo")
+
+_WORDS = ("арена", "модель", "ответ", "токен", "промт", "оценка", "запрос", "поток", "тест", "данные")
+
+
+class MockProviderServer:
+    """Состояние и обработчики mock сервера; счетчики запросов доступны в /stats."""
+
+    def __init__(self, latency_ms: float = 100.0, tokens_per_sec: float = 0.0, response_tokens: int = 64,
+                 rate_limit_ratio: float = 0.0, retry_after_ms: int = 50, seed: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+        self.response_tokens = response_tokens
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_ms = retry_after_ms
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+
+    # --- Общие части ---
+
+    def _should_rate_limit(self) -> bool:
+        self.requests += 1
+        if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return True
+        return False
+
+    def _rate_limit_headers(self) -> dict:
+        return {
+            "retry-after-ms": str(self.retry_after_ms),
+            "retry-after": str(max(1, round(self.retry_after_ms / 1000))),
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": f"{self.retry_after_ms}ms",
+        }
+
+    def _tokens(self, prompt: str, max_tokens) -> list:
+        count = min(self.response_tokens, max_tokens) if max_tokens else self.response_tokens
+        offset = len(prompt)
+        return [_WORDS[(offset + i) % len(_WORDS)] + " " for i in range(count)]
+
+    @staticmethod
+    def _prompt_text(messages: list) -> str:
+        parts = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list):
+                parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+            elif content:
+                parts.append(str(content))
+        return " ".join(parts)
+
+    async def _sse_response(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        return response
+
+    # --- OpenAI ---
+
+    async def openai_models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in OPENAI_MODELS],
+        })
+
+    async def openai_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if self._should_rate_limit():
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers=self._rate_limit_headers(),
+            )
+        prompt = self._prompt_text(body.get("messages", []))
+        tokens = self._tokens(prompt, body.get("max_tokens"))
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(tokens),
+                 "total_tokens": len(prompt.split()) + len(tokens)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o-mini")
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval * len(tokens))
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": usage,
+            }, headers={"x-ratelimit-remaining-requests": "1000", "x-ratelimit-remaining-tokens": "1000000"})
+
+        response = await self._sse_response(request)
+
+        async def send(choices, extra=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices}
+            if extra:
+                chunk.update(extra)
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        await send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for token in tokens:
+            await send([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], {"usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # --- Anthropic ---
+
+    async def anthropic_messages(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if self._should_rate_limit():
+            return web.json_response(
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limit reached (mock)"}},
+                status=429, headers=self._rate_limit_headers(),
+            )
+        prompt = self._prompt_text(body.get("messages", []))
+        tokens = self._tokens(prompt, body.get("max_tokens"))
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "claude-3-haiku-20240307")
+        input_tokens = len(prompt.split())
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval * len(tokens))
+            return web.json_response({
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [{"type": "text", "text": "".join(tokens)}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens)},
+            })
+
+        response = await self._sse_response(request)
+
+        async def send(event_type, data):
+            data["type"] = event_type
+            await response.write(f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+        await send("message_start", {"message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+        }})
+        await send("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+        for token in tokens:
+            await send("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": token}})
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+        await send("content_block_stop", {"index": 0})
+        await send("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                     "usage": {"output_tokens": len(tokens)}})
+        await send("message_stop", {})
+        await response.write_eof()
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "rate_limited": self.rate_limited})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.openai_models)
+        app.router.add_post("/v1/chat/completions", self.openai_chat)
+        app.router.add_post("/v1/messages", self.anthropic_messages)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_mock_server(server: MockProviderServer, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Запускает сервер в текущем цикле событий; остановка - await runner.cleanup()."""
+    runner = web.AppRunner(server.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры mock сервера (общие для этого скрипта и bench_load.py)."""
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="задержка до первого токена, мс")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="скорость генерации токенов (0 - без задержки)")
+    parser.add_argument("--response-tokens", type=int, default=64, help="токенов в ответе")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after-ms", type=int, default=50, help="значение retry-after в ответах 429, мс")
+
+
+def server_from_args(args) -> MockProviderServer:
+    return MockProviderServer(
+        latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec, response_tokens=args.response_tokens,
+        rate_limit_ratio=args.rate_limit_ratio, retry_after_ms=args.retry_after_ms,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(server_from_args(args).make_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@
 const API_BASE_URL = window.location.origin + '/api/v1';
 const MAX_CHAR_COUNT = 16000; // Максимальное число символов в промте
 const DEBOUNCE_DELAY = 300; // Задержка для debounce функций (мс)
+const MODELS_PAGE_SIZE = 100; // Сколько моделей запрашивать у сервера за раз
 const CACHE_TTL = 3600000; // Время жизни кеша (1 час в мс)
 
 // --- Глобальные переменные состояния ---
@@ -21,6 +22,9 @@ const state = {
   categories: [], // Список категорий из API
   allModels: [], // Список всех доступных моделей
   filteredModels: [], // Отфильтрованные модели (по категории/поиску)
+  modelsTotal: 0, // Сколько моделей найдено на сервере (показывается не больше MODELS_PAGE_SIZE)
+  modelSearchQuery: '', // Текущий поисковый запрос
+  modelSearchSeq: 0, // Номер последнего запроса поиска (ответы устаревших запросов отбрасываются)
   currentCategory: null, // Текущая выбранная категория
   apiKeys: {}, // Список сохраненных API ключей
   currentComparisonWinner: null, // Победитель в сравнении: 'model_1', 'model_2', 'tie'
@@ -441,6 +445,9 @@ function setupEventListeners() {
   dom.winnerModel1Btn.addEventListener('click', () => {
     state.currentComparisonWinner = 'model_1';
     updateWinnerButtons('model_1');
+    if (state.selectedModel1 && state.selectedModel2) {
+      submitComparisonVote(state.selectedModel1.id, state.selectedModel2.id, state.currentPrompt, 'model_1');
+    }
     
     // Автоматически отправляем оценки, если были проставлены звезды
     if (state.currentRatings.model1 > 0) {
@@ -455,6 +462,9 @@ function setupEventListeners() {
   dom.winnerModel2Btn.addEventListener('click', () => {
     state.currentComparisonWinner = 'model_2';
     updateWinnerButtons('model_2');
+    if (state.selectedModel1 && state.selectedModel2) {
+      submitComparisonVote(state.selectedModel1.id, state.selectedModel2.id, state.currentPrompt, 'model_2');
+    }
     
     // Автоматически отправляем оценки, если были проставлены звезды
     if (state.currentRatings.model1 > 0) {
@@ -469,6 +479,9 @@ function setupEventListeners() {
   dom.winnerTieBtn.addEventListener('click', () => {
     state.currentComparisonWinner = 'tie';
     updateWinnerButtons('tie');
+    if (state.selectedModel1 && state.selectedModel2) {
+      submitComparisonVote(state.selectedModel1.id, state.selectedModel2.id, state.currentPrompt, 'tie');
+    }
     
     // Автоматически отправляем оценки, если были проставлены звезды
     if (state.currentRatings.model1 > 0) {
@@ -680,19 +693,19 @@ async function fetchModels(categoryId = null) {
   try {
     state.isLoadingModels = true;
     
-    let url = '/models';
-    if (categoryId) {
-      url += `?category=${encodeURIComponent(categoryId)}`;
-    }
-    
-    const data = await fetchApi(url);
-    state.allModels = data;
-    state.filteredModels = data;
-    renderModels(data);
-    console.log('Модели загружены:', data.length);
+    // Поиск и фильтрация выполняются на сервере, загружается только первая страница
+    state.modelSearchSeq++;
+    const data = await fetchApi(buildModelSearchUrl(state.modelSearchQuery, categoryId));
+    const models = data.items;
+    state.allModels = models;
+    state.filteredModels = models;
+    state.modelsTotal = data.total;
+    state.isLoadingModels = false;
+    renderModels(models);
+    console.log('Модели загружены:', models.length, 'из', data.total);
     
     // Проверяем, есть ли модели, если нет - подсказываем добавить ключи
-    if (data.length === 0) {
+    if (data.total === 0 && !state.modelSearchQuery) {
       const keysExist = Object.keys(state.apiKeys).length > 0;
       if (!keysExist) {
         showNotification('Добавьте API ключи, чтобы загрузить доступные модели', 'info', 5000);
@@ -707,8 +720,7 @@ async function fetchModels(categoryId = null) {
     // Включаем кнопку отправки, если есть хотя бы одна выбранная модель
     dom.sendButton.disabled = !(state.selectedModel1 || state.selectedModel2);
     
-    state.isLoadingModels = false;
-    return data;
+    return models;
   } catch (error) {
     state.isLoadingModels = false;
     console.error('Ошибка при загрузке моделей:', error);
@@ -887,6 +899,90 @@ async function sendComparisonPrompt(modelId1, modelId2, prompt, params = {}) {
   }
 }
 
+/**
+ * Выполняет POST-запрос к потоковому (SSE) эндпоинту и вызывает обработчик для каждого события
+ * @param {string} url - путь к эндпоинту API
+ * @param {object} body - тело запроса
+ * @param {function} onEvent - обработчик события (получает распарсенный объект data)
+ */
+async function streamApi(url, body, onEvent) {
+  const headers = {
+    'Content-Type': 'application/json',
+    'Accept': 'text/event-stream'
+  };
+  const basicAuth = localStorage.getItem('basic_auth');
+  if (basicAuth) {
+    headers['Authorization'] = basicAuth;
+  }
+
+  const response = await fetch(`${API_BASE_URL}${url}`, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify(body)
+  });
+
+  if (!response.ok || !response.body) {
+    let detail = `HTTP ${response.status}`;
+    try {
+      detail = (await response.json()).detail || detail;
+    } catch (e) { /* тело ответа не JSON */ }
+    throw new Error(detail);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // События SSE разделяются пустой строкой
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const dataLines = rawEvent.split('\n')
+        .filter(line => line.startsWith('data:'))
+        .map(line => line.slice(5).trim());
+      if (dataLines.length) {
+        onEvent(JSON.parse(dataLines.join('\n')));
+      }
+    }
+  }
+}
+
+/**
+ * Отправляет промт одной модели в потоковом режиме
+ * @param {string} modelId - ID модели
+ * @param {string} prompt - Текст промта
+ * @param {object} params - Дополнительные параметры (max_tokens, temperature)
+ * @param {function} onEvent - обработчик событий 'delta' и 'done'
+ */
+async function streamPromptToModel(modelId, prompt, params, onEvent) {
+  return streamApi('/interact/stream', { model_id: modelId, prompt: prompt, ...params }, onEvent);
+}
+
+/**
+ * Потоковое сравнение двух моделей. События содержат поле slot ('model_1' или 'model_2')
+ * @param {string} modelId1 - ID первой модели
+ * @param {string} modelId2 - ID второй модели
+ * @param {string} prompt - Текст промта
+ * @param {function} onEvent - обработчик событий
+ */
+async function streamComparisonPrompt(modelId1, modelId2, prompt, onEvent) {
+  return streamApi('/interactions/compare/stream', {
+    model_id_1: modelId1,
+    model_id_2: modelId2,
+    prompt: prompt,
+    max_tokens: state.model1Settings.maxTokens,
+    temperature: state.model1Settings.temperature,
+    system_prompt_1: state.model1Settings.systemPrompt || null,
+    system_prompt_2: state.model2Settings.systemPrompt || null
+  }, onEvent);
+}
+
 /**
  * Отправляет оценку модели
  * @param {string} modelId - ID модели
@@ -922,6 +1018,35 @@ async function submitRating(modelId, promptText, rating, comparisonWinner = null
   }
 }
 
+/**
+ * Отправляет результат попарного сравнения (обновляет рейтинг Эло обеих моделей)
+ * @param {string} modelId1 - ID первой модели
+ * @param {string} modelId2 - ID второй модели
+ * @param {string} promptText - Текст промта
+ * @param {string} winner - Победитель ('model_1', 'model_2', 'tie')
+ */
+async function submitComparisonVote(modelId1, modelId2, promptText, winner) {
+  if (!modelId1 || !modelId2 || modelId1 === modelId2) {
+    return null;
+  }
+  try {
+    return await fetchApi('/rate/comparison', {
+      method: 'POST',
+      body: {
+        model_id_1: modelId1,
+        model_id_2: modelId2,
+        winner: winner,
+        prompt_text: promptText,
+        user_identifier: getUserIdentifier()
+      }
+    });
+  } catch (error) {
+    console.error('Ошибка при сохранении результата сравнения:', error);
+    showNotification(`Ошибка сохранения результата сравнения: ${error.message || 'Неизвестная ошибка'}`, 'error');
+    return null;
+  }
+}
+
 /**
  * Получает идентификатор пользователя или сессии
  * Для анонимных пользователей генерирует и сохраняет в localStorage
@@ -1112,6 +1237,14 @@ function renderModels(modelsList) {
     
     dom.modelsContainer.appendChild(modelItem);
   });
+
+  // Сервер возвращает только первую страницу результатов
+  if (state.modelsTotal > modelsList.length) {
+    const moreHint = document.createElement('div');
+    moreHint.className = 'text-center text-sm text-gray-500 my-2';
+    moreHint.textContent = `Показано ${modelsList.length} из ${state.modelsTotal}. Уточните поиск, чтобы найти остальные модели.`;
+    dom.modelsContainer.appendChild(moreHint);
+  }
 }
 
 /**
@@ -1128,22 +1261,42 @@ function formatCategoryName(categoryId) {
 }
 
 /**
- * Фильтрует список моделей по поисковому запросу
+ * Формирует URL поиска по каталогу моделей
  * @param {string} query - поисковый запрос
+ * @param {string} categoryId - ID категории (опционально)
  */
-function filterModels(query) {
-  if (!query) {
-    state.filteredModels = [...state.allModels];
-  } else {
-    const lowerQuery = query.toLowerCase();
-    state.filteredModels = state.allModels.filter(model => {
-      return model.name.toLowerCase().includes(lowerQuery) || 
-             model.provider.toLowerCase().includes(lowerQuery) || 
-             (model.category && model.category.toLowerCase().includes(lowerQuery));
-    });
+function buildModelSearchUrl(query, categoryId) {
+  const params = new URLSearchParams({ limit: MODELS_PAGE_SIZE });
+  if (query) {
+    params.set('q', query);
+  }
+  if (categoryId) {
+    params.set('category', categoryId);
+  }
+  return `/models/search?${params}`;
+}
+
+/**
+ * Ищет модели по запросу на сервере (индекс каталога) и показывает первую страницу.
+ * Повторный запрос с тем же условием браузер проверяет по ETag без загрузки тела ответа.
+ * @param {string} query - поисковый запрос
+ */
+async function filterModels(query) {
+  state.modelSearchQuery = query.trim();
+  const requestSeq = ++state.modelSearchSeq;
+  try {
+    const data = await fetchApi(buildModelSearchUrl(state.modelSearchQuery, state.currentCategory));
+    // Пока шел запрос, пользователь мог изменить условие поиска
+    if (requestSeq !== state.modelSearchSeq) {
+      return;
+    }
+    state.filteredModels = data.items;
+    state.modelsTotal = data.total;
+    renderModels(state.filteredModels);
+  } catch (error) {
+    console.error('Ошибка при поиске моделей:', error);
+    showNotification('Не удалось выполнить поиск моделей', 'error');
   }
-  
-  renderModels(state.filteredModels);
 }
 
 /**
@@ -1201,13 +1354,88 @@ function renderUserMessage(message, targetAreaId) {
   messageContainer.scrollTop = messageContainer.scrollHeight;
 }
 
+/**
+ * Преобразует Markdown-ответ модели в HTML и добавляет обработчики для блоков кода
+ * @param {HTMLElement} contentEl - элемент, в который выводится ответ
+ * @param {string} message - текст ответа
+ */
+function renderMarkdownContent(contentEl, message) {
+  // Используем marked.js для преобразования Markdown
+  try {
+    // Добавляем заголовок с кнопкой копирования для блоков кода
+    const markedOptions = {
+      highlight: (code, language) => {
+        return `<div class="code-header">
+                 <span class="code-language">${language || 'Код'}</span>
+                 <div class="code-actions">
+                   <button class="code-action-btn copy-code">Копировать</button>
+                   <button class="code-action-btn run-code">Запустить</button>
+                 </div>
+               </div>
+               <pre><code class="language-${language || 'text'}">${escapeHtml(code)}</code></pre>`;
+      }
+    };
+    
+    // Используем DOMPurify для безопасного HTML
+    contentEl.innerHTML = DOMPurify.sanitize(
+      marked.parse(message, markedOptions)
+    );
+    
+    // Добавляем обработчики для кнопок кода
+    contentEl.querySelectorAll('.copy-code').forEach(btn => {
+      btn.addEventListener('click', (e) => {
+        const codeBlock = e.target.closest('.code-header').nextElementSibling;
+        if (codeBlock) {
+          const code = codeBlock.textContent;
+          navigator.clipboard.writeText(code);
+          btn.textContent = 'Скопировано!';
+          setTimeout(() => { btn.textContent = 'Копировать'; }, 2000);
+        }
+      });
+    });
+    
+    contentEl.querySelectorAll('.run-code').forEach(btn => {
+      btn.addEventListener('click', (e) => {
+        const codeHeader = e.target.closest('.code-header');
+        const language = codeHeader.querySelector('.code-language').textContent.toLowerCase();
+        const codeBlock = codeHeader.nextElementSibling;
+        
+        if (codeBlock) {
+          const code = codeBlock.textContent;
+          openOutputPanel(code, language);
+        }
+      });
+    });
+  } catch (e) {
+    console.error('Ошибка при обработке Markdown:', e);
+    contentEl.textContent = message;
+  }
+}
+
+/**
+ * Формирует HTML сообщения об ошибке
+ * @param {string} message - текст ошибки
+ */
+function errorMessageHtml(message) {
+  return `
+      <div class="text-red-500">
+        <svg xmlns="http://www.w3.org/2000/svg" class="h-5 w-5 inline-block mr-1" viewBox="0 0 20 20" fill="currentColor">
+          <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16" />
+        </svg>
+        <strong>Ошибка:</strong> ${escapeHtml(message)}
+      </div>
+    `;
+}
+
 /**
  * Отображает сообщение от модели в чате
  * @param {string} message - текст сообщения
  * @param {string} targetAreaId - ID контейнера для отображения
  * @param {boolean} isError - является ли сообщение ошибкой
+ * @param {object} options - { streaming: true } - сообщение будет дополняться по мере генерации
+ * @returns {HTMLElement} - созданный элемент сообщения
  */
-function renderModelMessage(message, targetAreaId, isError = false) {
+function renderModelMessage(message, targetAreaId, isError = false, options = {}) {
   const messageContainer = document.getElementById(targetAreaId);
   
   // Если первое сообщение, удаляем placeholder
@@ -1218,68 +1446,17 @@ function renderModelMessage(message, targetAreaId, isError = false) {
   
   // Клонируем шаблон сообщения
   const messageEl = dom.templates.aiMessage.content.cloneNode(true).querySelector('.chat-message');
+  const contentEl = messageEl.querySelector('.message-content');
   
   if (isError) {
     messageEl.classList.add('error-message');
-    messageEl.querySelector('.message-content').innerHTML = `
-      <div class="text-red-500">
-        <svg xmlns="http://www.w3.org/2000/svg" class="h-5 w-5 inline-block mr-1" viewBox="0 0 20 20" fill="currentColor">
-          <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16" />
-        </svg>
-        <strong>Ошибка:</strong> ${escapeHtml(message)}
-      </div>
-    `;
+    contentEl.innerHTML = errorMessageHtml(message);
+  } else if (options.streaming) {
+    // Во время генерации выводим простой текст: Markdown рендерится один раз в конце
+    messageEl.classList.add('streaming-message');
+    contentEl.textContent = message;
   } else {
-    // Используем marked.js для преобразования Markdown
-    try {
-      // Добавляем заголовок с кнопкой копирования для блоков кода
-      const markedOptions = {
-        highlight: (code, language) => {
-          return `<div class="code-header">
-                   <span class="code-language">${language || 'Код'}</span>
-                   <div class="code-actions">
-                     <button class="code-action-btn copy-code">Копировать</button>
-                     <button class="code-action-btn run-code">Запустить</button>
-                   </div>
-                 </div>
-                 <pre><code class="language-${language || 'text'}">${escapeHtml(code)}</code></pre>`;
-        }
-      };
-      
-      // Используем DOMPurify для безопасного HTML
-      messageEl.querySelector('.message-content').innerHTML = DOMPurify.sanitize(
-        marked.parse(message, markedOptions)
-      );
-      
-      // Добавляем обработчики для кнопок кода
-      messageEl.querySelectorAll('.copy-code').forEach(btn => {
-        btn.addEventListener('click', (e) => {
-          const codeBlock = e.target.closest('.code-header').nextElementSibling;
-          if (codeBlock) {
-            const code = codeBlock.textContent;
-            navigator.clipboard.writeText(code);
-            btn.textContent = 'Скопировано!';
-            setTimeout(() => { btn.textContent = 'Копировать'; }, 2000);
-          }
-        });
-      });
-      
-      messageEl.querySelectorAll('.run-code').forEach(btn => {
-        btn.addEventListener('click', () => {
-          const codeHeader = e.target.closest('.code-header');
-          const language = codeHeader.querySelector('.code-language').textContent.toLowerCase();
-          const codeBlock = codeHeader.nextElementSibling;
-          
-          if (codeBlock) {
-            const code = codeBlock.textContent;
-            openOutputPanel(code, language);
-          }
-        });
-      });
-    } catch (e) {
-      console.error('Ошибка при обработке Markdown:', e);
-      messageEl.querySelector('.message-content').textContent = message;
-    }
+    renderMarkdownContent(contentEl, message);
   }
   
   // Устанавливаем временную метку
@@ -1296,6 +1473,48 @@ function renderModelMessage(message, targetAreaId, isError = false) {
       messageContainer.removeChild(messages[i]);
     }
   }
+
+  return messageEl;
+}
+
+/**
+ * Обновляет текст сообщения, которое генерируется в потоковом режиме
+ * @param {HTMLElement} messageEl - элемент сообщения
+ * @param {string} text - накопленный текст ответа
+ */
+function updateStreamingMessage(messageEl, text) {
+  messageEl.querySelector('.message-content').textContent = text;
+  const container = messageEl.parentElement;
+  if (container) {
+    container.scrollTop = container.scrollHeight;
+  }
+}
+
+/**
+ * Завершает потоковое сообщение: рендерит Markdown и показывает время до первого токена и общее время
+ * @param {HTMLElement} messageEl - элемент сообщения
+ * @param {string} text - полный текст ответа
+ * @param {object} doneEvent - завершающее событие потока (ttft, elapsed_time, error)
+ */
+function finalizeStreamingMessage(messageEl, text, doneEvent) {
+  const contentEl = messageEl.querySelector('.message-content');
+  messageEl.classList.remove('streaming-message');
+
+  if (doneEvent.error) {
+    messageEl.classList.add('error-message');
+    contentEl.innerHTML = errorMessageHtml(doneEvent.error);
+    return;
+  }
+
+  renderMarkdownContent(contentEl, text);
+
+  if (doneEvent.elapsed_time) {
+    const infoEl = document.createElement('div');
+    infoEl.className = 'message-info';
+    const ttft = doneEvent.ttft != null ? `Первый токен: ${doneEvent.ttft.toFixed(2)} сек. · ` : '';
+    infoEl.textContent = `${ttft}Время генерации: ${doneEvent.elapsed_time.toFixed(2)} сек.`;
+    contentEl.appendChild(infoEl);
+  }
 }
 
 /**
@@ -1512,13 +1731,10 @@ function renderLeaderboard(leaderboardEntries) {
       hideModal(dom.leaderboardModal);
       
       // Находим полную информацию о модели
-      const modelInfo = state.allModels.find(m => m.id === entry.model_id);
-      if (modelInfo) {
-        // Выбираем модель
-        handleModelSelect(modelInfo);
-      } else {
-        showNotification('Модель временно недоступна', 'error');
-      }
+      // Модель может не входить в загруженную страницу каталога
+      const modelInfo = state.allModels.find(m => m.id === entry.model_id)
+        || { id: entry.model_id, name: entry.name, provider: entry.provider, category: entry.category };
+      handleModelSelect(modelInfo);
     });
     
     actionsCell.appendChild(selectBtn);
@@ -1646,6 +1862,43 @@ async function handleSendPrompt() {
   }
 }
 
+/**
+ * Обрабатывает отправку промта в режиме одной модели (ответ выводится по мере генерации)
+ * @param {string} prompt - Текст промта
+ */
+async function handleSingleModeSubmit(prompt) {
+  if (!state.selectedModel1) {
+    showNotification('Сначала выберите модель', 'warning');
+    return;
+  }
+
+  state.isLoadingResponse = true;
+  renderUserMessage(prompt, 'chat-messages-single');
+  const messageEl = renderModelMessage('', 'chat-messages-single', false, { streaming: true });
+  let text = '';
+
+  try {
+    const params = {
+      max_tokens: parseInt(dom.maxTokensInput.value, 10) || null,
+      temperature: parseFloat(dom.temperatureInput.value)
+    };
+
+    await streamPromptToModel(state.selectedModel1.id, prompt, params, (event) => {
+      if (event.event === 'delta') {
+        text += event.text;
+        updateStreamingMessage(messageEl, text);
+      } else if (event.event === 'done') {
+        finalizeStreamingMessage(messageEl, text, event);
+      }
+    });
+  } catch (error) {
+    console.error(`Ошибка при отправке промта к модели ${state.selectedModel1.id}:`, error);
+    finalizeStreamingMessage(messageEl, text, { error: error.message || 'Неизвестная ошибка при обращении к API' });
+  } finally {
+    state.isLoadingResponse = false;
+  }
+}
+
 /**
  * Обрабатывает отправку промта и обновляет интерфейс в режиме сравнения
  * @param {string} prompt - Текст промта 
@@ -1669,20 +1922,28 @@ async function handleComparisonSubmit(prompt) {
   const msg2El = createLoadingMessageForComparison(2);
   
   try {
-    const params = {
-      max_tokens: dom.maxTokensInput.value,
-      temperature: dom.temperatureInput.value
+    // Ответы обеих моделей выводятся по мере генерации, независимо друг от друга
+    const slots = {
+      model_1: { el: msg1El, text: '', done: null },
+      model_2: { el: msg2El, text: '', done: null }
     };
     
-    const result = await sendComparisonPrompt(
-      state.selectedModel1.id, 
-      state.selectedModel2.id, 
-      prompt, 
-      params
-    );
+    await streamComparisonPrompt(state.selectedModel1.id, state.selectedModel2.id, prompt, (event) => {
+      const slot = slots[event.slot];
+      if (!slot) return;
+      if (event.event === 'delta') {
+        slot.text += event.text;
+        updateStreamingMessage(slot.el, slot.text);
+      } else if (event.event === 'done') {
+        slot.done = event;
+        finalizeStreamingMessage(slot.el, slot.text, event);
+      }
+    });
     
-    // Обновляем интерфейс с результатами
-    updateComparisonUIWithResponse(result, msg1El, msg2El);
+    // Голосование доступно, только если обе модели ответили без ошибок
+    if (slots.model_1.done && slots.model_2.done && !slots.model_1.done.error && !slots.model_2.done.error) {
+      enableComparisonVoting();
+    }
     
     // Сохраняем промт для возможной оценки
     state.currentPrompt = prompt;
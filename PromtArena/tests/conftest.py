@@ -0,0 +1,27 @@
+"""
+Окружение тестов: временная БД и ключи задаются до импорта backend (настройки
+читаются при импорте). Запуск из каталога PromtArena: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+_TMP_DIR = tempfile.mkdtemp(prefix="promptarena-tests-")
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_TMP_DIR}/test.db",
+    "RATING_BUFFER_JOURNAL_PATH": f"{_TMP_DIR}/ratings_journal.jsonl",
+    "RESPONSE_CACHE_PERSIST": "0",
+    "MOCK_PROVIDER_ENABLED": "1",
+    "MOCK_PROVIDER_LATENCY_MS": "5",
+    "TRACING_ENABLED": "0",
+    "LOG_LEVEL": "ERROR",
+})
+if not os.environ.get("ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+os.environ.setdefault("JWT_SECRET_KEY", "test-jwt-secret")
+sys.path.insert(0, str(PROJECT_DIR))
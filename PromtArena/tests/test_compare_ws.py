@@ -0,0 +1,36 @@
+"""Ошибочные кадры WebSocket-сравнения не закрывают соединение."""
+
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.config import settings
+from backend.main import app
+
+AUTH_HEADER = "Basic " + base64.b64encode(f"admin:{settings.auth_password}".encode()).decode()
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.mark.parametrize("send", [
+    lambda ws: ws.send_text("не json"),
+    lambda ws: ws.send_bytes(b"\x00\x01"),
+    lambda ws: ws.send_json([1, 2]),
+    lambda ws: ws.send_json("строка"),
+    lambda ws: ws.send_json({"prompt": "без моделей"}),
+])
+def test_invalid_frame_gets_error_event(client, send):
+    with client.websocket_connect("/api/v1/interactions/compare/ws", headers={"Authorization": AUTH_HEADER}) as ws:
+        send(ws)
+        assert ws.receive_json()["event"] == "error"
+        # Соединение остается рабочим для следующего сравнения
+        ws.send_json({"model_id_1": "mock/echo", "model_id_2": "mock/lorem", "prompt": "привет"})
+        events = []
+        while not events or events[-1]["event"] != "done":
+            events.append(ws.receive_json())
+        assert not [event for event in events if event["event"] == "error"]
@@ -0,0 +1,45 @@
+"""Смешанная конкурентная нагрузка не должна исчерпывать пулы соединений SQLite."""
+
+import asyncio
+import time
+
+import httpx
+
+from backend.config import settings
+from backend.main import app
+
+REQUESTS = 300
+AUTH = ("admin", settings.auth_password)
+
+
+async def _run_mix() -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", auth=AUTH, timeout=60) as client:
+            async def request(i: int) -> int:
+                # Свой IP на каждый запрос: ограничение частоты здесь не проверяется
+                headers = {"X-Forwarded-For": f"10.0.{i // 256}.{i % 256}"}
+                kind = i % 3
+                if kind == 0:
+                    response = await client.post("/api/v1/rate", headers=headers, json={
+                        "model_id": f"mock/model-{i % 7}", "prompt_text": f"prompt {i}", "rating": 1 + i % 10,
+                    })
+                elif kind == 1:
+                    response = await client.get("/api/v1/leaderboard", headers=headers)
+                else:
+                    response = await client.post("/api/v1/keys", headers=headers, json={
+                        "provider": "openai", "api_key": f"sk-test-{i}",
+                    })
+                return response.status_code
+
+            started = time.perf_counter()
+            statuses = await asyncio.gather(*(request(i) for i in range(REQUESTS)))
+            return statuses, time.perf_counter() - started
+
+
+def test_mixed_rate_leaderboard_keys_traffic():
+    statuses, elapsed = asyncio.run(_run_mix())
+    server_errors = [status for status in statuses if status >= 500]
+    assert not server_errors, f"{len(server_errors)} ответов 5xx из {REQUESTS}"
+    # Ожидание пула (pool_timeout 30 с) - признак взаимной блокировки
+    assert elapsed < settings.sqlite_write_queue_timeout
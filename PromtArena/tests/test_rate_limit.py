@@ -0,0 +1,36 @@
+"""Выбор правила ограничения частоты для путей API."""
+
+import pytest
+
+from backend.main import RateLimitMiddleware
+
+
+async def _noop_app(scope, receive, send):
+    pass
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return RateLimitMiddleware(_noop_app).matcher
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("POST", "/api/v1/token", "token"),
+    ("POST", "/api/v1/interact", "interact"),
+    ("POST", "/api/v1/interact/stream", "interact"),
+    ("POST", "/api/v1/interactions/compare", "compare"),
+    ("POST", "/api/v1/interactions/compare/stream", "compare"),
+    ("POST", "/api/v1/interactions/multi", "compare"),
+    ("GET", "/api/v1/interactions/compare/ws", "compare"),
+    ("POST", "/api/v1/rate", "POST"),
+    ("DELETE", "/api/v1/keys/openai", "DELETE"),
+    ("GET", "/api/v1/leaderboard", "default"),
+])
+def test_rule_for_path(matcher, method, path, expected):
+    assert matcher.match(method, path).name == expected
+
+
+def test_interact_paths_share_counter(matcher):
+    # Одинаковое имя - общий ключ счетчика для /interact и /interact/stream
+    assert matcher.match("POST", "/api/v1/interact").shared
+    assert matcher.match("POST", "/api/v1/interact/stream").shared